@@ -0,0 +1,301 @@
+import json
+import time
+from pathlib import Path
+from datetime import datetime, UTC
+from openai.types.chat import ChatCompletion
+
+import engine
+import llm
+from db import (
+    get_session, vec_connection, BatchJob, find_processed_hashes, record_processed_hashes, save_observations
+)
+from llm import plan_chunks, observe_request, segment_timestamps, parse_observations
+from loaders import group_messages_by_week, message_hash, filter_new_messages
+from summarize import (
+    assign_pending_observations, plan_tier0_tasks, save_tier0_summaries, summarize_tier0_tasks,
+    summarize_chunk_request, chunk_observations
+)
+from usage import record_call
+from embeddings import (
+    EMBEDDING_MODEL, batch_by_tokens, init_memory_vec, store_embeddings
+)
+
+BATCH_DIR = 'batches'
+BATCH_POLL_INTERVAL = 30
+COMPLETION_WINDOW = '24h'
+MAX_REQUESTS_PER_BATCH = 50000
+MAX_EMBEDDING_INPUTS_PER_BATCH = 50000
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+CHAT_ENDPOINT = '/v1/chat/completions'
+EMBEDDINGS_ENDPOINT = '/v1/embeddings'
+
+
+def get_batch_dir(db_path):
+    return Path(db_path).parent / BATCH_DIR
+
+
+def split_requests(requests, weight=lambda body: 1, limit=MAX_REQUESTS_PER_BATCH):
+    groups = []
+    current = []
+    current_weight = 0
+    for custom_id, body in requests:
+        w = weight(body)
+        if current and (len(current) >= MAX_REQUESTS_PER_BATCH or current_weight + w > limit):
+            groups.append(current)
+            current = []
+            current_weight = 0
+        current.append((custom_id, body))
+        current_weight += w
+    if current:
+        groups.append(current)
+    return groups
+
+
+def write_batch_file(path, endpoint, requests):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        for custom_id, body in requests:
+            f.write(json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': endpoint, 'body': body}) + '\n')
+    return path
+
+
+async def _upload_and_create(path, endpoint):
+    with open(path, 'rb') as f:
+        uploaded = await llm.get_client().files.create(file=(path.name, f.read()), purpose='batch')
+    return await llm.get_client().batches.create(
+        input_file_id=uploaded.id,
+        endpoint=endpoint,
+        completion_window=COMPLETION_WINDOW
+    )
+
+
+def submit_batch(session, stage, endpoint, requests, context, batch_dir):
+    stamp = datetime.now(UTC).strftime('%Y%m%dT%H%M%S%f')
+    path = write_batch_file(Path(batch_dir) / f'{stage}-{stamp}.jsonl', endpoint, requests)
+    created = engine.run(_upload_and_create(path, endpoint))
+    job = BatchJob(
+        stage=stage,
+        batch_id=created.id,
+        input_file_id=created.input_file_id,
+        status=created.status,
+        request_count=len(requests),
+        context=json.dumps(context, default=str),
+    )
+    session.add(job)
+    session.commit()
+    return job
+
+
+def pending_jobs(session, stage):
+    return session.query(BatchJob).filter(
+        BatchJob.stage == stage,
+        BatchJob.applied == False
+    ).order_by(BatchJob.id).all()
+
+
+def wait_for_batch(session, job, poll_interval=BATCH_POLL_INTERVAL, on_progress=None):
+    while True:
+        remote = engine.run(llm.get_client().batches.retrieve(job.batch_id))
+        if remote.status != job.status and on_progress:
+            counts = remote.request_counts
+            done = f" ({counts.completed}/{counts.total})" if counts else ''
+            on_progress(f"  Batch {job.batch_id} [{job.stage}]: {remote.status}{done}")
+        job.status = remote.status
+        job.output_file_id = remote.output_file_id
+        job.error_file_id = remote.error_file_id
+        session.commit()
+        if remote.status in TERMINAL_STATUSES:
+            return job
+        time.sleep(poll_interval)
+
+
+def fetch_results(job):
+    results = {}
+    if not job.output_file_id:
+        return results
+    content = engine.run(llm.get_client().files.content(job.output_file_id))
+    for line in content.text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get('response') or {}
+        if record.get('error') or response.get('status_code') != 200:
+            continue
+        results[record['custom_id']] = response['body']
+    return results
+
+
+def finish_job(session, job, apply, poll_interval=BATCH_POLL_INTERVAL, on_progress=None):
+    wait_for_batch(session, job, poll_interval, on_progress)
+    results = fetch_results(job)
+    context = json.loads(job.context)
+    applied = apply(results, context)
+    failed = job.request_count - len(results)
+    job.applied = True
+    job.completed_at = datetime.now(UTC)
+    session.commit()
+    if on_progress:
+        note = f", {failed} failed and will be retried on the next run" if failed else ''
+        on_progress(f"  Applied {len(results)}/{job.request_count} results from {job.batch_id}{note}")
+    return applied
+
+
+def resume_stage(session, stage, apply, poll_interval=BATCH_POLL_INTERVAL, on_progress=None):
+    jobs = pending_jobs(session, stage)
+    if jobs and on_progress:
+        on_progress(f"Resuming {len(jobs)} pending {stage} batch job(s)...")
+    return sum(finish_job(session, job, apply, poll_interval, on_progress) for job in jobs)
+
+
+def run_stage(session, stage, endpoint, requests, context, apply, batch_dir,
+              poll_interval=BATCH_POLL_INTERVAL, on_progress=None, weight=None, limit=MAX_REQUESTS_PER_BATCH):
+    if not requests:
+        return 0
+    groups = split_requests(requests, weight or (lambda body: 1), limit)
+    jobs = []
+    for group in groups:
+        group_context = {custom_id: context[custom_id] for custom_id, _ in group}
+        jobs.append(submit_batch(session, stage, endpoint, group, group_context, batch_dir))
+    if on_progress:
+        on_progress(f"Submitted {len(requests)} {stage} requests in {len(jobs)} batch job(s)")
+    return sum(finish_job(session, job, apply, poll_interval, on_progress) for job in jobs)
+
+
+def import_messages_batch(session, messages, batch_dir, poll_interval=BATCH_POLL_INTERVAL, on_progress=None):
+    def apply(results, context):
+        total = 0
+        for custom_id in sorted(results, key=lambda c: context[c]['order']):
+            ctx = context[custom_id]
+            response = ChatCompletion.model_validate(results[custom_id])
+            record_call('extract', response.model, 'batch', response.usage)
+            observations = parse_observations(response, ctx['timestamps'])
+            save_observations(session, observations)
+            record_processed_hashes(session, ctx['hashes'])
+            session.commit()
+            total += len(observations)
+        return total
+
+    total = resume_stage(session, 'extract', apply, poll_interval, on_progress)
+
+    known = find_processed_hashes(session, (message_hash(m) for m in messages))
+    new_messages = filter_new_messages(messages, known)
+    skipped = len(messages) - len(new_messages)
+    if skipped and on_progress:
+        on_progress(f"Skipping {skipped} already-processed messages")
+    plan = plan_chunks(group_messages_by_week(new_messages))
+
+    requests = []
+    context = {}
+    for i, entry in enumerate(plan):
+        custom_id = f'chunk-{i}'
+        requests.append((custom_id, observe_request(entry['segments'])))
+        context[custom_id] = {
+            'order': i,
+            'timestamps': segment_timestamps(entry['segments']),
+            'hashes': [message_hash(m) for _, chunk in entry['segments'] for m in chunk],
+        }
+
+    total += run_stage(session, 'extract', CHAT_ENDPOINT, requests, context, apply, batch_dir, poll_interval, on_progress)
+    return total
+
+
+def run_tier0_batch(db_path, poll_interval=BATCH_POLL_INTERVAL, on_progress=None, max_workers=10, max_obs=None):
+    session = get_session(db_path)
+    batch_dir = get_batch_dir(db_path)
+
+    def apply(results, context):
+        # Results are matched to their windows by custom_id. Saving a window
+        # moves its model's tier-0 watermark past it, so a failed window must
+        # stop that model's later windows from landing until it is retried.
+        rows = []
+        blocked = set()
+        for custom_id in sorted(context, key=lambda c: context[c]['order']):
+            ctx = context[custom_id]
+            if ctx['model_id'] in blocked:
+                continue
+            if custom_id not in results:
+                blocked.add(ctx['model_id'])
+                continue
+            response = ChatCompletion.model_validate(results[custom_id])
+            record_call('summarize', response.model, 'batch', response.usage)
+            text = response.choices[0].message.content
+            rows.append((
+                ctx['model_id'], text,
+                datetime.fromisoformat(ctx['start']), datetime.fromisoformat(ctx['end']),
+                ctx['obs_ids']
+            ))
+        return save_tier0_summaries(session, rows)
+
+    created = resume_stage(session, 'tier0', apply, poll_interval, on_progress)
+
+    assign_pending_observations(session, on_progress, max_obs, max_workers=max_workers)
+    tasks = plan_tier0_tasks(session)
+
+    # Windows too large for one request need a multi-step combine, so the
+    # whole model goes interactive to keep its windows landing in order.
+    oversized = {t[0] for t in tasks if len(chunk_observations(t[3])) > 1}
+    batchable = [t for t in tasks if t[0] not in oversized]
+    overflow = [t for t in tasks if t[0] in oversized]
+
+    if overflow:
+        if on_progress:
+            on_progress(f"Summarizing {len(overflow)} oversized tier-0 windows interactively...")
+        created += save_tier0_summaries(session, summarize_tier0_tasks(overflow, on_progress, max_workers))
+
+    requests = []
+    context = {}
+    for i, (model_id, model_name, model_desc, obs_chunk, start_ts, end_ts) in enumerate(batchable):
+        custom_id = f'tier0-{i}'
+        requests.append((custom_id, summarize_chunk_request(obs_chunk, model_name, model_desc or '')))
+        context[custom_id] = {
+            'order': i,
+            'model_id': model_id,
+            'start': start_ts.isoformat(),
+            'end': end_ts.isoformat(),
+            'obs_ids': [o.id for o in obs_chunk],
+        }
+
+    created += run_stage(session, 'tier0', CHAT_ENDPOINT, requests, context, apply, batch_dir, poll_interval, on_progress)
+    session.close()
+    return created
+
+
+def embed_new_items_batch(db_path, poll_interval=BATCH_POLL_INTERVAL, on_progress=None):
+    from sync import iter_items_to_embed
+
+    session = get_session(db_path)
+    conn = vec_connection(db_path)
+    init_memory_vec(conn)
+    batch_dir = get_batch_dir(db_path)
+
+    def apply(results, context):
+        stored = 0
+        for custom_id, body in results.items():
+            items = [(source_type, source_id, None) for source_type, source_id in context[custom_id]]
+            embeddings = [d['embedding'] for d in sorted(body['data'], key=lambda d: d['index'])]
+            record_call('embed', body.get('model', EMBEDDING_MODEL), 'batch', body.get('usage'))
+            store_embeddings(conn, items, embeddings)
+            stored += len(items)
+        return stored
+
+    embedded = resume_stage(session, 'embed', apply, poll_interval, on_progress)
+
+    to_embed = [item for page in iter_items_to_embed(conn) for item in page]
+    requests = []
+    context = {}
+    offset = 0
+    for i, texts in enumerate(batch_by_tokens([item[2] for item in to_embed])):
+        items = to_embed[offset:offset + len(texts)]
+        offset += len(texts)
+        custom_id = f'embed-{i}'
+        requests.append((custom_id, {'model': EMBEDDING_MODEL, 'input': texts}))
+        context[custom_id] = [[source_type, source_id] for source_type, source_id, _ in items]
+
+    embedded += run_stage(
+        session, 'embed', EMBEDDINGS_ENDPOINT, requests, context, apply, batch_dir, poll_interval, on_progress,
+        weight=lambda body: len(body['input']), limit=MAX_EMBEDDING_INPUTS_PER_BATCH
+    )
+    conn.close()
+    session.close()
+    return embedded
@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime, timedelta, UTC
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STARTUP_COMMANDS = (['--help'], ['search', '--help'], ['stats', '--help'])
+# Commands whose real code path must stay as light as 'import cli'
+LIGHT_COMMANDS = (['search', '-w', '{workspace}', 'query'],)
+HEAVY_MODULES = ('openai', 'sqlalchemy', 'sqlite_vec', 'tiktoken', 'dotenv')
+
+WORDS = (
+    'garden tomatoes project deadline review meeting sister birthday trip tokyo flight hotel '
+    'python refactor database index cache latency budget invoice bakery recipe sourdough '
+    'marathon training knee physio guitar lesson chord book chapter draft editor'
+).split()
+
+
+def synthetic_messages(count, seed=0, start=None, span_days=120):
+    rng = random.Random(seed)
+    start = start or datetime(2025, 1, 1, tzinfo=UTC)
+    step = timedelta(days=span_days) / max(count, 1)
+    messages = []
+    for i in range(count):
+        role = 'user' if i % 2 == 0 else 'assistant'
+        content = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 40)))
+        messages.append({'role': role, 'content': content, 'timestamp': (start + step * i).isoformat()})
+    return messages
+
+
+def run_pipeline(args):
+    from fake_openai import FakeOpenAIServer
+
+    server = FakeOpenAIServer(
+        latency=args.latency, jitter=args.jitter, rate_limit_rate=args.rate_limit, seed=args.seed
+    ).start()
+    os.environ['OPENAI_BASE_URL'] = server.base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+    from db import init_db, get_session
+    from sync import sync, import_messages
+    from llm import enable_cache
+    from usage import enable_ledger, flush_calls, call_stats
+    from ratelimit import seed_concurrency
+
+    workspace = args.workspace or tempfile.mkdtemp(prefix='pyramid-bench-')
+    db_path = os.path.join(workspace, 'pyramid.db')
+    init_db(db_path)
+    enable_cache(workspace)
+    enable_ledger(db_path)
+    seed_concurrency(args.parallel)
+    messages = synthetic_messages(args.messages, args.seed)
+    progress = print if args.verbose else None
+
+    timings = {}
+    started = time.perf_counter()
+    session = get_session(db_path)
+    import_messages(session, messages, progress, args.parallel)
+    session.close()
+    timings['import'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    sync(workspace, on_progress=progress, max_workers=args.parallel)
+    timings['sync'] = time.perf_counter() - started
+    flush_calls()
+    server.stop()
+
+    session = get_session(db_path)
+    stages = call_stats(session, 'stage')
+    session.close()
+
+    wall = sum(timings.values())
+    calls = sum(row['calls'] for row in stages)
+    report = {
+        'workspace': workspace,
+        'messages': args.messages,
+        'parallel': args.parallel,
+        'latency': args.latency,
+        'wall_seconds': round(wall, 3),
+        'phase_seconds': {k: round(v, 3) for k, v in timings.items()},
+        'llm_calls': calls,
+        'calls_per_second': round(calls / wall, 1) if wall else None,
+        'messages_per_second': round(args.messages / timings['import'], 1) if timings['import'] else None,
+        'server': server.state.stats(),
+        'stages': {
+            row['stage']: {k: round(row[k], 1) if isinstance(row[k], float) else row[k] for k in ('calls', 'prompt_tokens', 'p50_ms', 'p95_ms', 'retries')}
+            for row in stages
+        },
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+def startup_modules(*command):
+    # Heavy modules loaded by 'import cli' or, given a command, by running it.
+    # Commands run against an empty workspace, so they stop at the missing
+    # database right after their own imports.
+    code = f"""
+import sys, tempfile, cli
+if {list(command)!r}:
+    with tempfile.TemporaryDirectory() as workspace:
+        args = [a.replace('{{workspace}}', workspace) for a in {list(command)!r}]
+        cli.cli.main(args, standalone_mode=False)
+print('MODULES', ' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+    result = subprocess.run([sys.executable, '-c', code], cwd=HERE, capture_output=True, text=True, check=True)
+    return result.stdout.rsplit('MODULES', 1)[1].split()
+
+
+def run_startup(args):
+    timings = {}
+    for command in STARTUP_COMMANDS:
+        samples = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, 'cli.py', *command], cwd=HERE, capture_output=True, check=True)
+            samples.append((time.perf_counter() - started) * 1000)
+        timings[' '.join(command)] = {'median_ms': round(statistics.median(samples), 1), 'min_ms': round(min(samples), 1)}
+
+    slowest = max(t['median_ms'] for t in timings.values())
+    report = {
+        'repeat': args.repeat,
+        'commands': timings,
+        'heavy_modules_at_import': startup_modules(),
+        'heavy_modules_by_command': {command[0]: startup_modules(*command) for command in LIGHT_COMMANDS},
+        'budget_ms': args.budget_ms,
+        'within_budget': slowest <= args.budget_ms,
+    }
+    print(json.dumps(report, indent=2))
+    return (report['within_budget'] and not report['heavy_modules_at_import']
+            and not any(report['heavy_modules_by_command'].values()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks against the bundled fake OpenAI server.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    pipeline = sub.add_parser('pipeline', help='Import synthetic messages and run a full sync end to end')
+    pipeline.add_argument('--messages', '-n', type=int, default=2000)
+    pipeline.add_argument('--parallel', '-p', type=int, default=10)
+    pipeline.add_argument('--latency', type=float, default=0.0, help='Simulated seconds per LLM call (0 measures pure overhead)')
+    pipeline.add_argument('--jitter', type=float, default=0.0)
+    pipeline.add_argument('--rate-limit', type=float, default=0.0, help='Fraction of calls answered with 429')
+    pipeline.add_argument('--seed', type=int, default=0)
+    pipeline.add_argument('--workspace', '-w', default=None, help='Workspace directory (default: a new temp dir)')
+    pipeline.add_argument('--verbose', '-v', action='store_true')
+    pipeline.set_defaults(func=run_pipeline)
+
+    startup = sub.add_parser('startup', help='Time cold CLI startup and check that heavy modules load lazily')
+    startup.add_argument('--repeat', '-r', type=int, default=10)
+    startup.add_argument('--budget-ms', type=float, default=300.0, help='Fail if any command\'s median startup exceeds this')
+    startup.set_defaults(func=run_startup)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
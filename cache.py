@@ -0,0 +1,118 @@
+import json
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+CACHE_FILENAME = 'llm_cache.db'
+DEFAULT_MAX_ENTRIES = 50000
+# Hits are written in batches of this many, so a hit-only run still persists them
+TOUCH_BATCH_SIZE = 100
+
+
+def request_key(request):
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # last_used updates from hits, written with the next put, every
+        # TOUCH_BATCH_SIZE hits, on flush() or on close
+        self._touched = {}
+        self._lock = threading.Lock()
+        if self.path != ':memory:':
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_last_used ON responses (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, request):
+        key = request_key(request)
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", [key]).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_BATCH_SIZE:
+                self._write_touched()
+                self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, request, response):
+        key = request_key(request)
+        now = time.time()
+        with self._lock:
+            self._write_touched()
+            exists = self._conn.execute("SELECT 1 FROM responses WHERE key = ?", [key]).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                [key, request.get('model'), json.dumps(response), now, now]
+            )
+            if exists is None:
+                self._count += 1
+            self._evict()
+            self._conn.commit()
+
+    def _write_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE responses SET last_used = ? WHERE key = ?", [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+
+    def _evict(self):
+        # _count tracks the rows this instance has written; another process
+        # sharing the file can push the table past it, which the next
+        # eviction after a reopen corrects.
+        excess = self._count - self.max_entries
+        if excess <= 0:
+            return
+        deleted = self._conn.execute("""
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY last_used LIMIT ?
+            )
+        """, [excess]).rowcount
+        self._count -= deleted
+        self.evictions += deleted
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def flush(self):
+        with self._lock:
+            if self._touched:
+                self._write_touched()
+                self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._write_touched()
+            self._conn.commit()
+            self._conn.close()
@@ -1,15 +1,11 @@
 import click
 import sqlite3
 from pathlib import Path
-from datetime import datetime, UTC
-from db import init_db, get_session, Observation, Model, Summary, ImportedSession
-from llm import extract_observations, client, MODEL
-from summarize import run_tier0_summarization, run_higher_tier_summarization, run_all_summarization, mark_model_dirty
-from embeddings import embed_many, enable_vec, init_memory_vec, get_existing_embeddings, store_embeddings, search_memory, enrich_for_embedding
-from loaders import load_glenn_messages, load_claude_messages, load_openclaw_messages, group_messages_by_week, get_openclaw_file_stats
-from generate import export_models
-from pyramid import synthesize_dirty_models
-from sync import sync as do_sync
+from datetime import datetime, timedelta, UTC
+
+# Command modules are imported inside each command so that `--help` and
+# short-lived commands like `search` don't pay for SQLAlchemy, the OpenAI
+# SDK and the summarization stack at startup.
 
 
 def get_db_path(workspace, db):
@@ -32,7 +28,16 @@ def cli():
 @click.option('--conversation', '-c', default=None, type=int, help='Process specific conversation ID (glenn only)')
 @click.option('--user', '-u', default=None, type=str, help='Filter by username (glenn only)')
 @click.option('--parallel', '-p', default=10, type=int, help='Number of parallel workers (default: 10)')
-def import_cmd(workspace, db, source, format, limit, conversation, user, parallel):
+@click.option('--batch', is_flag=True, help='Submit extraction through the Batch API (cheaper, completes within 24h)')
+@click.option('--poll-interval', default=30, type=int, help='Seconds between batch status checks (default: 30)')
+def import_cmd(workspace, db, source, format, limit, conversation, user, parallel, batch, poll_interval):
+    from db import init_db, get_session, ImportedSession
+    from llm import enable_cache
+    from usage import enable_ledger
+    from ratelimit import seed_concurrency
+    from loaders import load_glenn_messages, load_claude_messages, load_openclaw_messages, get_openclaw_file_stats
+    from sync import import_messages
+    
     if not format:
         click.echo('Error: Must specify --glenn, --claude, or --openclaw format')
         return
@@ -44,6 +49,9 @@ def import_cmd(workspace, db, source, format, limit, conversation, user, paralle
     db_path = get_db_path(workspace, db)
     Path(workspace).mkdir(parents=True, exist_ok=True)
     init_db(str(db_path))
+    enable_cache(workspace)
+    enable_ledger(db_path)
+    seed_concurrency(parallel)
     
     if format == 'glenn':
         messages, info = load_glenn_messages(source, conversation, user, limit)
@@ -62,35 +70,14 @@ def import_cmd(workspace, db, source, format, limit, conversation, user, paralle
         click.echo('No messages to process.')
         return
     
-    by_week = group_messages_by_week(messages)
-    weeks = sorted(by_week.keys())
-    click.echo(f'Processing {len(weeks)} weeks...')
-    
-    total_observations = 0
     session = get_session(str(db_path))
-    
-    for week in weeks:
-        week_messages = by_week[week]
-        click.echo(f'\n{week}: {len(week_messages)} messages')
-        
-        def progress(completed, total, msgs_in_chunk, timestamp, obs_count):
-            click.echo(f'  [{completed}/{total}] {obs_count} obs')
-        
-        observations = extract_observations(week_messages, on_progress=progress, max_workers=parallel)
-        
-        for obs_data in observations:
-            ts = obs_data.get('timestamp')
-            if isinstance(ts, str):
-                ts = datetime.fromisoformat(ts)
-            obs = Observation(
-                text=obs_data['text'],
-                timestamp=ts or datetime.now(UTC)
-            )
-            session.add(obs)
-        session.commit()
-        
-        total_observations += len(observations)
-        click.echo(f'  Saved {len(observations)} observations')
+    if batch:
+        from batch import import_messages_batch, get_batch_dir
+        total_observations = import_messages_batch(
+            session, messages, get_batch_dir(db_path), poll_interval, on_progress=click.echo
+        )
+    else:
+        total_observations = import_messages(session, messages, on_progress=click.echo, max_workers=parallel)
     
     click.echo(f'\nTotal: {total_observations} observations')
     
@@ -113,9 +100,19 @@ def import_cmd(workspace, db, source, format, limit, conversation, user, paralle
 @click.option('--db', default='pyramid.db', help='Database filename (default: pyramid.db)')
 @click.option('--source', default=None, help='Path to sessions directory for incremental import')
 @click.option('--parallel', '-p', default=10, type=int, help='Number of parallel workers (default: 10)')
-def sync(workspace, db, source, parallel):
+@click.option('--batch', is_flag=True, help='Run extraction, tier-0 summaries and embeddings through the Batch API')
+@click.option('--poll-interval', default=30, type=int, help='Seconds between batch status checks (default: 30)')
+@click.option('--assign-margin', default=0.05, type=float, help='Similarity margin for assigning observations by embedding without the LLM (default: 0.05)')
+@click.option('--no-fast-assign', is_flag=True, help='Send every observation to the LLM for model assignment')
+@click.option('--full-rebuild', is_flag=True, help='Rebuild dirty summaries from all inputs instead of patching in new material')
+def sync(workspace, db, source, parallel, batch, poll_interval, assign_margin, no_fast_assign, full_rebuild):
+    from sync import sync as do_sync
+    from ratelimit import seed_concurrency
+    
+    seed_concurrency(parallel)
     progress = lambda msg: click.echo(msg)
-    do_sync(workspace, db, source, on_progress=progress, max_workers=parallel)
+    do_sync(workspace, db, source, on_progress=progress, max_workers=parallel, batch=batch, poll_interval=poll_interval,
+            assign_margin=None if no_fast_assign else assign_margin, patch_summaries=not full_rebuild)
 
 
 @cli.command(help='Semantic search across memory.')
@@ -126,6 +123,10 @@ def sync(workspace, db, source, parallel):
 @click.option('--raw', is_flag=True, help='Show raw results without LLM synthesis')
 @click.option('--time-weight', '-t', default=0.3, help='Time decay weight (0=pure semantic, 1=heavy recency bias)')
 def search(workspace, db, query, limit, raw, time_weight):
+    from llm import chat, enable_cache
+    from usage import enable_ledger
+    from embeddings import enable_vec, search_memory
+    
     db_path = get_db_path(workspace, db)
     
     if not db_path.exists():
@@ -133,8 +134,11 @@ def search(workspace, db, query, limit, raw, time_weight):
         click.echo(f'Hint: Run "import" or "observe" first to create the database')
         return
     
-    session = get_session(str(db_path))
-    conn = sqlite3.connect(str(db_path))
+    enable_cache(workspace)
+    enable_ledger(db_path)
+    # A plain connection rather than the pooled engine keeps SQLAlchemy off
+    # the search path
+    conn = sqlite3.connect(str(db_path), timeout=30)
     enable_vec(conn)
     
     results = search_memory(conn, query, limit, time_weight=time_weight)
@@ -146,34 +150,78 @@ def search(workspace, db, query, limit, raw, time_weight):
     context_items = []
     for source_type, source_id, distance in results:
         if source_type == 'observation':
-            item = session.get(Observation, source_id)
-            if item:
-                context_items.append(f"[obs] {item.text}")
+            row = conn.execute("SELECT text FROM observations WHERE id = ?", [source_id]).fetchone()
+            if row:
+                context_items.append(f"[obs] {row[0]}")
         else:
-            item = session.get(Summary, source_id)
-            if item:
-                model_name = item.model.name if item.model else '?'
-                context_items.append(f"[{model_name} T{item.tier}] {item.text}")
+            row = conn.execute("""
+                SELECT s.tier, s.text, m.name
+                FROM summaries s LEFT JOIN models m ON m.id = s.model_id
+                WHERE s.id = ?
+            """, [source_id]).fetchone()
+            if row:
+                tier, text, model_name = row
+                context_items.append(f"[{model_name or '?'} T{tier}] {text}")
     
     conn.close()
     
     if raw:
         for i, (source_type, source_id, distance) in enumerate(results):
             click.echo(f'[{distance:.3f}] {context_items[i]}')
-        session.close()
         return
     
     context = "\n\n".join(context_items)
     
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[
+    response = chat(
+        [
             {"role": "system", "content": "Answer questions based on the memory context provided. Be concise and direct. If the answer isn't in the context, say so."},
             {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"}
-        ]
+        ],
+        stage='search'
     )
     
     click.echo(response.choices[0].message.content)
+
+
+@cli.command(help='Show LLM call counts, tokens, patch savings and latency by stage and by day.')
+@click.option('--workspace', '-w', required=True, help='Workspace directory')
+@click.option('--db', default='pyramid.db', help='Database filename (default: pyramid.db)')
+@click.option('--days', '-d', default=None, type=int, help='Only include calls from the last N days')
+def stats(workspace, db, days):
+    from db import init_db, get_session
+    from usage import call_stats
+    
+    db_path = get_db_path(workspace, db)
+    
+    if not db_path.exists():
+        click.echo(f'Error: No database found at {db_path}')
+        return
+    
+    init_db(str(db_path))
+    session = get_session(str(db_path))
+    since = datetime.now(UTC) - timedelta(days=days) if days else None
+    
+    by_stage = call_stats(session, 'stage', since)
+    if not by_stage:
+        click.echo('No LLM calls recorded yet.')
+        session.close()
+        return
+    
+    def ms(value):
+        return f'{value:.0f}' if value is not None else '-'
+    
+    click.echo(f'{"stage":<12} {"calls":>7} {"cached":>7} {"errors":>6} {"retries":>7} {"prompt":>11} {"completion":>10} {"prefix%":>7} {"saved":>9} {"p50 ms":>7} {"p95 ms":>7}')
+    for row in by_stage:
+        click.echo(f'{row["stage"]:<12} {row["calls"]:>7} {row["cached"]:>7} {row["errors"]:>6} {row["retries"]:>7} '
+                   f'{row["prompt_tokens"]:>11} {row["completion_tokens"]:>10} {row["cached_rate"]:>7.0%} {row["saved_tokens"]:>9} '
+                   f'{ms(row["p50_ms"]):>7} {ms(row["p95_ms"]):>7}')
+    
+    click.echo('')
+    click.echo(f'{"day":<12} {"calls":>7} {"cached":>7} {"errors":>6} {"prompt":>11} {"completion":>10} {"p95 ms":>7}')
+    for row in call_stats(session, 'day', since):
+        click.echo(f'{row["day"]:<12} {row["calls"]:>7} {row["cached"]:>7} {row["errors"]:>6} '
+                   f'{row["prompt_tokens"]:>11} {row["completion_tokens"]:>10} {ms(row["p95_ms"]):>7}')
+    
     session.close()
 
 
@@ -187,6 +235,8 @@ def internal():
 @click.option('--db', default='pyramid.db', help='Database filename (default: pyramid.db)')
 @click.argument('text')
 def observe_cmd(workspace, db, text):
+    from db import init_db, get_session, Observation
+    
     db_path = get_db_path(workspace, db)
     Path(workspace).mkdir(parents=True, exist_ok=True)
     init_db(str(db_path))
@@ -205,17 +255,28 @@ def observe_cmd(workspace, db, text):
 @click.option('--max-obs', '-n', default=None, type=int, help='Maximum observations to process')
 @click.option('--max-tier', '-T', default=None, type=int, help='Maximum tier to build')
 @click.option('--parallel', '-p', default=10, type=int, help='Number of parallel workers')
-def summarize_cmd(workspace, db, max_obs, max_tier, parallel):
+@click.option('--assign-margin', default=0.05, type=float, help='Similarity margin for assigning observations by embedding without the LLM')
+@click.option('--no-fast-assign', is_flag=True, help='Send every observation to the LLM for model assignment')
+def summarize_cmd(workspace, db, max_obs, max_tier, parallel, assign_margin, no_fast_assign):
+    from llm import enable_cache
+    from usage import enable_ledger
+    from ratelimit import seed_concurrency
+    from summarize import run_all_summarization
+    
     db_path = get_db_path(workspace, db)
     
     if not db_path.exists():
         click.echo(f'Error: No database found at {db_path}')
         return
     
+    enable_cache(workspace)
+    enable_ledger(db_path)
+    seed_concurrency(parallel)
     progress = lambda msg: click.echo(msg)
     
     click.echo('Running summarization...')
-    tier0, higher = run_all_summarization(str(db_path), on_progress=progress, max_workers=parallel, max_tier=max_tier, max_obs=max_obs)
+    tier0, higher = run_all_summarization(str(db_path), on_progress=progress, max_workers=parallel, max_tier=max_tier, max_obs=max_obs,
+                                          assign_margin=None if no_fast_assign else assign_margin)
     click.echo(f'Created {tier0} tier 0 + {higher} higher tier summaries')
 
 
@@ -225,50 +286,44 @@ def summarize_cmd(workspace, db, max_obs, max_tier, parallel):
 @click.option('--parallel', '-p', default=10, help='Number of parallel workers')
 @click.option('--force', is_flag=True, help='Clear existing embeddings and re-embed everything')
 def embed_cmd(workspace, db, parallel, force):
+    from db import vec_connection
+    from usage import enable_ledger
+    from ratelimit import seed_concurrency
+    from embeddings import embed_many, init_memory_vec, store_embeddings, clear_embeddings
+    from sync import count_items_to_embed, iter_items_to_embed
+    
     db_path = get_db_path(workspace, db)
     
     if not db_path.exists():
         click.echo(f'Error: No database found at {db_path}')
         return
     
-    session = get_session(str(db_path))
-    conn = sqlite3.connect(str(db_path))
-    enable_vec(conn)
+    enable_ledger(db_path)
+    seed_concurrency(parallel)
+    conn = vec_connection(str(db_path))
     init_memory_vec(conn)
     
     if force:
-        conn.execute("DELETE FROM memory_vec")
-        conn.commit()
+        clear_embeddings(conn)
         click.echo('Cleared existing embeddings.')
     
-    existing = get_existing_embeddings(conn)
-    
-    to_embed = []
-    for obs in session.query(Observation).all():
-        if ('observation', obs.id) not in existing and obs.text and obs.text.strip():
-            enriched = enrich_for_embedding(obs.text, obs.timestamp)
-            to_embed.append(('observation', obs.id, enriched))
-    for s in session.query(Summary).all():
-        if ('summary', s.id) not in existing and s.text and s.text.strip():
-            enriched = enrich_for_embedding(s.text, s.start_timestamp, s.end_timestamp)
-            to_embed.append(('summary', s.id, enriched))
+    total = count_items_to_embed(conn)
     
-    if not to_embed:
+    if not total:
+        conn.close()
         click.echo('Nothing to embed.')
         return
     
-    click.echo(f'Embedding {len(to_embed)} items...')
-    texts = [item[2] for item in to_embed]
+    click.echo(f'Embedding {total} items...')
+    done = 0
+    for page in iter_items_to_embed(conn):
+        embeddings = embed_many([item[2] for item in page], max_workers=parallel)
+        store_embeddings(conn, page, embeddings)
+        done += len(page)
+        click.echo(f'  {done}/{total} items')
     
-    def progress(items_done, items_total, batches_done, batches_total):
-        click.echo(f'  {items_done}/{items_total} items ({batches_done}/{batches_total} batches)')
-    
-    embeddings = embed_many(texts, max_workers=parallel, on_progress=progress)
-    
-    store_embeddings(conn, to_embed, embeddings)
     conn.close()
-    session.close()
-    click.echo(f'Done. {len(to_embed)} items embedded.')
+    click.echo(f'Done. {done} items embedded.')
 
 
 @internal.command('generate', help='Write markdown files from cached synthesis.')
@@ -276,12 +331,20 @@ def embed_cmd(workspace, db, parallel, force):
 @click.option('--db', default='pyramid.db', help='Database filename (default: pyramid.db)')
 @click.option('--parallel', '-p', default=10, type=int, help='Number of parallel workers')
 def generate_cmd(workspace, db, parallel):
+    from llm import enable_cache
+    from usage import enable_ledger
+    from ratelimit import seed_concurrency
+    from generate import export_models
+    
     db_path = get_db_path(workspace, db)
     
     if not db_path.exists():
         click.echo(f'Error: No database found at {db_path}')
         return
     
+    enable_cache(workspace)
+    enable_ledger(db_path)
+    seed_concurrency(parallel)
     progress = lambda msg: click.echo(msg)
     regenerated = export_models(workspace, str(db_path), on_progress=progress, max_workers=parallel)
     click.echo(f'Generated: {", ".join(regenerated)}')
@@ -292,12 +355,20 @@ def generate_cmd(workspace, db, parallel):
 @click.option('--db', default='pyramid.db', help='Database filename (default: pyramid.db)')
 @click.option('--parallel', '-p', default=10, type=int, help='Number of parallel workers')
 def synthesize_cmd(workspace, db, parallel):
+    from llm import enable_cache
+    from usage import enable_ledger
+    from ratelimit import seed_concurrency
+    from pyramid import synthesize_dirty_models
+    
     db_path = get_db_path(workspace, db)
     
     if not db_path.exists():
         click.echo(f'Error: No database found at {db_path}')
         return
     
+    enable_cache(workspace)
+    enable_ledger(db_path)
+    seed_concurrency(parallel)
     progress = lambda msg: click.echo(msg)
     count = synthesize_dirty_models(str(db_path), on_progress=progress, max_workers=parallel)
     click.echo(f'Synthesized {count} models')
@@ -1,5 +1,7 @@
+import os
+import threading
 from datetime import datetime, UTC
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, ForeignKey
+from sqlalchemy import create_engine, event, Column, Integer, Float, String, Text, DateTime, Boolean, ForeignKey, Index
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 
 Base = declarative_base()
@@ -13,6 +15,10 @@ class Model(Base):
     is_base = Column(Boolean, default=False)
     synthesized_content = Column(Text)
     content_dirty = Column(Boolean, default=True)
+    context_block = Column(Text)
+    context_dirty = Column(Boolean, default=True)
+    tier0_watermark_ts = Column(DateTime)
+    tier0_watermark_id = Column(Integer)
     
     observations = relationship('Observation', back_populates='model')
     summaries = relationship('Summary', back_populates='model')
@@ -25,8 +31,16 @@ class Observation(Base):
     text = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=lambda: datetime.now(UTC))
     model_id = Column(Integer, ForeignKey('models.id'), nullable=True)
+    import_chunk_id = Column(Integer, ForeignKey('import_chunks.id'), nullable=True)
+    
+    embedded = Column(Boolean, default=False)
     
     model = relationship('Model', back_populates='observations')
+    
+    __table_args__ = (
+        Index('ix_observations_model_timestamp', 'model_id', 'timestamp'),
+        Index('ix_observations_embedded', 'embedded'),
+    )
 
 
 class Summary(Base):
@@ -39,9 +53,21 @@ class Summary(Base):
     start_timestamp = Column(DateTime, nullable=False)
     end_timestamp = Column(DateTime, nullable=False)
     is_dirty = Column(Boolean, default=False)
+    parent_id = Column(Integer, ForeignKey('summaries.id'), nullable=True)
+    input_hash = Column(String)
+    patch_count = Column(Integer, default=0)
+    embedded = Column(Boolean, default=False)
     
     model = relationship('Model', back_populates='summaries')
     sources = relationship('SummarySource', back_populates='summary', cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        Index('ix_summaries_unparented', 'tier', 'parent_id', 'model_id', 'start_timestamp'),
+        Index('ix_summaries_parent_id', 'parent_id'),
+        Index('ix_summaries_model_tier_span', 'model_id', 'tier', 'start_timestamp', 'end_timestamp'),
+        Index('ix_summaries_is_dirty', 'is_dirty'),
+        Index('ix_summaries_embedded', 'embedded'),
+    )
 
 
 class SummarySource(Base):
@@ -53,6 +79,11 @@ class SummarySource(Base):
     source_id = Column(Integer, nullable=False)
     
     summary = relationship('Summary', back_populates='sources')
+    
+    __table_args__ = (
+        Index('ix_summary_sources_source', 'source_type', 'source_id'),
+        Index('ix_summary_sources_summary_id', 'summary_id'),
+    )
 
 
 class ImportedSession(Base):
@@ -64,14 +95,157 @@ class ImportedSession(Base):
     last_mtime = Column(DateTime, nullable=False)
 
 
+class ProcessedMessage(Base):
+    __tablename__ = 'processed_messages'
+    
+    id = Column(Integer, primary_key=True)
+    hash = Column(String, unique=True, nullable=False)
+    processed_at = Column(DateTime, default=lambda: datetime.now(UTC))
+
+
+class ImportChunk(Base):
+    __tablename__ = 'import_chunks'
+    
+    id = Column(Integer, primary_key=True)
+    key = Column(String, unique=True, nullable=False)
+    segments = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default='pending')
+    message_count = Column(Integer, nullable=False, default=0)
+    observation_count = Column(Integer)
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
+    completed_at = Column(DateTime)
+
+
+class LLMCall(Base):
+    __tablename__ = 'llm_calls'
+    
+    id = Column(Integer, primary_key=True)
+    stage = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    kind = Column(String, nullable=False)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    cached_tokens = Column(Integer, default=0)
+    latency_ms = Column(Float)
+    retries = Column(Integer, default=0)
+    outcome = Column(String, nullable=False)
+    error = Column(String)
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC), index=True)
+    saved_tokens = Column(Integer, default=0)
+
+
+class BatchJob(Base):
+    __tablename__ = 'batch_jobs'
+    
+    id = Column(Integer, primary_key=True)
+    stage = Column(String, nullable=False)
+    batch_id = Column(String, unique=True, nullable=False)
+    input_file_id = Column(String, nullable=False)
+    output_file_id = Column(String)
+    error_file_id = Column(String)
+    status = Column(String, nullable=False, default='validating')
+    request_count = Column(Integer, nullable=False, default=0)
+    context = Column(Text, nullable=False)
+    applied = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
+    completed_at = Column(DateTime)
+
+
+HASH_LOOKUP_BATCH = 500
+
+
+def find_processed_hashes(session, hashes):
+    hashes = list(hashes)
+    known = set()
+    for i in range(0, len(hashes), HASH_LOOKUP_BATCH):
+        batch = hashes[i:i + HASH_LOOKUP_BATCH]
+        rows = session.query(ProcessedMessage.hash).filter(ProcessedMessage.hash.in_(batch)).all()
+        known.update(row[0] for row in rows)
+    return known
+
+
+def record_processed_hashes(session, hashes):
+    for h in hashes:
+        session.add(ProcessedMessage(hash=h))
+
+
+def save_observations(session, observations, import_chunk_id=None):
+    for obs_data in observations:
+        ts = obs_data.get('timestamp')
+        if isinstance(ts, str):
+            ts = datetime.fromisoformat(ts)
+        session.add(Observation(
+            text=obs_data['text'],
+            timestamp=ts or datetime.now(UTC),
+            import_chunk_id=import_chunk_id
+        ))
+
+
+# Applied to every pooled connection. WAL lets search read while sync
+# writes; synchronous=NORMAL is durable across crashes in WAL mode.
+SQLITE_PRAGMAS = (
+    'journal_mode = WAL',
+    'synchronous = NORMAL',
+    'busy_timeout = 30000',
+    'cache_size = -65536',
+    'mmap_size = 268435456',
+    'temp_store = MEMORY',
+)
+POOL_SIZE = 5
+POOL_MAX_OVERFLOW = 10
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def configure_connection(dbapi_conn, connection_record):
+    cursor = dbapi_conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+    # sqlite-vec is optional for ORM work; vec_connection() reports why it is missing
+    try:
+        from embeddings import enable_vec
+        enable_vec(dbapi_conn)
+    except Exception as e:
+        connection_record.info['vec_error'] = e
+
+
 def get_engine(db_path='pyramid.db'):
-    return create_engine(f'sqlite:///{db_path}')
+    path = os.path.abspath(db_path)
+    with _engines_lock:
+        engine = _engines.get(path)
+        if engine is None:
+            engine = create_engine(
+                f'sqlite:///{path}',
+                pool_size=POOL_SIZE,
+                max_overflow=POOL_MAX_OVERFLOW,
+                connect_args={'check_same_thread': False, 'timeout': 30},
+            )
+            event.listen(engine, 'connect', configure_connection)
+            _engines[path] = engine
+        return engine
+
+
+def dispose_engines():
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
 
 
 def get_session(db_path='pyramid.db'):
-    engine = get_engine(db_path)
-    Session = sessionmaker(bind=engine)
-    return Session()
+    return sessionmaker(bind=get_engine(db_path))()
+
+
+def vec_connection(db_path='pyramid.db'):
+    # Pooled DBAPI connection with sqlite-vec loaded; close() returns it to the pool
+    conn = get_engine(db_path).raw_connection()
+    error = conn.info.get('vec_error')
+    if error is not None:
+        conn.close()
+        raise error
+    return conn
 
 
 BASE_MODELS = {
@@ -80,38 +254,125 @@ BASE_MODELS = {
 }
 
 
-def migrate_db(db_path):
-    import sqlite3
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute("PRAGMA table_info(models)")
-    model_cols = {row[1] for row in cursor.fetchall()}
+def table_columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cursor.fetchall()}
+
+
+def migrate_columns(cursor):
+    # Version 1: every column added before migrations were versioned
+    model_cols = table_columns(cursor, 'models')
     if 'synthesized_content' not in model_cols:
         cursor.execute("ALTER TABLE models ADD COLUMN synthesized_content TEXT")
     if 'content_dirty' not in model_cols:
         cursor.execute("ALTER TABLE models ADD COLUMN content_dirty BOOLEAN DEFAULT 1")
+    if 'context_block' not in model_cols:
+        cursor.execute("ALTER TABLE models ADD COLUMN context_block TEXT")
+    if 'context_dirty' not in model_cols:
+        cursor.execute("ALTER TABLE models ADD COLUMN context_dirty BOOLEAN DEFAULT 1")
+    if 'tier0_watermark_ts' not in model_cols:
+        cursor.execute("ALTER TABLE models ADD COLUMN tier0_watermark_ts DATETIME")
+    if 'tier0_watermark_id' not in model_cols:
+        cursor.execute("ALTER TABLE models ADD COLUMN tier0_watermark_id INTEGER")
     
-    cursor.execute("PRAGMA table_info(summaries)")
-    summary_cols = {row[1] for row in cursor.fetchall()}
+    if 'import_chunk_id' not in table_columns(cursor, 'observations'):
+        cursor.execute("ALTER TABLE observations ADD COLUMN import_chunk_id INTEGER REFERENCES import_chunks(id)")
+    
+    summary_cols = table_columns(cursor, 'summaries')
     if 'is_dirty' not in summary_cols:
         cursor.execute("ALTER TABLE summaries ADD COLUMN is_dirty BOOLEAN DEFAULT 0")
-    
-    conn.commit()
-    conn.close()
+    if 'parent_id' not in summary_cols:
+        cursor.execute("ALTER TABLE summaries ADD COLUMN parent_id INTEGER REFERENCES summaries(id)")
+        cursor.execute("""
+            UPDATE summaries SET parent_id = (
+                SELECT MAX(ss.summary_id) FROM summary_sources ss
+                WHERE ss.source_type = 'summary' AND ss.source_id = summaries.id
+            )
+        """)
+    if 'input_hash' not in summary_cols:
+        cursor.execute("ALTER TABLE summaries ADD COLUMN input_hash VARCHAR")
+    if 'patch_count' not in summary_cols:
+        cursor.execute("ALTER TABLE summaries ADD COLUMN patch_count INTEGER DEFAULT 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_summaries_unparented ON summaries (tier, parent_id, model_id, start_timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_summaries_parent_id ON summaries (parent_id)")
+
+
+def migrate_hot_path_indexes(cursor):
+    # Version 2: indexes for the columns every stage filters by
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_observations_model_timestamp ON observations (model_id, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_summaries_model_tier_span ON summaries (model_id, tier, start_timestamp, end_timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_summaries_is_dirty ON summaries (is_dirty)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_summary_sources_source ON summary_sources (source_type, source_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_summary_sources_summary_id ON summary_sources (summary_id)")
+
+
+def migrate_embedded_flags(cursor):
+    # Version 3: per-row embedding state. Existing rows start NULL (unknown)
+    # and are settled against memory_vec by the first embed run.
+    for table in ('observations', 'summaries'):
+        if 'embedded' not in table_columns(cursor, table):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN embedded BOOLEAN")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_embedded ON {table} (embedded)")
+
+
+def migrate_ledger_saved_tokens(cursor):
+    # Version 4: prompt tokens a call avoided (incremental summary patches)
+    if 'saved_tokens' not in table_columns(cursor, 'llm_calls'):
+        cursor.execute("ALTER TABLE llm_calls ADD COLUMN saved_tokens INTEGER DEFAULT 0")
+
+
+# Applied in order to any database whose PRAGMA user_version is below the
+# step's version. Append new steps; never edit or renumber released ones.
+MIGRATIONS = [
+    (1, migrate_columns),
+    (2, migrate_hot_path_indexes),
+    (3, migrate_embedded_flags),
+    (4, migrate_ledger_saved_tokens),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(db_path):
+    import sqlite3
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def migrate_db(db_path):
+    import sqlite3
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    applied = []
+    try:
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            # DDL and user_version are transactional in SQLite, so a failed
+            # step leaves the file at the previous version.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                migrate(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append(version)
+    finally:
+        conn.close()
+    return applied
 
 
 def init_db(db_path='pyramid.db'):
     from pathlib import Path
     Path(db_path).parent.mkdir(parents=True, exist_ok=True)
     
-    db_exists = Path(db_path).exists()
-    
     engine = get_engine(db_path)
     Base.metadata.create_all(engine)
-    
-    if db_exists:
-        migrate_db(db_path)
+    migrate_db(db_path)
     
     session = get_session(db_path)
     
@@ -119,17 +380,20 @@ def init_db(db_path='pyramid.db'):
     if old_self:
         old_self.name = 'assistant'
         old_self.description = BASE_MODELS['assistant']
+        old_self.context_dirty = True
     
     old_agent = session.query(Model).filter_by(name='agent').first()
     if old_agent:
         old_agent.name = 'assistant'
         old_agent.description = BASE_MODELS['assistant']
+        old_agent.context_dirty = True
     
     for name, description in BASE_MODELS.items():
         existing = session.query(Model).filter_by(name=name).first()
         if not existing:
             session.add(Model(name=name, description=description, is_base=True, content_dirty=True))
-        else:
+        elif existing.description != description:
             existing.description = description
+            existing.context_dirty = True
     session.commit()
     session.close()
@@ -1,14 +1,12 @@
 import struct
 import math
 from datetime import datetime, UTC
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import sqlite_vec
-from openai import OpenAI
-from dotenv import load_dotenv
+from ratelimit import get_limiter
+from tokens import count_tokens
+from usage import record_call
+from llm import get_client
+import engine
 
-load_dotenv()
-
-client = OpenAI()
 EMBEDDING_MODEL = "text-embedding-3-small"
 
 
@@ -38,29 +36,46 @@ TIME_DECAY_HALF_LIFE_DAYS = 30
 
 MAX_TOKENS_PER_REQUEST = 250000
 MAX_ITEMS_PER_REQUEST = 2048
-CHARS_PER_TOKEN = 4
 
 
 def estimate_tokens(text):
-    return len(text) // CHARS_PER_TOKEN
+    return count_tokens(text)
 
 
-def get_embedding(text):
-    response = client.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=text
-    )
+async def acreate_embeddings(input):
+    request = {'model': EMBEDDING_MODEL, 'input': input}
+    info = {}
+    try:
+        response = await get_limiter().call(
+            EMBEDDING_MODEL, request,
+            lambda: get_client().embeddings.with_raw_response.create(**request),
+            info
+        )
+    except Exception as e:
+        record_call('embed', EMBEDDING_MODEL, 'embedding', retries=info.get('retries'), outcome='error', error=type(e).__name__)
+        raise
+    record_call('embed', EMBEDDING_MODEL, 'embedding', getattr(response, 'usage', None), info.get('latency'), info.get('retries'))
+    return response
+
+
+async def aget_embedding(text):
+    response = await acreate_embeddings(text)
     return response.data[0].embedding
 
 
-def get_embeddings_batch(texts):
-    response = client.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=texts
-    )
+async def aget_embeddings_batch(texts):
+    response = await acreate_embeddings(texts)
     return [item.embedding for item in response.data]
 
 
+def get_embedding(text):
+    return engine.run(aget_embedding(text))
+
+
+def get_embeddings_batch(texts):
+    return engine.run(aget_embeddings_batch(texts))
+
+
 def batch_by_tokens(texts, max_tokens=MAX_TOKENS_PER_REQUEST, max_items=MAX_ITEMS_PER_REQUEST):
     batches = []
     current_batch = []
@@ -87,18 +102,12 @@ def embed_many(texts, max_workers=10, on_progress=None):
     items_done = 0
     batches_done = 0
     
-    def process_batch(batch_idx):
-        return batch_idx, get_embeddings_batch(batches[batch_idx])
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_batch, i) for i in range(len(batches))]
-        for future in as_completed(futures):
-            batch_idx, embeddings = future.result()
-            results[batch_idx] = embeddings
-            items_done += len(embeddings)
-            batches_done += 1
-            if on_progress:
-                on_progress(items_done, len(texts), batches_done, len(batches))
+    for batch_idx, embeddings in engine.map_unordered(aget_embeddings_batch, batches, max_workers):
+        results[batch_idx] = embeddings
+        items_done += len(embeddings)
+        batches_done += 1
+        if on_progress:
+            on_progress(items_done, len(texts), batches_done, len(batches))
     
     return [emb for batch in results for emb in batch]
 
@@ -113,6 +122,7 @@ def deserialize_embedding(blob):
 
 
 def enable_vec(conn):
+    import sqlite_vec
     conn.enable_load_extension(True)
     sqlite_vec.load(conn)
     conn.enable_load_extension(False)
@@ -151,11 +161,28 @@ def init_memory_vec(conn):
     """)
 
 
-def get_existing_embeddings(conn):
-    return set(
-        (row[0], row[1]) 
-        for row in conn.execute("SELECT source_type, source_id FROM memory_vec").fetchall()
-    )
+SOURCE_TABLES = {'observation': 'observations', 'summary': 'summaries'}
+
+
+def reconcile_embedded_flags(conn):
+    # Rows from before the embedded column: one pass over memory_vec settles
+    # them, after which this is an index probe that finds nothing.
+    for source_type, table in SOURCE_TABLES.items():
+        if conn.execute(f"SELECT 1 FROM {table} WHERE embedded IS NULL LIMIT 1").fetchone() is None:
+            continue
+        conn.execute(f"""
+            UPDATE {table} SET embedded = 1
+            WHERE embedded IS NULL AND id IN (SELECT source_id FROM memory_vec WHERE source_type = ?)
+        """, [source_type])
+        conn.execute(f"UPDATE {table} SET embedded = 0 WHERE embedded IS NULL")
+    conn.commit()
+
+
+def clear_embeddings(conn):
+    conn.execute("DELETE FROM memory_vec")
+    for table in SOURCE_TABLES.values():
+        conn.execute(f"UPDATE {table} SET embedded = 0")
+    conn.commit()
 
 
 def store_embeddings(conn, items, embeddings):
@@ -164,9 +191,76 @@ def store_embeddings(conn, items, embeddings):
             "INSERT INTO memory_vec (source_type, source_id, embedding) VALUES (?, ?, ?)",
             [source_type, source_id, serialize_embedding(embeddings[i])]
         )
+        conn.execute(f"UPDATE {SOURCE_TABLES[source_type]} SET embedded = 1 WHERE id = ?", [source_id])
     conn.commit()
 
 
+def get_observation_embeddings(conn, obs_ids):
+    found = {}
+    ids = list(obs_ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(
+            f"SELECT source_id, embedding FROM memory_vec WHERE source_type = 'observation' AND source_id IN ({placeholders})",
+            chunk
+        ).fetchall()
+        for source_id, blob in rows:
+            found[source_id] = deserialize_embedding(blob)
+    return found
+
+
+def init_centroids(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS model_centroids (
+            model_id INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL,
+            embedding BLOB NOT NULL
+        )
+    """)
+
+
+def update_centroids(conn, assigned):
+    sums = {}
+    for model_id, embedding in assigned:
+        count, total = sums.get(model_id, (0, None))
+        total = list(embedding) if total is None else [a + b for a, b in zip(total, embedding)]
+        sums[model_id] = (count + 1, total)
+
+    for model_id, (added, total) in sums.items():
+        row = conn.execute("SELECT count, embedding FROM model_centroids WHERE model_id = ?", [model_id]).fetchone()
+        if row:
+            count, mean = row[0], deserialize_embedding(row[1])
+            total = [m * count + t for m, t in zip(mean, total)]
+            added += count
+        conn.execute(
+            "INSERT OR REPLACE INTO model_centroids (model_id, count, embedding) VALUES (?, ?, ?)",
+            [model_id, added, serialize_embedding([t / added for t in total])]
+        )
+    conn.commit()
+    return len(sums)
+
+
+def rebuild_centroids(conn):
+    conn.execute("DELETE FROM model_centroids")
+    rows = conn.execute("""
+        SELECT o.model_id, v.embedding
+        FROM memory_vec v JOIN observations o ON o.id = v.source_id
+        WHERE v.source_type = 'observation' AND o.model_id IS NOT NULL
+    """)
+    return update_centroids(conn, ((model_id, deserialize_embedding(blob)) for model_id, blob in rows))
+
+
+def nearest_centroids(conn, embedding, min_count=1, limit=2):
+    return conn.execute("""
+        SELECT model_id, 1 - vec_distance_cosine(embedding, ?) AS similarity
+        FROM model_centroids
+        WHERE count >= ?
+        ORDER BY similarity DESC
+        LIMIT ?
+    """, [serialize_embedding(embedding), min_count, limit]).fetchall()
+
+
 def compute_time_penalty(timestamp, half_life_days=TIME_DECAY_HALF_LIFE_DAYS):
     if timestamp is None:
         return 0.5
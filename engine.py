@@ -0,0 +1,129 @@
+import asyncio
+import queue
+import threading
+
+_loop = None
+_thread = None
+_lock = threading.Lock()
+
+
+def get_loop():
+    global _loop, _thread
+    with _lock:
+        if _loop is None or not _thread.is_alive():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='llm-engine', daemon=True)
+            thread.start()
+            _loop, _thread = loop, thread
+        return _loop
+
+
+def run(coro):
+    loop = get_loop()
+    if threading.current_thread() is _thread:
+        raise RuntimeError('engine.run() cannot be called from inside the engine loop; await the coroutine instead')
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+class TaskPool:
+    def __init__(self, max_concurrency=10):
+        self.max_concurrency = max_concurrency
+        self._loop = get_loop()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._results = queue.Queue()
+        self._futures = []
+        self._pending = 0
+
+    async def _run(self, key, coro):
+        async with self._semaphore:
+            try:
+                result = await coro
+            except BaseException as e:
+                self._results.put((key, None, e))
+                return
+        self._results.put((key, result, None))
+
+    def submit(self, key, coro):
+        self._pending += 1
+        self._futures.append(asyncio.run_coroutine_threadsafe(self._run(key, coro), self._loop))
+
+    def cancel(self):
+        for future in self._futures:
+            future.cancel()
+
+    def completed(self):
+        try:
+            while self._pending:
+                key, result, error = self._results.get()
+                self._pending -= 1
+                if error is not None:
+                    raise error
+                yield key, result
+        finally:
+            if self._pending:
+                self.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._pending:
+            self.cancel()
+
+
+class TaskGraph:
+    def __init__(self, max_concurrency=10):
+        self.max_concurrency = max_concurrency
+        self._loop = get_loop()
+        self._nodes = {}
+        self._results = queue.Queue()
+
+    def add(self, key, factory, deps=()):
+        # factory receives {dep_key: result} once every dep in the graph is done
+        self._nodes[key] = ([d for d in deps], factory)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    async def _run_all(self):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        futures = {key: self._loop.create_future() for key in self._nodes}
+
+        async def run(key):
+            deps, factory = self._nodes[key]
+            try:
+                inputs = {d: await futures[d] for d in deps if d in futures}
+                async with semaphore:
+                    result = await factory(inputs)
+            except BaseException as e:
+                futures[key].set_exception(e)
+                self._results.put((key, None, e))
+                return
+            futures[key].set_result(result)
+            self._results.put((key, result, None))
+
+        await asyncio.gather(*(run(key) for key in self._nodes), return_exceptions=True)
+        for future in futures.values():
+            if future.done() and not future.cancelled():
+                future.exception()
+
+    def completed(self):
+        future = asyncio.run_coroutine_threadsafe(self._run_all(), self._loop)
+        remaining = len(self._nodes)
+        try:
+            while remaining:
+                key, result, error = self._results.get()
+                remaining -= 1
+                if error is not None:
+                    raise error
+                yield key, result
+        finally:
+            if not future.done():
+                future.cancel()
+
+
+def map_unordered(func, items, max_concurrency=10):
+    pool = TaskPool(max_concurrency)
+    for i, item in enumerate(items):
+        pool.submit(i, func(item))
+    return pool.completed()
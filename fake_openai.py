@@ -0,0 +1,413 @@
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tokens import count_tokens
+
+EMBEDDING_DIMENSIONS = 1536
+TOPICS = ['garden', 'work-project', 'family']
+MAX_OBSERVATIONS_PER_SEGMENT = 3
+
+_ASSIGN_LINE_RE = re.compile(r'^\[(\d+)\] (.*)$', re.MULTILINE)
+_SEGMENT_RE = re.compile(r'^### Segment (\d+)$', re.MULTILINE)
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode()).digest()
+
+
+def fake_embedding(text, dimensions=EMBEDDING_DIMENSIONS):
+    seed = _digest(text)
+    vector = [((seed[i % len(seed)] + i) % 256) / 255 - 0.5 for i in range(dimensions)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _tool_call(name, arguments):
+    encoded = json.dumps(arguments)
+    return {
+        'id': 'call_' + hashlib.sha256((name + encoded).encode()).hexdigest()[:12],
+        'type': 'function',
+        'function': {'name': name, 'arguments': encoded}
+    }
+
+
+def _conversation_observations(text, segment=None):
+    observations = []
+    for line in text.splitlines():
+        role, _, content = line.partition(': ')
+        if role not in ('user', 'assistant') or not content.strip():
+            continue
+        words = ' '.join(content.split()[:12])
+        subject = 'User' if role == 'user' else 'Assistant'
+        arguments = {'text': f"{subject} said: {words}"}
+        if segment is not None:
+            arguments['segment'] = segment
+        observations.append(arguments)
+        if len(observations) >= MAX_OBSERVATIONS_PER_SEGMENT:
+            break
+    return observations
+
+
+def fake_observations(prompt):
+    markers = list(_SEGMENT_RE.finditer(prompt))
+    if not markers:
+        body = prompt.split('\n\n', 1)[-1]
+        return [_tool_call('add_observation', a) for a in _conversation_observations(body)]
+    calls = []
+    for n, marker in enumerate(markers):
+        end = markers[n + 1].start() if n + 1 < len(markers) else len(prompt)
+        section = prompt[marker.end():end]
+        calls.extend(_tool_call('add_observation', a) for a in _conversation_observations(section, int(marker.group(1))))
+    return calls
+
+
+def fake_assignments(prompt):
+    calls = []
+    for match in _ASSIGN_LINE_RE.finditer(prompt):
+        obs_id, text = int(match.group(1)), match.group(2)
+        bucket = _digest(text)[0] % (len(TOPICS) + 3)
+        if text.startswith('Assistant'):
+            model_name = 'assistant'
+        elif bucket < 3:
+            model_name = 'user'
+        else:
+            model_name = TOPICS[bucket - 3]
+        calls.append(_tool_call('assign_model', {'observation_id': obs_id, 'model_name': model_name}))
+    return calls
+
+
+def fake_text(system, prompt):
+    lines = [line.lstrip('- ').strip() for line in prompt.splitlines() if line.strip()]
+    gist = '; '.join(line[:60] for line in lines[-3:])
+    if 'brief description' in system:
+        return 'Synthetic topic - generated notes for offline runs'
+    if 'temporal sections' in prompt:
+        return f"## Earlier\nSynthesized from {len(lines)} lines: {gist}"
+    return f"Summary of {len(lines)} lines: {gist}"
+
+
+def fake_chat_completion(body):
+    messages = body.get('messages', [])
+    system = '\n'.join(m.get('content') or '' for m in messages if m.get('role') == 'system')
+    prompt = messages[-1]['content'] if messages else ''
+    message = {'role': 'assistant', 'content': None}
+    finish_reason = 'stop'
+
+    tool_names = {t['function']['name'] for t in body.get('tools') or []}
+    if 'add_observation' in tool_names:
+        tool_calls = fake_observations(prompt)
+    elif 'assign_model' in tool_names:
+        tool_calls = fake_assignments(prompt)
+    else:
+        tool_calls = None
+        message['content'] = fake_text(system, prompt)
+    if tool_calls:
+        message['tool_calls'] = tool_calls
+        finish_reason = 'tool_calls'
+
+    prompt_tokens = sum(count_tokens(m.get('content') or '') + 4 for m in messages)
+    completion_tokens = count_tokens(json.dumps(tool_calls) if tool_calls else message['content'])
+    return {
+        'id': 'chatcmpl-' + hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()[:16],
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'fake'),
+        'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': 0}
+        }
+    }
+
+
+def fake_embeddings(body):
+    inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+    tokens = sum(count_tokens(text) for text in inputs)
+    return {
+        'object': 'list',
+        'model': body.get('model', 'fake'),
+        'data': [{'object': 'embedding', 'index': i, 'embedding': fake_embedding(text)} for i, text in enumerate(inputs)],
+        'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}
+    }
+
+
+ENDPOINTS = {
+    '/v1/chat/completions': fake_chat_completion,
+    '/v1/embeddings': fake_embeddings,
+}
+
+
+class FakeOpenAIState:
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_rate=0.0, retry_after_ms=50, seed=0):
+        self.lock = threading.RLock()
+        self.files = {}
+        self.batches = {}
+        self.requests = []
+        self.fail_custom_ids = set()
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_ms = retry_after_ms
+        self.random = random.Random(seed)
+        self.counts = {}
+        self.throttled = 0
+        self.delay_total = 0.0
+
+    def plan_response(self, path):
+        with self.lock:
+            self.counts[path] = self.counts.get(path, 0) + 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            throttle = self.random.random() < self.rate_limit_rate
+            if throttle:
+                self.throttled += 1
+            self.delay_total += delay
+        return delay, throttle
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': dict(self.counts),
+                'throttled': self.throttled,
+                'simulated_latency': self.delay_total,
+            }
+
+    def next_id(self, prefix, table):
+        return f"{prefix}-{len(table) + 1}"
+
+    def add_file(self, content, purpose):
+        with self.lock:
+            file_id = self.next_id('file', self.files)
+            self.files[file_id] = {'content': content, 'purpose': purpose, 'created_at': int(time.time())}
+        return file_id
+
+    def create_batch(self, input_file_id, endpoint, completion_window):
+        with self.lock:
+            batch_id = self.next_id('batch', self.batches)
+            self.batches[batch_id] = {
+                'id': batch_id,
+                'object': 'batch',
+                'endpoint': endpoint,
+                'input_file_id': input_file_id,
+                'completion_window': completion_window,
+                'status': 'validating',
+                'output_file_id': None,
+                'error_file_id': None,
+                'created_at': int(time.time()),
+                'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+            }
+        return self.batches[batch_id]
+
+    def advance_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        if batch['status'] == 'validating':
+            batch['status'] = 'in_progress'
+            return batch
+        if batch['status'] != 'in_progress':
+            return batch
+
+        output = []
+        errors = []
+        lines = self.files[batch['input_file_id']]['content'].decode().splitlines()
+        for line in lines:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            handler = ENDPOINTS.get(record['url'])
+            if handler is None or record['custom_id'] in self.fail_custom_ids:
+                errors.append({
+                    'custom_id': record['custom_id'],
+                    'response': {'status_code': 500, 'body': {'error': {'message': 'failed'}}},
+                    'error': None
+                })
+                continue
+            output.append({
+                'custom_id': record['custom_id'],
+                'response': {'status_code': 200, 'body': handler(record['body'])},
+                'error': None
+            })
+
+        if output:
+            batch['output_file_id'] = self.add_file(''.join(json.dumps(r) + '\n' for r in output).encode(), 'batch_output')
+        if errors:
+            batch['error_file_id'] = self.add_file(''.join(json.dumps(r) + '\n' for r in errors).encode(), 'batch_output')
+        batch['request_counts'] = {'total': len(output) + len(errors), 'completed': len(output), 'failed': len(errors)}
+        batch['status'] = 'completed'
+        batch['completed_at'] = int(time.time())
+        return batch
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeOpenAI/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _send_json(self, payload, status=200, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def _not_found(self):
+        self._send_json({'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}}, 404)
+
+    def do_POST(self):
+        body = self._read_body()
+        path = self.path.split('?')[0]
+        self.state.requests.append(('POST', path))
+
+        if path in ENDPOINTS:
+            delay, throttle = self.state.plan_response(path)
+            if delay:
+                time.sleep(delay)
+            if throttle:
+                return self._send_json(
+                    {'error': {'message': 'Rate limit reached (simulated)', 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                    429, {'retry-after-ms': str(self.state.retry_after_ms)}
+                )
+            return self._send_json(ENDPOINTS[path](json.loads(body)))
+
+        if path == '/v1/files':
+            fields = parse_multipart(self.headers.get('Content-Type'), body)
+            file_id = self.state.add_file(fields['file'], fields.get('purpose', b'').decode())
+            return self._send_json(self._file_object(file_id))
+
+        if path == '/v1/batches':
+            payload = json.loads(body)
+            batch = self.state.create_batch(payload['input_file_id'], payload['endpoint'], payload['completion_window'])
+            return self._send_json(batch)
+
+        self._not_found()
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        self.state.requests.append(('GET', path))
+        parts = path.strip('/').split('/')
+
+        if len(parts) == 3 and parts[:2] == ['v1', 'batches'] and parts[2] in self.state.batches:
+            with self.state.lock:
+                batch = self.state.advance_batch(parts[2])
+            return self._send_json(batch)
+
+        if len(parts) == 4 and parts[:2] == ['v1', 'files'] and parts[3] == 'content' and parts[2] in self.state.files:
+            data = self.state.files[parts[2]]['content']
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        if len(parts) == 3 and parts[:2] == ['v1', 'files'] and parts[2] in self.state.files:
+            return self._send_json(self._file_object(parts[2]))
+
+        self._not_found()
+
+    def _file_object(self, file_id):
+        f = self.state.files[file_id]
+        return {
+            'id': file_id,
+            'object': 'file',
+            'bytes': len(f['content']),
+            'created_at': f['created_at'],
+            'filename': file_id,
+            'purpose': f['purpose'],
+            'status': 'processed',
+        }
+
+
+def parse_multipart(content_type, body):
+    message = BytesParser(policy=HTTP).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+    )
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        fields[name] = part.get_payload(decode=True)
+    return fields
+
+
+class FakeOpenAIServer:
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        self.httpd = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = FakeOpenAIState(**options)
+        self._thread = None
+
+    @property
+    def state(self):
+        return self.httpd.state
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-openai', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local OpenAI-compatible fake server for offline runs and benchmarks.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='Mean seconds added to each chat/embedding response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Uniform +/- seconds around --latency')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--retry-after-ms', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = FakeOpenAIServer(
+        args.host, args.port,
+        latency=args.latency, jitter=args.jitter, rate_limit_rate=args.rate_limit,
+        retry_after_ms=args.retry_after_ms, seed=args.seed
+    )
+    print(f'Fake OpenAI listening on {server.base_url}')
+    print(f'  export OPENAI_BASE_URL={server.base_url} OPENAI_API_KEY=fake')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(json.dumps(server.state.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,20 @@
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from sqlalchemy import func
 from db import get_session, Model, Observation
-from llm import client, MODEL
+from llm import achat
+import engine
 
 
 CORE_MODELS = ['assistant', 'user']
 
+DESCRIBE_SYSTEM_PROMPT = """You describe what a memory model stores, given sample observations from it.
+
+Write a brief description (under 120 chars) with format: "[Who/What this is] - [what kind of info is stored]"
+Examples:
+- "Marcus Chen (mentee) - career goals, skill development, meeting notes"
+- "Sunrise Bakery (business) - recipes, suppliers, seasonal menu planning"
+- "Japan 2025 (trip) - flights, accommodations, restaurant reservations, packing list\""""
+
 
 def update_model_descriptions(session, on_progress=None, max_workers=10):
     models = session.query(Model).filter(
@@ -26,26 +34,18 @@ def update_model_descriptions(session, on_progress=None, max_workers=10):
         ).order_by(func.random()).limit(10).all()
         model_samples[model.id] = [s.text for s in samples]
     
-    def derive_one(model_id, model_name, samples):
+    async def derive_one(model_id, model_name, samples):
         if not samples:
             return model_id, None
         
         sample_text = "\n".join(f"- {s}" for s in samples)
         
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[{
-                "role": "user", 
-                "content": f"""These observations are stored under the model '{model_name}':
-
-{sample_text}
-
-Write a brief description (under 120 chars) with format: "[Who/What this is] - [what kind of info is stored]"
-Examples:
-- "Marcus Chen (mentee) - career goals, skill development, meeting notes"
-- "Sunrise Bakery (business) - recipes, suppliers, seasonal menu planning"
-- "Japan 2025 (trip) - flights, accommodations, restaurant reservations, packing list\""""
-            }]
+        response = await achat(
+            [
+                {"role": "system", "content": DESCRIBE_SYSTEM_PROMPT},
+                {"role": "user", "content": f"These observations are stored under the model '{model_name}':\n\n{sample_text}"}
+            ],
+            stage='describe'
         )
         desc = response.choices[0].message.content.strip()
         if len(desc) > 120:
@@ -53,18 +53,18 @@ Examples:
         return model_id, desc
     
     results = {}
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(derive_one, m.id, m.name, model_samples[m.id]): m for m in models}
-        for i, future in enumerate(as_completed(futures), 1):
-            model = futures[future]
-            model_id, desc = future.result()
-            results[model_id] = desc
-            if on_progress:
-                on_progress(f"  [{i}/{len(models)}] {model.name}")
+    pool = engine.TaskPool(max_workers)
+    for m in models:
+        pool.submit(m, derive_one(m.id, m.name, model_samples[m.id]))
+    for i, (model, (model_id, desc)) in enumerate(pool.completed(), 1):
+        results[model_id] = desc
+        if on_progress:
+            on_progress(f"  [{i}/{len(models)}] {model.name}")
     
     for model in models:
-        if results.get(model.id):
+        if results.get(model.id) and results[model.id] != model.description:
             model.description = results[model.id]
+            model.context_dirty = True
     
     session.commit()
 
@@ -1,16 +1,31 @@
 import os
 import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from openai import OpenAI
-from dotenv import load_dotenv
-
-load_dotenv()
+import atexit
+import asyncio
+from pathlib import Path
+from cache import ResponseCache, CACHE_FILENAME
+from ratelimit import get_limiter
+from tokens import count_tokens
+from usage import record_call
+import engine
 
 MODEL = 'gpt-4.1-mini'
 MAX_TOKENS = 10000
-CHARS_PER_TOKEN = 4
+# 'tool_calls' is a complete answer to an auto tool_choice request
+COMPLETE_FINISH_REASONS = ('stop', 'tool_calls')
+
+_client = None
+_cache = None
 
-client = OpenAI()
+
+def get_client():
+    global _client
+    if _client is None:
+        from dotenv import load_dotenv
+        from openai import AsyncOpenAI
+        load_dotenv()
+        _client = AsyncOpenAI(max_retries=0)
+    return _client
 
 OBSERVE_TOOL = {
     "type": "function",
@@ -42,9 +57,109 @@ GOOD: "User prefers dark mode in all apps"
 
 Include names, places, dates, numbers, preferences. Each observation should be a single factual sentence."""
 
+SEGMENTED_OBSERVE_TOOL = {
+    "type": "function",
+    "function": {
+        **OBSERVE_TOOL["function"],
+        "parameters": {
+            "type": "object",
+            "properties": {
+                **OBSERVE_TOOL["function"]["parameters"]["properties"],
+                "segment": {
+                    "type": "integer",
+                    "description": "Number of the conversation segment the observation comes from"
+                }
+            },
+            "required": ["text", "segment"]
+        }
+    }
+}
+
+
+def flush_cache():
+    # Persist pending last_used updates from cache hits
+    if _cache is not None:
+        _cache.flush()
+
+
+def set_cache(cache):
+    global _cache
+    _cache = cache
+
+
+def get_cache():
+    return _cache
+
+
+def enable_cache(workspace, max_entries=None):
+    path = Path(workspace) / CACHE_FILENAME
+    if _cache is not None and _cache.path == str(path):
+        return _cache
+    if _cache is not None:
+        _cache.flush()
+    else:
+        atexit.register(flush_cache)
+    cache = ResponseCache(path, max_entries) if max_entries else ResponseCache(path)
+    set_cache(cache)
+    return cache
+
+
+def build_request(messages, tools=None, tool_choice=None, model=MODEL):
+    request = {'model': model, 'messages': messages}
+    if tools:
+        request['tools'] = tools
+        request['tool_choice'] = tool_choice or 'auto'
+    return request
+
+
+def is_complete(response):
+    # Truncated or filtered output would otherwise be replayed on every run
+    return all(choice.finish_reason in COMPLETE_FINISH_REASONS for choice in response.choices)
+
+
+async def acomplete(request, stage=None, saved_tokens=0):
+    # Cache reads and writes are blocking SQLite calls, so they run in a
+    # worker thread instead of stalling every in-flight request on the loop
+    cache = _cache
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, request)
+        if cached is not None:
+            record_call(stage, request['model'], 'chat', outcome='cached')
+            from openai.types.chat import ChatCompletion
+            return ChatCompletion.model_validate(cached)
+    
+    info = {}
+    try:
+        response = await get_limiter().call(
+            request['model'], request,
+            lambda: get_client().chat.completions.with_raw_response.create(**request),
+            info
+        )
+    except Exception as e:
+        record_call(stage, request['model'], 'chat', retries=info.get('retries'), outcome='error', error=type(e).__name__)
+        raise
+    record_call(stage, request['model'], 'chat', getattr(response, 'usage', None), info.get('latency'), info.get('retries'),
+                saved_tokens=saved_tokens)
+    
+    if cache is not None and is_complete(response):
+        await asyncio.to_thread(cache.put, request, response.model_dump(mode='json'))
+    return response
+
+
+async def achat(messages, tools=None, tool_choice=None, model=MODEL, stage=None, saved_tokens=0):
+    return await acomplete(build_request(messages, tools, tool_choice, model), stage, saved_tokens)
+
+
+def chat(messages, tools=None, tool_choice=None, model=MODEL, stage=None):
+    return engine.run(achat(messages, tools, tool_choice, model, stage))
+
 
 def estimate_tokens(text):
-    return len(text) // CHARS_PER_TOKEN
+    return count_tokens(text)
+
+
+def message_tokens(msg):
+    return estimate_tokens(f"{msg['role']}: {msg['content']}\n")
 
 
 def chunk_messages(messages, max_tokens=MAX_TOKENS):
@@ -53,8 +168,7 @@ def chunk_messages(messages, max_tokens=MAX_TOKENS):
     current_tokens = 0
     
     for msg in messages:
-        msg_text = f"{msg['role']}: {msg['content']}"
-        msg_tokens = estimate_tokens(msg_text)
+        msg_tokens = message_tokens(msg)
         
         if current_tokens + msg_tokens > max_tokens and current_chunk:
             chunks.append(current_chunk)
@@ -70,50 +184,86 @@ def chunk_messages(messages, max_tokens=MAX_TOKENS):
     return chunks
 
 
-def process_chunk(chunk):
-    chunk_timestamp = chunk[-1].get('timestamp') if chunk else None
-    conversation_text = "\n".join(f"{m['role']}: {m['content']}" for m in chunk if m['content'])
+def observe_request(segments):
+    if len(segments) == 1:
+        chunk = segments[0][1]
+        conversation_text = "\n".join(f"{m['role']}: {m['content']}" for m in chunk if m['content'])
+        return build_request(
+            [
+                {"role": "system", "content": OBSERVE_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Extract observations from this conversation:\n\n{conversation_text}"}
+            ],
+            tools=[OBSERVE_TOOL],
+            tool_choice="auto"
+        )
+    
+    sections = []
+    for n, (_, chunk) in enumerate(segments, 1):
+        conversation_text = "\n".join(f"{m['role']}: {m['content']}" for m in chunk if m['content'])
+        sections.append(f"### Segment {n}\n{conversation_text}")
     
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[
+    return build_request(
+        [
             {"role": "system", "content": OBSERVE_SYSTEM_PROMPT},
-            {"role": "user", "content": f"Extract observations from this conversation:\n\n{conversation_text}"}
+            {"role": "user", "content": "Extract observations from these conversation segments. "
+                                        "Pass the segment number with each observation.\n\n" + "\n\n".join(sections)}
         ],
-        tools=[OBSERVE_TOOL],
+        tools=[SEGMENTED_OBSERVE_TOOL],
         tool_choice="auto"
     )
-    
+
+
+def segment_timestamps(segments):
+    return [chunk[-1].get('timestamp') if chunk else None for _, chunk in segments]
+
+
+def parse_observations(response, timestamps):
     observations = []
     for tool_call in response.choices[0].message.tool_calls or []:
         if tool_call.function.name == "add_observation":
             args = json.loads(tool_call.function.arguments)
-            args['timestamp'] = chunk_timestamp
+            segment = args.pop('segment', None)
+            if not isinstance(segment, int) or not 1 <= segment <= len(timestamps):
+                segment = len(timestamps)
+            args['timestamp'] = timestamps[segment - 1]
             observations.append(args)
-    
-    return observations, chunk_timestamp
+    return observations
 
 
-def extract_observations(messages, on_progress=None, max_workers=10):
-    chunks = chunk_messages(messages)
-    total_chunks = len(chunks)
-    
-    if total_chunks == 0:
-        return []
-    
-    all_observations = [None] * total_chunks
+def plan_chunks(by_week, max_tokens=MAX_TOKENS, pack_tails=True):
+    plan = []
+    for week in sorted(by_week):
+        for chunk in chunk_messages(by_week[week], max_tokens):
+            tokens = sum(message_tokens(m) for m in chunk)
+            if pack_tails and plan and plan[-1]['tokens'] + tokens <= max_tokens:
+                plan[-1]['segments'].append((week, chunk))
+                plan[-1]['tokens'] += tokens
+            else:
+                plan.append({'segments': [(week, chunk)], 'tokens': tokens})
+    return plan
+
+
+async def aprocess_segments(segments):
+    response = await acomplete(observe_request(segments), stage='extract')
+    return parse_observations(response, segment_timestamps(segments))
+
+
+def extract_planned(plan, on_progress=None, max_workers=10):
+    pool = engine.TaskPool(max_workers)
+    for i, entry in enumerate(plan):
+        pool.submit(i, aprocess_segments(entry['segments']))
     
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_chunk, chunk): i for i, chunk in enumerate(chunks)}
-        completed = 0
+    finished = {}
+    next_index = 0
+    completed = 0
+    for i, observations in pool.completed():
+        finished[i] = observations
+        completed += 1
+        if on_progress:
+            segments = plan[i]['segments']
+            msgs_in_chunk = sum(len(chunk) for _, chunk in segments)
+            on_progress(completed, len(plan), msgs_in_chunk, segments[-1][1][-1].get('timestamp'), len(observations))
         
-        for future in as_completed(futures):
-            i = futures[future]
-            observations, chunk_timestamp = future.result()
-            all_observations[i] = observations
-            completed += 1
-            
-            if on_progress:
-                on_progress(completed, total_chunks, len(chunks[i]), chunk_timestamp, len(observations))
-    
-    return [obs for chunk_obs in all_observations for obs in chunk_obs]
+        while next_index in finished:
+            yield next_index, finished.pop(next_index)
+            next_index += 1
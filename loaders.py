@@ -1,10 +1,12 @@
 import json
 import os
+import hashlib
 from datetime import datetime
 from pathlib import Path
 from sqlalchemy import create_engine, text
 
 DEFAULT_OPENCLAW_PATH = Path.home() / '.openclaw' / 'agents' / 'main' / 'sessions'
+JSON_READ_SIZE = 1 << 20
 
 
 def get_week_key(timestamp_str):
@@ -15,6 +17,23 @@ def get_week_key(timestamp_str):
     return f'{year}-W{week:02d}'
 
 
+def message_hash(msg):
+    key = '\0'.join(str(msg.get(field) or '') for field in ('role', 'content', 'timestamp'))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def filter_new_messages(messages, known_hashes):
+    seen = set(known_hashes)
+    new_messages = []
+    for msg in messages:
+        h = message_hash(msg)
+        if h in seen:
+            continue
+        seen.add(h)
+        new_messages.append(msg)
+    return new_messages
+
+
 def group_messages_by_week(messages):
     by_week = {}
     for msg in messages:
@@ -63,30 +82,91 @@ def load_glenn_messages(source, conversation=None, user=None, limit=None):
     return messages, user_info
 
 
-def load_claude_messages(source, limit=None):
-    with open(source) as f:
-        data = json.load(f)
+def iter_json_array(f, read_size=JSON_READ_SIZE):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
     
-    messages = []
-    for conv in data:
-        for msg in conv.get('chat_messages', []):
-            sender = msg.get('sender', '')
-            role = 'user' if sender == 'human' else 'assistant'
-            timestamp = msg.get('created_at', '')
-            
-            content_parts = []
-            for content in msg.get('content', []):
-                if content.get('type') == 'text' and content.get('text'):
-                    content_parts.append(content['text'])
-            
-            if content_parts:
-                messages.append({
-                    'role': role,
-                    'content': '\n'.join(content_parts),
-                    'timestamp': timestamp
-                })
+    def fill(size):
+        nonlocal buffer, pos, eof
+        chunk = f.read(size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
     
-    messages.sort(key=lambda m: m.get('timestamp', ''))
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill(read_size)
+    
+    def expect(chars):
+        nonlocal pos
+        skip_whitespace()
+        if pos >= len(buffer) or buffer[pos] not in chars:
+            raise json.JSONDecodeError(f"Expected one of {chars!r}", buffer, pos)
+        pos += 1
+        return buffer[pos - 1]
+    
+    expect('[')
+    skip_whitespace()
+    if buffer.startswith(']', pos):
+        return
+    
+    while True:
+        skip_whitespace()
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                if end < len(buffer) or eof:
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            # Grow geometrically so one huge element isn't re-parsed once per read.
+            fill(max(read_size, len(buffer) - pos))
+        pos = end
+        yield item
+        if expect(',]') == ']':
+            return
+
+
+def parse_claude_conversation(conv):
+    messages = []
+    for msg in conv.get('chat_messages', []):
+        sender = msg.get('sender', '')
+        role = 'user' if sender == 'human' else 'assistant'
+        timestamp = msg.get('created_at', '')
+        
+        content_parts = []
+        for content in msg.get('content', []):
+            if content.get('type') == 'text' and content.get('text'):
+                content_parts.append(content['text'])
+        
+        if content_parts:
+            messages.append({
+                'role': role,
+                'content': '\n'.join(content_parts),
+                'timestamp': timestamp
+            })
+    return messages
+
+
+def iter_claude_messages(source, read_size=JSON_READ_SIZE):
+    with open(source) as f:
+        for conv in iter_json_array(f, read_size):
+            yield from parse_claude_conversation(conv)
+
+
+def load_claude_messages(source, limit=None):
+    # Only the JSON parse is streamed. Sorting by time needs every message, so
+    # the result is an in-memory list, as the import pipeline expects.
+    messages = sorted(iter_claude_messages(source), key=lambda m: m.get('timestamp', ''))
     if limit:
         messages = messages[:limit]
     return messages, None
@@ -1,7 +1,7 @@
 from datetime import timedelta, datetime, UTC
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from db import Summary, Observation, Model, get_session
-from llm import client, MODEL
+from llm import achat
+import engine
 
 
 TIME_BUCKETS = [
@@ -13,6 +13,19 @@ TIME_BUCKETS = [
     ('Earlier', None),
 ]
 
+ASSISTANT_VOICE = "first person (I, me, my) as the AI assistant reflecting on my own experience"
+NARRATIVE_VOICE = "third person narrative prose"
+
+SYNTHESIZE_SYSTEM_PROMPT = """You synthesize information about a mental model into a coherent narrative.
+
+Content is organized by recency. Rules:
+- Output MUST have these sections: Last 3 Days, This Week, This Month, This Quarter, This Year, Earlier
+- Only include sections that have content
+- Within each section, synthesize and deduplicate the information
+- Newer details override older ones (e.g., if age changes, use the most recent)
+- Write in {voice}
+- Each section should be self-contained but avoid repetition across sections"""
+
 
 def get_pyramid(session, model_id):
     summaries = session.query(Summary).filter_by(model_id=model_id)\
@@ -92,7 +105,7 @@ def get_non_overlapping_summaries(by_tier):
     return result
 
 
-def synthesize_model(name, description, by_tier, unsummarized_obs=None, ref_date=None):
+async def asynthesize_model(name, description, by_tier, unsummarized_obs=None, ref_date=None):
     all_items = get_non_overlapping_summaries(by_tier)
     
     if unsummarized_obs:
@@ -123,36 +136,31 @@ def synthesize_model(name, description, by_tier, unsummarized_obs=None, ref_date
     if not sections:
         return None
     
-    if name == 'assistant':
-        voice = "first person (I, me, my) as the AI assistant reflecting on my own experience"
-    else:
-        voice = "third person narrative prose"
+    voice = ASSISTANT_VOICE if name == 'assistant' else NARRATIVE_VOICE
     
-    prompt = f"""Synthesize this information about '{name}' into a coherent mental model.
-
+    prompt = f"""Model: {name}
 Model purpose: {description or 'Not specified'}
 Reference date: {ref_date:%Y-%m-%d}
 
-Content is organized by recency. Rules:
-- Output MUST have these sections: Last 3 Days, This Week, This Month, This Quarter, This Year, Earlier
-- Only include sections that have content
-- Within each section, synthesize and deduplicate the information
-- Newer details override older ones (e.g., if age changes, use the most recent)
-- Write in {voice}
-- Each section should be self-contained but avoid repetition across sections
-
 Content:
 {chr(10).join(sections)}
 
 Write a synthesized model of '{name}' with temporal sections:"""
 
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[{"role": "user", "content": prompt}]
+    response = await achat(
+        [
+            {"role": "system", "content": SYNTHESIZE_SYSTEM_PROMPT.format(voice=voice)},
+            {"role": "user", "content": prompt}
+        ],
+        stage='synthesize'
     )
     return response.choices[0].message.content.strip()
 
 
+def synthesize_model(name, description, by_tier, unsummarized_obs=None, ref_date=None):
+    return engine.run(asynthesize_model(name, description, by_tier, unsummarized_obs, ref_date))
+
+
 def prepare_model_data(session, model, ref_date=None):
     by_tier_raw = get_pyramid(session, model.id)
     unsummarized = get_unsummarized_observations(session, model.id, by_tier_raw)
@@ -172,10 +180,10 @@ def prepare_model_data(session, model, ref_date=None):
     }
 
 
-def synthesize_one_model(data):
+async def asynthesize_one_model(data):
     if not data['by_tier'] and not data['unsummarized']:
         return None
-    return synthesize_model(
+    return await asynthesize_model(
         data['name'],
         data['description'],
         data['by_tier'],
@@ -205,14 +213,11 @@ def synthesize_dirty_models(db_path, on_progress=None, max_workers=10, ref_date=
         model_data_list.append(data)
     
     results = {}
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(synthesize_one_model, data): data for data in model_data_list}
-        for i, future in enumerate(as_completed(futures), 1):
-            data = futures[future]
-            content = future.result()
-            results[data['model_id']] = content
-            if on_progress:
-                on_progress(f"  [{i}/{len(model_data_list)}] {data['name']}")
+    for i, (idx, content) in enumerate(engine.map_unordered(asynthesize_one_model, model_data_list, max_workers), 1):
+        data = model_data_list[idx]
+        results[data['model_id']] = content
+        if on_progress:
+            on_progress(f"  [{i}/{len(model_data_list)}] {data['name']}")
     
     for model in dirty_models:
         model.synthesized_content = results.get(model.id)
@@ -0,0 +1,259 @@
+import re
+import json
+import time
+import random
+import asyncio
+from tokens import rough_count, calibrate
+
+DEFAULT_RPM = 5000
+DEFAULT_TPM = 2000000
+DEFAULT_COMPLETION_TOKENS = 600
+MESSAGE_OVERHEAD_TOKENS = 4
+
+INITIAL_CONCURRENCY = 10
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 256
+LATENCY_SLOWDOWN_FACTOR = 2.0
+
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+def estimate_prompt_tokens(request):
+    if 'input' in request:
+        inputs = request['input'] if isinstance(request['input'], list) else [request['input']]
+        return sum(rough_count(text) for text in inputs)
+    tokens = sum(rough_count(m.get('content') or '') + MESSAGE_OVERHEAD_TOKENS for m in request.get('messages', []))
+    if request.get('tools'):
+        tokens += rough_count(json.dumps(request['tools']))
+    return tokens
+
+
+def estimate_request_tokens(request):
+    prompt = estimate_prompt_tokens(request)
+    if 'input' in request:
+        return prompt
+    return prompt + (request.get('max_tokens') or DEFAULT_COMPLETION_TOKENS)
+
+
+class TokenBucket:
+    def __init__(self, capacity, per_minute):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount):
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.level >= amount:
+                self.level -= amount
+                return
+            await asyncio.sleep((amount - self.level) / self.rate)
+
+    def adjust(self, delta):
+        self._refill()
+        self.level = min(self.capacity, self.level - delta)
+
+    def sync(self, limit=None, remaining=None):
+        self._refill()
+        if limit and limit != self.capacity:
+            self.capacity = limit
+            self.rate = limit / 60.0
+        if remaining is not None:
+            self.level = min(self.level, remaining)
+
+
+class AdaptiveConcurrency:
+    def __init__(self, initial=INITIAL_CONCURRENCY, minimum=MIN_CONCURRENCY, maximum=MAX_CONCURRENCY):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.avg_latency = None
+        self._last_decrease = 0.0
+        self._condition = None
+
+    def _get_condition(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        condition = self._get_condition()
+        async with condition:
+            while self.in_flight >= int(self.limit):
+                await condition.wait()
+            self.in_flight += 1
+
+    async def release(self, latency=None, throttled=False):
+        if throttled:
+            self._decrease()
+        elif latency is not None:
+            if self.avg_latency is not None and latency > self.avg_latency * LATENCY_SLOWDOWN_FACTOR:
+                self.limit = max(self.minimum, self.limit - 1)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.avg_latency = latency if self.avg_latency is None else 0.9 * self.avg_latency + 0.1 * latency
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if self.avg_latency is not None and now - self._last_decrease < self.avg_latency:
+            return
+        self.limit = max(self.minimum, self.limit / 2)
+        self._last_decrease = now
+
+
+class RateLimiter:
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, concurrency=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.buckets = {}
+        self.retries = 0
+        self.throttled = 0
+
+    def _buckets(self, model):
+        if model not in self.buckets:
+            self.buckets[model] = (TokenBucket(self.rpm, self.rpm), TokenBucket(self.tpm, self.tpm))
+        return self.buckets[model]
+
+    def _sync_headers(self, model, headers):
+        requests, tokens = self._buckets(model)
+        requests.sync(_header_int(headers, 'x-ratelimit-limit-requests'), _header_int(headers, 'x-ratelimit-remaining-requests'))
+        tokens.sync(_header_int(headers, 'x-ratelimit-limit-tokens'), _header_int(headers, 'x-ratelimit-remaining-tokens'))
+
+    async def call(self, model, request, send, info=None):
+        import openai
+        retryable = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+        requests, tokens = self._buckets(model)
+        prompt_estimate = estimate_prompt_tokens(request)
+        estimate = estimate_request_tokens(request)
+
+        for attempt in range(MAX_RETRIES + 1):
+            await requests.acquire(1)
+            await tokens.acquire(estimate)
+            await self.concurrency.acquire()
+            started = time.monotonic()
+            try:
+                raw = await send()
+            except retryable as e:
+                # A failed attempt used no tokens, so its reservation is refunded
+                tokens.adjust(-estimate)
+                throttled = isinstance(e, openai.RateLimitError)
+                await self.concurrency.release(throttled=throttled)
+                headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+                self._sync_headers(model, headers)
+                if throttled:
+                    self.throttled += 1
+                if attempt == MAX_RETRIES:
+                    if info is not None:
+                        info['retries'] = attempt
+                    raise
+                self.retries += 1
+                await asyncio.sleep(_retry_delay(headers, attempt))
+                continue
+            except BaseException:
+                tokens.adjust(-estimate)
+                await self.concurrency.release()
+                if info is not None:
+                    info['retries'] = attempt
+                raise
+
+            latency = time.monotonic() - started
+            await self.concurrency.release(latency=latency)
+            if info is not None:
+                info['retries'] = attempt
+                info['latency'] = latency
+            self._sync_headers(model, raw.headers)
+            response = raw.parse()
+            usage = getattr(response, 'usage', None)
+            if usage is not None and getattr(usage, 'total_tokens', None):
+                tokens.adjust(usage.total_tokens - estimate)
+                if 'input' not in request and getattr(usage, 'prompt_tokens', None):
+                    calibrate(prompt_estimate, usage.prompt_tokens)
+            return response
+
+    def stats(self):
+        return {
+            'concurrency': int(self.concurrency.limit),
+            'retries': self.retries,
+            'throttled': self.throttled,
+        }
+
+
+def _header_int(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _retry_delay(headers, attempt):
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = parse_duration(headers.get('retry-after'))
+    if retry_after is not None:
+        return retry_after
+    reset = parse_duration(headers.get('x-ratelimit-reset-requests')) or parse_duration(headers.get('x-ratelimit-reset-tokens'))
+    backoff = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    if reset is not None:
+        backoff = min(backoff, max(reset, 0.1))
+    return backoff * (0.5 + random.random())
+
+
+_limiter = None
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter()
+    return _limiter
+
+
+def set_limiter(limiter):
+    global _limiter
+    _limiter = limiter
+
+
+def seed_concurrency(workers):
+    # Start the adaptive limit at the caller's worker count (--parallel)
+    # instead of INITIAL_CONCURRENCY; it still adapts from there
+    concurrency = get_limiter().concurrency
+    concurrency.limit = float(min(concurrency.maximum, max(concurrency.minimum, workers)))
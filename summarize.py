@@ -1,11 +1,29 @@
 import json
+import asyncio
+import hashlib
 from datetime import datetime, UTC
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from sqlalchemy import func
-from db import get_session, Observation, Summary, SummarySource, Model, BASE_MODELS
-from llm import client, MODEL, MAX_TOKENS, CHARS_PER_TOKEN, estimate_tokens
+from sqlalchemy import func, or_, and_, exists, select, tuple_
+from db import get_session, vec_connection, Observation, Summary, SummarySource, Model, BASE_MODELS
+from llm import achat, acomplete, build_request, MAX_TOKENS, estimate_tokens
+from embeddings import (
+    embed_many, init_memory_vec, store_embeddings, enrich_for_embedding, get_observation_embeddings,
+    init_centroids, update_centroids, rebuild_centroids, nearest_centroids
+)
+import engine
 
 STEP = 10
+REDUCE_FANOUT = 10
+
+# Embedding fast path: an observation goes straight to its nearest model when
+# that centroid is similar enough and beats the runner-up by the margin.
+ASSIGN_MARGIN = 0.05
+ASSIGN_MIN_SIMILARITY = 0.45
+CENTROID_MIN_OBSERVATIONS = 10
+
+# Dirty summaries whose stored text still matches their old inputs are patched
+# with only the delta, until too much has changed or too many patches pile up.
+PATCH_MAX_FRACTION = 0.5
+PATCH_MAX_CONSECUTIVE = 3
 
 SUMMARIZE_SYSTEM_PROMPT = """You are a memory agent creating summaries.
 
@@ -15,6 +33,19 @@ Write in clear, readable narrative prose. Convey importance through word choice
 Preserve specific facts: names, dates, numbers, places.
 Organize related information into coherent paragraphs."""
 
+BASE_MODELS_TEXT = "\n".join(f"- {name}: {desc}" for name, desc in BASE_MODELS.items())
+
+ASSIGN_SYSTEM_PROMPT = f"""You assign observations to mental models. Call assign_model for each observation.
+
+Base models:
+{BASE_MODELS_TEXT}
+
+Create new models for distinct entities (specific people, projects, topics) only when you see 
+multiple observations about them in the current batch. If an observation doesn't fit well 
+anywhere, you may leave it unassigned by not calling assign_model for it.
+
+Assign each observation to the most appropriate model based on the models and examples below."""
+
 ASSIGN_MODEL_TOOL = {
     "type": "function", 
     "function": {
@@ -32,84 +63,172 @@ ASSIGN_MODEL_TOOL = {
 }
 
 
-def get_models_context(session, include_samples=True):
-    models = session.query(Model).all()
-    lines = ["Available models:"]
-    for m in models:
-        lines.append(f"\n### {m.name}")
-        lines.append(f"Purpose: {m.description or '(undefined)'}")
-        
-        if include_samples:
-            samples = session.query(Observation).filter(
-                Observation.model_id == m.id
-            ).order_by(Observation.timestamp.desc()).limit(5).all()
-            
-            if samples:
-                lines.append("Examples:")
-                for s in samples:
-                    lines.append(f"  - {s.text}")
-    
+def render_model_context(session, model, include_samples=True):
+    lines = [f"\n### {model.name}", f"Purpose: {model.description or '(undefined)'}"]
+    if include_samples:
+        samples = session.query(Observation.text).filter(
+            Observation.model_id == model.id
+        ).order_by(Observation.timestamp.desc()).limit(5).all()
+        if samples:
+            lines.append("Examples:")
+            for (text,) in samples:
+                lines.append(f"  - {text}")
     return "\n".join(lines)
 
 
-def assign_models_to_observations(session, observations, on_progress=None):
-    if not observations:
-        return
+def get_models_context(session, include_samples=True):
+    if not include_samples:
+        blocks = [render_model_context(session, m, False) for m in session.query(Model).order_by(Model.id)]
+        return "\n".join(["Available models:", *blocks])
+    
+    # Rendered blocks are stored on the model and only rebuilt for models
+    # flagged context_dirty (new observations or a changed description).
+    stale = session.query(Model).filter((Model.context_dirty == True) | (Model.context_block == None)).all()
+    for model in stale:
+        model.context_block = render_model_context(session, model)
+        model.context_dirty = False
+    if stale:
+        session.commit()
     
-    base_models_text = "\n".join(f"- {name}: {desc}" for name, desc in BASE_MODELS.items())
-    system_prompt = f"""You assign observations to mental models. Call assign_model for each observation.
+    blocks = [block for (block,) in session.query(Model.context_block).order_by(Model.id)]
+    return "\n".join(["Available models:", *blocks])
 
-Base models:
-{base_models_text}
 
-Create new models for distinct entities (specific people, projects, topics) only when you see 
-multiple observations about them in the current batch. If an observation doesn't fit well 
-anywhere, you may leave it unassigned by not calling assign_model for it."""
+def assign_request(system_prompt, batch, new_model_names):
+    obs_text = "\n".join(f"[{obs.id}] {obs.text}" for obs in batch)
+    prompt = f"Observations to assign:\n{obs_text}"
+    if new_model_names:
+        prompt = f"Models created earlier in this run: {', '.join(new_model_names)}\n\n{prompt}"
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ]
 
-    for i in range(0, len(observations), STEP):
-        batch = observations[i:i + STEP]
-        
-        models_context = get_models_context(session, include_samples=True)
-        obs_text = "\n".join(f"[{obs.id}] {obs.text}" for obs in batch)
-        
-        prompt = f"""{models_context}
 
-Assign each observation to the most appropriate model based on the examples shown.
+def parse_assignments(response):
+    assignments = []
+    for tool_call in response.choices[0].message.tool_calls or []:
+        if tool_call.function.name == "assign_model":
+            args = json.loads(tool_call.function.arguments)
+            model_name = args['model_name'].lower().strip().replace(' ', '-')
+            assignments.append((args['observation_id'], model_name))
+    return assignments
 
-Observations to assign:
-{obs_text}"""
 
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            tools=[ASSIGN_MODEL_TOOL],
-            tool_choice="auto"
-        )
-        
-        for tool_call in response.choices[0].message.tool_calls or []:
-            if tool_call.function.name == "assign_model":
-                args = json.loads(tool_call.function.arguments)
-                obs_id = args['observation_id']
-                model_name = args['model_name'].lower().strip().replace(' ', '-')
-                
-                model = session.query(Model).filter_by(name=model_name).first()
-                if not model:
-                    model = Model(name=model_name, is_base=False, content_dirty=True)
-                    session.add(model)
-                    session.flush()
-                
-                obs = session.query(Observation).get(obs_id)
-                if obs:
-                    obs.model_id = model.id
-                    model.content_dirty = True
+def apply_assignments(session, updates):
+    if not updates:
+        return
+    session.bulk_update_mappings(Observation, [{'id': obs_id, 'model_id': model_id} for obs_id, model_id in updates.items()])
+    session.query(Model).filter(Model.id.in_(set(updates.values()))).update({'content_dirty': True, 'context_dirty': True}, synchronize_session=False)
+    
+    # Observations landing behind a model's tier-0 watermark will not be
+    # picked up by planning. Regenerate the summary whose range covers one;
+    # when none does (an older export, a gap between windows) move the
+    # watermark back so planning gives it a window of its own.
+    obs_ids = list(updates)
+    for i in range(0, len(obs_ids), 500):
+        backdated = session.query(Observation.id, Observation.model_id, Observation.timestamp).join(
+            Model, Observation.model_id == Model.id
+        ).filter(Observation.id.in_(obs_ids[i:i + 500]), ~past_tier0_watermark()).all()
+        for obs_id, model_id, timestamp in backdated:
+            if not mark_overlapping_summaries_dirty(session, model_id, timestamp):
+                rewind_tier0_watermark(session, model_id, timestamp, obs_id)
+
+
+def confident_model(candidates, margin=ASSIGN_MARGIN, min_similarity=ASSIGN_MIN_SIMILARITY):
+    if len(candidates) < 2:
+        return None
+    (best_id, best), (_, runner_up) = candidates[0], candidates[1]
+    if best >= min_similarity and best - runner_up >= margin:
+        return best_id
+    return None
+
+
+def embed_observations(conn, observations, max_workers=10):
+    embeddings = get_observation_embeddings(conn, [obs.id for obs in observations])
+    missing = [obs for obs in observations if obs.id not in embeddings]
+    if missing:
+        items = [('observation', obs.id, enrich_for_embedding(obs.text, obs.timestamp)) for obs in missing]
+        vectors = embed_many([item[2] for item in items], max_workers=max_workers)
+        store_embeddings(conn, items, vectors)
+        embeddings.update((obs.id, vector) for obs, vector in zip(missing, vectors))
+    return embeddings
+
+
+def fast_assign_observations(session, conn, observations, margin=ASSIGN_MARGIN, min_similarity=ASSIGN_MIN_SIMILARITY, max_workers=10):
+    # Returns the observations left for the LLM plus every embedding, so the
+    # caller can fold the LLM's assignments into the centroids afterwards.
+    init_centroids(conn)
+    if conn.execute("SELECT COUNT(*) FROM model_centroids").fetchone()[0] == 0:
+        rebuild_centroids(conn)
+    
+    embeddings = embed_observations(conn, observations, max_workers)
+    updates = {}
+    remaining = []
+    for obs in observations:
+        candidates = nearest_centroids(conn, embeddings[obs.id], CENTROID_MIN_OBSERVATIONS)
+        model_id = confident_model(candidates, margin, min_similarity)
+        if model_id is None:
+            remaining.append(obs)
+        else:
+            updates[obs.id] = model_id
+    
+    apply_assignments(session, updates)
+    session.commit()
+    update_centroids(conn, [(model_id, embeddings[obs_id]) for obs_id, model_id in updates.items()])
+    return remaining, embeddings
+
+
+def assign_models_to_observations(session, observations, on_progress=None, max_workers=10):
+    if not observations:
+        return
+    
+    # Every batch is sent against one snapshot of the model list, so all
+    # requests share a system prompt and can run concurrently. Names created
+    # by batches that finished before a request was sent go in its user
+    # message; the same name from concurrent batches reconciles to one model.
+    system_prompt = f"""{ASSIGN_SYSTEM_PROMPT}
+
+{get_models_context(session, include_samples=True)}"""
+    model_ids = {m.name: m.id for m in session.query(Model).all()}
+    created = []
+    pending_ids = {obs.id for obs in observations}
+    batches = [observations[i:i + STEP] for i in range(0, len(observations), STEP)]
+    
+    pool = engine.TaskPool(max_workers)
+    submitted = 0
+    
+    def submit_next():
+        nonlocal submitted
+        batch = batches[submitted]
+        messages = assign_request(system_prompt, batch, created)
+        pool.submit(submitted, achat(messages, tools=[ASSIGN_MODEL_TOOL], tool_choice="auto", stage='assign'))
+        submitted += 1
+    
+    while submitted < min(max_workers, len(batches)):
+        submit_next()
+    
+    for done, (_, response) in enumerate(pool.completed(), 1):
+        updates = {}
+        for obs_id, model_name in parse_assignments(response):
+            if obs_id not in pending_ids:
+                continue
+            if model_name not in model_ids:
+                model = Model(name=model_name, is_base=False, content_dirty=True)
+                session.add(model)
+                session.flush()
+                model_ids[model_name] = model.id
+                created.append(model_name)
+            updates[obs_id] = model_ids[model_name]
         
+        apply_assignments(session, updates)
+        pending_ids -= updates.keys()
         session.commit()
         
+        if submitted < len(batches):
+            submit_next()
         if on_progress:
-            on_progress(f"  Assigned batch {i//STEP + 1}/{(len(observations) + STEP - 1)//STEP}")
+            on_progress(f"  Assigned batch {done}/{len(batches)}")
 
 
 def mark_model_dirty(session, model_id):
@@ -139,27 +258,15 @@ def record_summary_sources(session, summary, source_type, source_ids):
         ))
 
 
-def propagate_dirty_upward(session, summary):
-    parent_summaries = session.query(Summary).join(SummarySource).filter(
-        SummarySource.source_type == 'summary',
-        SummarySource.source_id == summary.id
-    ).all()
-    for parent in parent_summaries:
-        parent.is_dirty = True
+def input_fingerprint(source_type, sources):
+    # sources: ordered (id, text) pairs the summary is generated from
+    payload = json.dumps([source_type, [[source_id, text] for source_id, text in sources]])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
 
 
-def get_observations_by_model(session):
-    observations = session.query(Observation).filter(
-        Observation.model_id != None
-    ).order_by(Observation.timestamp).all()
-    
-    by_model = {}
-    for obs in observations:
-        if obs.model_id not in by_model:
-            by_model[obs.model_id] = []
-        by_model[obs.model_id].append(obs)
-    
-    return by_model
+def set_parent(session, summary, child_ids):
+    if child_ids:
+        session.query(Summary).filter(Summary.id.in_(child_ids)).update({'parent_id': summary.id}, synchronize_session=False)
 
 
 def chunk_observations(observations, max_tokens=MAX_TOKENS):
@@ -168,7 +275,7 @@ def chunk_observations(observations, max_tokens=MAX_TOKENS):
     current_tokens = 0
     
     for obs in observations:
-        obs_tokens = estimate_tokens(obs.text)
+        obs_tokens = estimate_tokens(f"- {obs.text}\n")
         if current_tokens + obs_tokens > max_tokens and current_chunk:
             chunks.append(current_chunk)
             current_chunk = []
@@ -182,155 +289,218 @@ def chunk_observations(observations, max_tokens=MAX_TOKENS):
     return chunks
 
 
-def summarize_observations(observations, model_name, model_description):
-    chunks = chunk_observations(observations)
+def group_for_reduce(texts, max_tokens=MAX_TOKENS, fanout=REDUCE_FANOUT):
+    groups = []
+    current = []
+    current_tokens = 0
     
-    if len(chunks) == 1:
-        return summarize_chunk(chunks[0], model_name, model_description)
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and len(current) >= 2 and (current_tokens + tokens > max_tokens or len(current) >= fanout):
+            groups.append(current)
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += tokens
+    
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])
+        else:
+            groups.append(current)
     
-    chunk_summaries = [summarize_chunk(chunk, model_name, model_description) for chunk in chunks]
-    combined = "\n\n---\n\n".join(chunk_summaries)
+    return groups
+
+
+async def acombine_summaries(texts, model_name, model_description):
+    combined = "\n\n---\n\n".join(texts)
     
     system = f"""{SUMMARIZE_SYSTEM_PROMPT}
 
-Model: {model_name}
-Purpose: {model_description}
+Combine the following partial summaries into one coherent narrative.
 
-Combine the following partial summaries into one coherent narrative."""
+Model: {model_name}
+Purpose: {model_description}"""
 
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[
+    response = await achat(
+        [
             {"role": "system", "content": system},
             {"role": "user", "content": combined}
-        ]
+        ],
+        stage='summarize'
     )
     return response.choices[0].message.content
 
 
-def summarize_chunk(observations, model_name, model_description):
+async def asummarize_observations(observations, model_name, model_description):
+    chunks = chunk_observations(observations)
+    
+    if len(chunks) == 1:
+        return await asummarize_chunk(chunks[0], model_name, model_description)
+    
+    # Map every chunk concurrently, then combine level by level so a wide
+    # window takes O(log n) sequential rounds instead of one call per chunk.
+    texts = await asyncio.gather(*(asummarize_chunk(chunk, model_name, model_description) for chunk in chunks))
+    while len(texts) > 1:
+        groups = group_for_reduce(texts)
+        texts = await asyncio.gather(*(acombine_summaries(group, model_name, model_description) for group in groups))
+    return texts[0]
+
+
+def summarize_chunk_request(observations, model_name, model_description):
     obs_text = "\n".join(f"- {obs.text}" for obs in observations)
     
     system = f"""{SUMMARIZE_SYSTEM_PROMPT}
 
-Model: {model_name}
-Purpose: {model_description}
+Only include information relevant to this model's purpose. If an observation seems misplaced, you may omit it.
 
-Only include information relevant to this model's purpose. If an observation seems misplaced, you may omit it."""
+Model: {model_name}
+Purpose: {model_description}"""
 
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[
+    return build_request(
+        [
             {"role": "system", "content": system},
             {"role": "user", "content": f"Summarize these observations:\n\n{obs_text}"}
         ]
     )
+
+
+async def asummarize_chunk(observations, model_name, model_description):
+    response = await acomplete(summarize_chunk_request(observations, model_name, model_description), stage='summarize')
     return response.choices[0].message.content
 
 
-def summarize_summaries(summaries, model_name, model_description):
-    text = "\n\n---\n\n".join(s.text for s in summaries)
-    
+async def apatch_summary(existing, update, model_name, model_description, saved_tokens=0):
     system = f"""{SUMMARIZE_SYSTEM_PROMPT}
 
+Update the existing summary with the new material. Keep what is still accurate, work the new 
+facts in where they belong, and return the complete updated summary.
+
 Model: {model_name}
-Purpose: {model_description}
+Purpose: {model_description}"""
+
+    response = await achat(
+        [
+            {"role": "system", "content": system},
+            {"role": "user", "content": f"Existing summary:\n\n{existing}\n\n{update}"}
+        ],
+        stage='summarize',
+        saved_tokens=saved_tokens
+    )
+    return response.choices[0].message.content
+
+
+async def asummarize_summaries(texts, model_name, model_description):
+    text = "\n\n---\n\n".join(texts)
+    
+    system = f"""{SUMMARIZE_SYSTEM_PROMPT}
 
-Combine these summaries into one higher-level narrative, preserving key facts and themes."""
+Combine these summaries into one higher-level narrative, preserving key facts and themes.
 
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[
+Model: {model_name}
+Purpose: {model_description}"""
+
+    response = await achat(
+        [
             {"role": "system", "content": system},
             {"role": "user", "content": text}
-        ]
+        ],
+        stage='summarize'
     )
     return response.choices[0].message.content
 
 
-def process_dirty_tier0(db_path, on_progress=None, max_workers=10):
-    session = get_session(db_path)
-    
-    dirty_summaries = session.query(Summary).filter(
-        Summary.tier == 0,
-        Summary.is_dirty == True
-    ).all()
+def assign_pending_observations(session, on_progress=None, max_obs=None, start_id=None, max_workers=10,
+                                vec_conn=None, margin=ASSIGN_MARGIN):
+    query = session.query(Observation).filter(Observation.model_id == None)
+    if start_id:
+        query = query.filter(Observation.id >= start_id)
+    unassigned = query.order_by(Observation.id).all()
     
-    if not dirty_summaries:
-        session.close()
+    if not unassigned:
         return 0
     
+    if max_obs:
+        unassigned = unassigned[:max_obs]
     if on_progress:
-        on_progress(f"Regenerating {len(dirty_summaries)} dirty tier-0 summaries...")
-    
-    def process_one(summary_id):
-        s = get_session(db_path)
-        summary = s.query(Summary).get(summary_id)
-        model = summary.model
-        
-        observations = s.query(Observation).filter(
-            Observation.model_id == summary.model_id,
-            Observation.timestamp >= summary.start_timestamp,
-            Observation.timestamp <= summary.end_timestamp
-        ).order_by(Observation.timestamp).all()
-        
-        new_text = summarize_observations(observations, model.name, model.description or '')
-        obs_ids = [o.id for o in observations]
-        s.close()
-        return summary_id, new_text, obs_ids
+        on_progress(f"Assigning {len(unassigned)} observations (IDs {unassigned[0].id}-{unassigned[-1].id}) to models...")
     
-    results = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_one, s.id): s for s in dirty_summaries}
-        for i, future in enumerate(as_completed(futures), 1):
-            results.append(future.result())
-            if on_progress:
-                on_progress(f"  [{i}/{len(dirty_summaries)}] regenerated")
-    
-    for summary_id, new_text, obs_ids in results:
-        summary = session.query(Summary).get(summary_id)
-        summary.text = new_text
-        summary.is_dirty = False
-        
-        session.query(SummarySource).filter_by(summary_id=summary_id).delete()
-        record_summary_sources(session, summary, 'observation', obs_ids)
-        
-        propagate_dirty_upward(session, summary)
-        mark_model_dirty(session, summary.model_id)
+    if vec_conn is None:
+        assign_models_to_observations(session, unassigned, on_progress, max_workers)
+        return len(unassigned)
     
-    session.commit()
-    session.close()
-    return len(results)
+    remaining, embeddings = fast_assign_observations(session, vec_conn, unassigned, margin, max_workers=max_workers)
+    skipped = len(unassigned) - len(remaining)
+    if on_progress:
+        on_progress(f"  Fast path assigned {skipped}/{len(unassigned)} observations without the LLM ({skipped / len(unassigned):.0%} skip rate)")
+    
+    remaining_ids = [obs.id for obs in remaining]
+    assign_models_to_observations(session, remaining, on_progress, max_workers)
+    assigned = session.query(Observation.id, Observation.model_id).filter(
+        Observation.id.in_(remaining_ids), Observation.model_id != None
+    ).all() if remaining_ids else []
+    update_centroids(vec_conn, [(model_id, embeddings[obs_id]) for obs_id, model_id in assigned])
+    return len(unassigned)
+
+
+def open_vec_connection(db_path):
+    conn = vec_connection(db_path)
+    init_memory_vec(conn)
+    init_centroids(conn)
+    return conn
+
+
+def init_tier0_watermarks(session):
+    # Databases from before watermarks: place each model's watermark on the
+    # last observation its existing tier-0 summaries cover (once per model).
+    counts = dict(session.query(Summary.model_id, func.count(Summary.id)).filter(
+        Summary.tier == 0
+    ).group_by(Summary.model_id).all())
+    models = session.query(Model).filter(Model.tier0_watermark_id == None, Model.id.in_(counts.keys())).all()
+    for model in models:
+        last = session.query(Observation).filter(
+            Observation.model_id == model.id
+        ).order_by(Observation.timestamp, Observation.id).offset(counts[model.id] * STEP - 1).first()
+        if last:
+            model.tier0_watermark_ts = last.timestamp
+            model.tier0_watermark_id = last.id
+    if models:
+        session.commit()
 
 
-def run_tier0_summarization(db_path, on_progress=None, max_workers=10, max_obs=None, start_id=None):
-    session = get_session(db_path)
-    
-    query = session.query(Observation).filter(Observation.model_id == None)
-    if start_id:
-        query = query.filter(Observation.id >= start_id)
-    unassigned = query.order_by(Observation.id).all()
-    
-    if unassigned:
-        if max_obs:
-            unassigned = unassigned[:max_obs]
-        if on_progress:
-            on_progress(f"Assigning {len(unassigned)} observations (IDs {unassigned[0].id}-{unassigned[-1].id}) to models...")
-        assign_models_to_observations(session, unassigned, on_progress)
-    
-    by_model = get_observations_by_model(session)
+def past_tier0_watermark():
+    return or_(
+        Model.tier0_watermark_id == None,
+        Observation.timestamp > Model.tier0_watermark_ts,
+        and_(Observation.timestamp == Model.tier0_watermark_ts, Observation.id > Model.tier0_watermark_id)
+    )
+
+
+def rewind_tier0_watermark(session, model_id, timestamp, obs_id):
+    # The watermark is a (timestamp, id) position; (ts, id - 1) sits just
+    # before the observation. Covered observations after it are skipped by
+    # the planner's source check.
+    model = session.get(Model, model_id)
+    if (timestamp, obs_id - 1) < (model.tier0_watermark_ts, model.tier0_watermark_id):
+        model.tier0_watermark_ts = timestamp
+        model.tier0_watermark_id = obs_id - 1
+
+
+def plan_tier0_tasks(session):
+    init_tier0_watermarks(session)
     
+    # One range query per model on ix_observations_model_timestamp. Only a
+    # rewound watermark leaves already-summarized observations in the range.
     tasks = []
-    for model_id, observations in by_model.items():
-        model = session.query(Model).get(model_id)
-        
-        existing_count = session.query(Summary).filter(
-            Summary.tier == 0,
-            Summary.model_id == model_id
-        ).count()
-        
-        summarized_obs_count = existing_count * STEP
-        unsummarized = observations[summarized_obs_count:]
+    for model in session.query(Model).order_by(Model.id).all():
+        query = session.query(Observation).filter(
+            Observation.model_id == model.id,
+            ~exists().where(SummarySource.source_type == 'observation', SummarySource.source_id == Observation.id)
+        )
+        if model.tier0_watermark_id is not None:
+            query = query.filter(tuple_(Observation.timestamp, Observation.id) > tuple_(model.tier0_watermark_ts, model.tier0_watermark_id))
+        unsummarized = query.order_by(Observation.timestamp, Observation.id).all()
+        model_id = model.id
         
         for i in range(0, len(unsummarized) - STEP + 1, STEP):
             chunk = unsummarized[i:i + STEP]
@@ -339,219 +509,378 @@ def run_tier0_summarization(db_path, on_progress=None, max_workers=10, max_obs=N
             
             tasks.append((model_id, model.name, model.description, chunk, start_ts, end_ts))
     
-    if not tasks:
-        session.close()
-        return 0
-    
-    if on_progress:
-        on_progress(f"Creating {len(tasks)} tier 0 summaries...")
-    
-    def process_task(task):
-        model_id, model_name, model_desc, obs_chunk, start_ts, end_ts = task
-        summary_text = summarize_observations(obs_chunk, model_name, model_desc or '')
-        obs_ids = [o.id for o in obs_chunk]
-        return (model_id, summary_text, start_ts, end_ts, obs_ids)
-    
-    results = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_task, task): task for task in tasks}
-        for i, future in enumerate(as_completed(futures), 1):
-            results.append(future.result())
-            if on_progress:
-                on_progress(f"  [{i}/{len(tasks)}] completed")
-    
+    return tasks
+
+
+def save_tier0_summaries(session, results):
+    watermarks = {}
+    all_ids = [obs_id for *_, obs_ids in results for obs_id in obs_ids]
+    rows = {}
+    for i in range(0, len(all_ids), 500):
+        rows.update((row[0], row) for row in session.query(Observation.id, Observation.timestamp, Observation.text).filter(Observation.id.in_(all_ids[i:i + 500])))
     for model_id, summary_text, start_ts, end_ts, obs_ids in results:
+        ordered = sorted((rows[obs_id] for obs_id in obs_ids if obs_id in rows), key=lambda r: (r[1], r[0]))
         summary = Summary(
             model_id=model_id,
             tier=0,
             text=summary_text,
             start_timestamp=start_ts,
             end_timestamp=end_ts,
-            is_dirty=False
+            is_dirty=False,
+            input_hash=input_fingerprint('observation', [(obs_id, text) for obs_id, _, text in ordered])
         )
         session.add(summary)
         session.flush()
         
         record_summary_sources(session, summary, 'observation', obs_ids)
         mark_model_dirty(session, model_id)
+        watermarks[model_id] = max(watermarks.get(model_id, (end_ts, obs_ids[-1])), (end_ts, obs_ids[-1]))
+    
+    for model_id, (ts, obs_id) in watermarks.items():
+        model = session.get(Model, model_id)
+        if model.tier0_watermark_id is None or (ts, obs_id) > (model.tier0_watermark_ts, model.tier0_watermark_id):
+            model.tier0_watermark_ts = ts
+            model.tier0_watermark_id = obs_id
     
     session.commit()
-    session.close()
     return len(results)
 
 
-def run_higher_tier_summarization(db_path, on_progress=None, max_workers=10, max_tier=None):
+def summarize_tier0_tasks(tasks, on_progress=None, max_workers=10):
+    pool = engine.TaskPool(max_workers)
+    for model_id, model_name, model_desc, obs_chunk, start_ts, end_ts in tasks:
+        obs_ids = [o.id for o in obs_chunk]
+        pool.submit((model_id, start_ts, end_ts, obs_ids), asummarize_observations(obs_chunk, model_name, model_desc or ''))
+    
+    results = []
+    for i, ((model_id, start_ts, end_ts, obs_ids), summary_text) in enumerate(pool.completed(), 1):
+        results.append((model_id, summary_text, start_ts, end_ts, obs_ids))
+        if on_progress:
+            on_progress(f"  [{i}/{len(tasks)}] completed")
+    return results
+
+
+def run_tier0_summarization(db_path, on_progress=None, max_workers=10, max_obs=None, start_id=None, assign_margin=ASSIGN_MARGIN):
     session = get_session(db_path)
-    models = session.query(Model).all()
     
-    total_created = 0
-    tier = 0
+    vec_conn = open_vec_connection(db_path) if assign_margin is not None else None
+    try:
+        assign_pending_observations(session, on_progress, max_obs, start_id, max_workers, vec_conn, assign_margin)
+    finally:
+        if vec_conn is not None:
+            vec_conn.close()
+    tasks = plan_tier0_tasks(session)
     
-    while True:
-        if max_tier is not None and tier >= max_tier:
-            break
-            
-        tasks = []
-        
-        for model in models:
-            summaries = session.query(Summary).filter(
-                Summary.model_id == model.id,
-                Summary.tier == tier
-            ).order_by(Summary.start_timestamp).all()
-            
-            unsummarized = []
-            for s in summaries:
-                already_summarized = session.query(Summary).filter(
-                    Summary.model_id == model.id,
-                    Summary.tier == tier + 1,
-                    Summary.start_timestamp <= s.start_timestamp,
-                    Summary.end_timestamp >= s.end_timestamp
-                ).first()
-                if not already_summarized:
-                    unsummarized.append(s)
-            
-            if len(unsummarized) < STEP:
-                continue
-            
-            for i in range(0, len(unsummarized) - STEP + 1, STEP):
-                chunk = unsummarized[i:i + STEP]
-                start_ts = chunk[0].start_timestamp
-                end_ts = chunk[-1].end_timestamp
-                
-                existing = session.query(Summary).filter(
-                    Summary.model_id == model.id,
-                    Summary.tier == tier + 1,
-                    Summary.start_timestamp == start_ts,
-                    Summary.end_timestamp == end_ts
-                ).first()
-                
-                if existing:
-                    continue
-                
-                tasks.append((model.id, model.name, model.description, tier + 1, start_ts, end_ts, chunk))
-        
-        if not tasks:
-            break
-        
-        if on_progress:
-            on_progress(f"T{tier + 1}: {len(tasks)} summaries across models...")
-        
-        def process_task(task):
-            model_id, model_name, model_desc, new_tier, start_ts, end_ts, chunk = task
-            summary_text = summarize_summaries(chunk, model_name, model_desc or '')
-            child_ids = [s.id for s in chunk]
-            return (model_id, new_tier, start_ts, end_ts, summary_text, child_ids)
-        
-        results = []
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(process_task, task): task for task in tasks}
-            for i, future in enumerate(as_completed(futures), 1):
-                results.append(future.result())
-                if on_progress:
-                    on_progress(f"  [{i}/{len(tasks)}] completed")
-        
-        for model_id, new_tier, start_ts, end_ts, summary_text, child_ids in results:
-            summary = Summary(
-                model_id=model_id,
-                tier=new_tier,
-                text=summary_text,
-                start_timestamp=start_ts,
-                end_timestamp=end_ts,
-                is_dirty=False
-            )
-            session.add(summary)
-            session.flush()
-            
-            record_summary_sources(session, summary, 'summary', child_ids)
-            mark_model_dirty(session, model_id)
-            total_created += 1
-        
-        session.commit()
-        tier += 1
+    if not tasks:
+        session.close()
+        return 0
     
+    if on_progress:
+        on_progress(f"Creating {len(tasks)} tier 0 summaries...")
+    
+    results = summarize_tier0_tasks(tasks, on_progress, max_workers)
+    created = save_tier0_summaries(session, results)
     session.close()
-    return total_created
+    return created
+
+
+def plan_higher_tiers(session, max_tier=None):
+    # Every summary without a parent is a candidate child. Each full window of
+    # STEP becomes a node for the tier above, and planned nodes feed the next
+    # tier's windows in turn, so the whole build is known before any call.
+    unparented = session.query(Summary).filter(Summary.parent_id == None).order_by(
+        Summary.model_id, Summary.tier, Summary.start_timestamp
+    ).all()
+    
+    levels = {}
+    for s in unparented:
+        levels.setdefault(s.model_id, {}).setdefault(s.tier, []).append(
+            {'key': ('summary', s.id), 'start': s.start_timestamp, 'end': s.end_timestamp, 'text': s.text}
+        )
+    
+    nodes = []
+    for model_id, by_tier in levels.items():
+        # A tier with nothing unparented (e.g. left by an earlier --max-tier
+        # run) must not stop the tiers above it from building.
+        tier = min(by_tier)
+        while tier <= max(by_tier) and (max_tier is None or tier < max_tier):
+            entries = sorted(by_tier.get(tier, []), key=lambda e: e['start'])
+            for i in range(0, len(entries) - STEP + 1, STEP):
+                children = entries[i:i + STEP]
+                node = {
+                    'key': ('new', model_id, tier + 1, i // STEP),
+                    'model_id': model_id,
+                    'tier': tier + 1,
+                    'start': children[0]['start'],
+                    'end': children[-1]['end'],
+                    'children': children,
+                    'text': None,
+                }
+                nodes.append(node)
+                by_tier.setdefault(tier + 1, []).append(node)
+            tier += 1
+    return nodes
 
 
-def process_dirty_higher_tiers(db_path, on_progress=None, max_workers=10, max_tier=None):
+def child_texts(children, results):
+    return [results[c['key']] if c['text'] is None else c['text'] for c in children]
+
+
+def should_patch(node, changed, total):
+    return (node['patchable'] and bool(node['text']) and 0 < changed <= total * PATCH_MAX_FRACTION
+            and node['patch_count'] < PATCH_MAX_CONSECUTIVE)
+
+
+def run_higher_tier_summarization(db_path, on_progress=None, max_workers=10, max_tier=None):
     session = get_session(db_path)
+    session.expire_on_commit = False
+    models = {m.id: m for m in session.query(Model).all()}
+    nodes = plan_higher_tiers(session, max_tier)
     
-    tier = 1
-    total_processed = 0
+    if not nodes:
+        session.close()
+        return 0
     
-    while True:
-        if max_tier is not None and tier > max_tier:
-            break
+    if on_progress:
+        tiers = sorted({n['tier'] for n in nodes})
+        on_progress(f"Building {len(nodes)} higher-tier summaries (T{tiers[0]}-T{tiers[-1]}) across models...")
+    
+    # A node runs as soon as its own children are done; there is no per-tier
+    # barrier, so models and branches proceed independently.
+    graph = engine.TaskGraph(max_workers)
+    by_key = {}
+    for node in nodes:
+        by_key[node['key']] = node
+        model = models[node['model_id']]
+        pending = [c['key'] for c in node['children'] if c['text'] is None]
         
-        dirty_summaries = session.query(Summary).filter(
-            Summary.tier == tier,
-            Summary.is_dirty == True
-        ).all()
+        async def build(results, node=node, name=model.name, description=model.description or ''):
+            return await asummarize_summaries(child_texts(node['children'], results), name, description)
         
-        if not dirty_summaries:
-            tier += 1
-            more_tiers = session.query(Summary).filter(Summary.tier >= tier).first()
-            if not more_tiers:
-                break
-            continue
+        graph.add(node['key'], build, pending)
+    
+    saved_ids = {}
+    texts = {}
+    for i, (key, summary_text) in enumerate(graph.completed(), 1):
+        node = by_key[key]
+        texts[key] = summary_text
+        child_ids = [c['key'][1] if c['key'][0] == 'summary' else saved_ids[c['key']] for c in node['children']]
+        summary = Summary(
+            model_id=node['model_id'],
+            tier=node['tier'],
+            text=summary_text,
+            start_timestamp=node['start'],
+            end_timestamp=node['end'],
+            is_dirty=False,
+            input_hash=input_fingerprint('summary', zip(child_ids, child_texts(node['children'], texts)))
+        )
+        session.add(summary)
+        session.flush()
+        saved_ids[key] = summary.id
         
+        record_summary_sources(session, summary, 'summary', child_ids)
+        set_parent(session, summary, child_ids)
+        mark_model_dirty(session, node['model_id'])
+        if i % 50 == 0:
+            session.commit()
         if on_progress:
-            on_progress(f"Regenerating {len(dirty_summaries)} dirty tier-{tier} summaries...")
-        
-        def process_one(summary_id):
-            s = get_session(db_path)
-            summary = s.query(Summary).get(summary_id)
-            model = summary.model
-            
+            on_progress(f"  [{i}/{len(nodes)}] T{node['tier']} {models[node['model_id']].name}")
+    
+    session.commit()
+    session.close()
+    return len(nodes)
+
+
+def propagate_dirty_in_bulk(session):
+    # Mark every ancestor of a dirty summary dirty in one statement, so the
+    # regeneration graph is known up front.
+    result = session.connection().exec_driver_sql("""
+        WITH RECURSIVE ancestors(id) AS (
+            SELECT parent_id FROM summaries WHERE is_dirty = 1 AND parent_id IS NOT NULL
+            UNION
+            SELECT s.parent_id FROM summaries s JOIN ancestors a ON s.id = a.id WHERE s.parent_id IS NOT NULL
+        )
+        UPDATE summaries SET is_dirty = 1
+        WHERE id IN (SELECT id FROM ancestors) AND (is_dirty IS NULL OR is_dirty = 0)
+    """)
+    session.commit()
+    return result.rowcount
+
+
+def tier0_inputs(session, summary):
+    # The summary's recorded sources still assigned to its model, plus late
+    # observations in its range that no tier-0 summary has taken yet. Window
+    # boundaries often share a timestamp, so the range alone would also pull
+    # in the neighbouring window's observations.
+    recorded = select(SummarySource.source_id).where(
+        SummarySource.summary_id == summary.id, SummarySource.source_type == 'observation'
+    )
+    unsummarized = ~exists().where(SummarySource.source_type == 'observation', SummarySource.source_id == Observation.id)
+    return session.query(Observation).filter(
+        Observation.model_id == summary.model_id,
+        or_(
+            Observation.id.in_(recorded),
+            and_(Observation.timestamp >= summary.start_timestamp, Observation.timestamp <= summary.end_timestamp, unsummarized)
+        )
+    ).order_by(Observation.timestamp, Observation.id).all()
+
+
+def plan_dirty_regeneration(session, min_tier=0, max_tier=None):
+    query = session.query(Summary).filter(Summary.is_dirty == True, Summary.tier >= min_tier)
+    if max_tier is not None:
+        query = query.filter(Summary.tier <= max_tier)
+    dirty = query.order_by(Summary.tier, Summary.start_timestamp).all()
+    dirty_ids = {s.id for s in dirty}
+    
+    # A node is patchable when its stored text is exactly the summary of the
+    # inputs it still has (the kept observations, or the children as they
+    # read before this run); the delta is then everything else.
+    nodes = []
+    claimed = set()
+    for summary in dirty:
+        node = {
+            'key': summary.id, 'summary': summary, 'tier': summary.tier, 'text': summary.text,
+            'input_hash': summary.input_hash, 'patch_count': summary.patch_count or 0,
+        }
+        if summary.tier == 0:
+            node['observations'] = [o for o in tier0_inputs(session, summary) if o.id not in claimed]
+            claimed.update(o.id for o in node['observations'])
+            node['fingerprint'] = input_fingerprint('observation', [(o.id, o.text) for o in node['observations']])
+            source_ids = {src.source_id for src in summary.sources if src.source_type == 'observation'}
+            kept = [(o.id, o.text) for o in node['observations'] if o.id in source_ids]
+            node['delta'] = [o for o in node['observations'] if o.id not in source_ids]
+            node['patchable'] = bool(kept) and input_fingerprint('observation', kept) == summary.input_hash
+        else:
             child_ids = [src.source_id for src in summary.sources if src.source_type == 'summary']
-            children = s.query(Summary).filter(Summary.id.in_(child_ids)).all() if child_ids else []
-            
+            children = session.query(Summary).filter(Summary.id.in_(child_ids)).order_by(Summary.start_timestamp).all() if child_ids else []
             if not children:
-                children = s.query(Summary).filter(
+                children = session.query(Summary).filter(
                     Summary.model_id == summary.model_id,
-                    Summary.tier == tier - 1,
+                    Summary.tier == summary.tier - 1,
                     Summary.start_timestamp >= summary.start_timestamp,
                     Summary.end_timestamp <= summary.end_timestamp
                 ).order_by(Summary.start_timestamp).all()
-            
-            new_text = summarize_summaries(children, model.name, model.description or '')
-            s.close()
-            return summary_id, new_text, [c.id for c in children]
+            node['children'] = [
+                {'key': c.id, 'text': None if c.id in dirty_ids else c.text, 'base_text': c.text}
+                for c in children
+            ]
+            node['patchable'] = bool(children) and input_fingerprint('summary', [(c.id, c.text) for c in children]) == summary.input_hash
+        nodes.append(node)
+    return nodes
+
+
+def regenerate_result(text, fingerprint, skipped=False, patched=False, saved=0):
+    return {'text': text, 'fingerprint': fingerprint, 'skipped': skipped, 'patched': patched, 'saved': saved}
+
+
+def process_dirty_summaries(db_path, on_progress=None, max_workers=10, min_tier=0, max_tier=None, patch=True):
+    session = get_session(db_path)
+    session.expire_on_commit = False
+    propagate_dirty_in_bulk(session)
+    nodes = plan_dirty_regeneration(session, min_tier, max_tier)
+    
+    if not nodes:
+        session.close()
+        return 0
+    
+    if on_progress:
+        on_progress(f"Regenerating {len(nodes)} dirty summaries...")
+    
+    # When the inputs hash to the stored input_hash the old text is kept and no
+    # call is made; an unchanged child then leaves its parent's fingerprint
+    # unchanged too. Otherwise a patchable node sends its old text plus the
+    # delta, and everything else is rebuilt from all of its inputs.
+    graph = engine.TaskGraph(max_workers)
+    by_key = {}
+    for node in nodes:
+        by_key[node['key']] = node
+        model = node['summary'].model
+        name, description = model.name, model.description or ''
         
-        results = []
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(process_one, s.id): s for s in dirty_summaries}
-            for i, future in enumerate(as_completed(futures), 1):
-                results.append(future.result())
-                if on_progress:
-                    on_progress(f"  [{i}/{len(dirty_summaries)}] regenerated")
+        if node['tier'] == 0:
+            async def regenerate(results, node=node, name=name, description=description):
+                if node['fingerprint'] == node['input_hash']:
+                    return regenerate_result(node['text'], node['fingerprint'], skipped=True)
+                if patch and should_patch(node, len(node['delta']), len(node['observations'])):
+                    update = "New observations:\n" + "\n".join(f"- {o.text}" for o in node['delta'])
+                    full = "\n".join(f"- {o.text}" for o in node['observations'])
+                    saved = estimate_tokens(full) - estimate_tokens(f"{node['text']}\n\n{update}")
+                    text = await apatch_summary(node['text'], update, name, description, max(0, saved))
+                    return regenerate_result(text, node['fingerprint'], patched=True, saved=saved)
+                return regenerate_result(await asummarize_observations(node['observations'], name, description), node['fingerprint'])
+            graph.add(node['key'], regenerate)
+        else:
+            async def regenerate(results, node=node, name=name, description=description):
+                texts = child_texts(node['children'], {key: result['text'] for key, result in results.items()})
+                fingerprint = input_fingerprint('summary', zip([c['key'] for c in node['children']], texts))
+                if fingerprint == node['input_hash']:
+                    return regenerate_result(node['text'], fingerprint, skipped=True)
+                # Each changed section goes with its old text so the model can
+                # tell what to revise in the existing summary
+                changed = [
+                    f"Before:\n{c['base_text']}\n\nAfter:\n{text}"
+                    for c, text in zip(node['children'], texts) if text != c['base_text']
+                ]
+                if patch and should_patch(node, len(changed), len(texts)):
+                    update = "Updated sections:\n\n" + "\n\n---\n\n".join(changed)
+                    saved = estimate_tokens("\n\n---\n\n".join(texts)) - estimate_tokens(f"{node['text']}\n\n{update}")
+                    text = await apatch_summary(node['text'], update, name, description, max(0, saved))
+                    return regenerate_result(text, fingerprint, patched=True, saved=saved)
+                return regenerate_result(await asummarize_summaries(texts, name, description), fingerprint)
+            graph.add(node['key'], regenerate, [c['key'] for c in node['children'] if c['text'] is None])
+    
+    skipped = patched = saved = 0
+    for i, (key, result) in enumerate(graph.completed(), 1):
+        node = by_key[key]
+        summary = node['summary']
+        summary.is_dirty = False
+        if result['skipped']:
+            skipped += 1
+            continue
+        summary.text = result['text']
+        summary.input_hash = result['fingerprint']
+        if result['patched']:
+            summary.patch_count = node['patch_count'] + 1
+            patched += 1
+            saved += max(0, result['saved'])
+        else:
+            summary.patch_count = 0
         
-        for summary_id, new_text, child_ids in results:
-            summary = session.query(Summary).get(summary_id)
-            summary.text = new_text
-            summary.is_dirty = False
-            
-            session.query(SummarySource).filter_by(summary_id=summary_id).delete()
+        session.query(SummarySource).filter_by(summary_id=summary.id).delete()
+        if node['tier'] == 0:
+            record_summary_sources(session, summary, 'observation', [o.id for o in node['observations']])
+        else:
+            child_ids = [c['key'] for c in node['children']]
             record_summary_sources(session, summary, 'summary', child_ids)
-            
-            propagate_dirty_upward(session, summary)
-            mark_model_dirty(session, summary.model_id)
-        
-        session.commit()
-        total_processed += len(results)
-        tier += 1
+            set_parent(session, summary, child_ids)
+        mark_model_dirty(session, summary.model_id)
+        if i % 50 == 0:
+            session.commit()
+        if on_progress:
+            on_progress(f"  [{i}/{len(nodes)}] {'patched' if result['patched'] else 'regenerated'} T{node['tier']}")
     
+    session.commit()
     session.close()
-    return total_processed
+    if skipped and on_progress:
+        on_progress(f"Skipped {skipped}/{len(nodes)} dirty summaries with unchanged inputs")
+    if patched and on_progress:
+        on_progress(f"Patched {patched}/{len(nodes)} dirty summaries, saving ~{saved} prompt tokens")
+    return len(nodes) - skipped
+
+
+def process_dirty_tier0(db_path, on_progress=None, max_workers=10, patch=True):
+    return process_dirty_summaries(db_path, on_progress, max_workers, max_tier=0, patch=patch)
+
+
+def process_dirty_higher_tiers(db_path, on_progress=None, max_workers=10, max_tier=None, patch=True):
+    return process_dirty_summaries(db_path, on_progress, max_workers, min_tier=1, max_tier=max_tier, patch=patch)
 
 
-def process_all_dirty(db_path, on_progress=None, max_workers=10, max_tier=None):
-    tier0_processed = process_dirty_tier0(db_path, on_progress, max_workers)
-    higher_processed = process_dirty_higher_tiers(db_path, on_progress, max_workers, max_tier)
-    return tier0_processed + higher_processed
+def process_all_dirty(db_path, on_progress=None, max_workers=10, max_tier=None, patch=True):
+    return process_dirty_summaries(db_path, on_progress, max_workers, max_tier=max_tier, patch=patch)
 
 
-def run_all_summarization(db_path, on_progress=None, max_workers=10, max_tier=None, max_obs=None, start_id=None):
-    tier0_count = run_tier0_summarization(db_path, on_progress, max_workers=max_workers, max_obs=max_obs, start_id=start_id)
+def run_all_summarization(db_path, on_progress=None, max_workers=10, max_tier=None, max_obs=None, start_id=None, assign_margin=ASSIGN_MARGIN):
+    tier0_count = run_tier0_summarization(db_path, on_progress, max_workers=max_workers, max_obs=max_obs, start_id=start_id, assign_margin=assign_margin)
     higher_count = run_higher_tier_summarization(db_path, on_progress, max_workers=max_workers, max_tier=max_tier)
     return tier0_count, higher_count
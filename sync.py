@@ -1,13 +1,20 @@
-import sqlite3
+import json
+import hashlib
 from pathlib import Path
 from datetime import datetime, UTC
 
-from db import init_db, get_session, Observation, Model, Summary, ImportedSession
-from llm import extract_observations
-from loaders import load_openclaw_incremental, get_openclaw_file_stats, group_messages_by_week
+from db import (
+    init_db, get_session, vec_connection, Model, ImportedSession, ImportChunk,
+    find_processed_hashes, record_processed_hashes, save_observations
+)
+from llm import plan_chunks, extract_planned, enable_cache
+from ratelimit import get_limiter
+from usage import usage_by_stage, format_usage, enable_ledger, flush_calls
+from loaders import load_openclaw_incremental, get_openclaw_file_stats, group_messages_by_week, message_hash, filter_new_messages
 from summarize import (
     run_tier0_summarization,
     run_higher_tier_summarization,
+    ASSIGN_MARGIN,
     process_all_dirty,
     mark_model_dirty,
     mark_overlapping_summaries_dirty
@@ -15,51 +22,148 @@ from summarize import (
 from pyramid import synthesize_dirty_models
 from embeddings import (
     embed_many,
-    enable_vec,
     init_memory_vec,
-    get_existing_embeddings,
+    reconcile_embedded_flags,
     store_embeddings,
     enrich_for_embedding
 )
 
 
-def embed_new_items(db_path, on_progress=None, max_workers=10):
-    session = get_session(db_path)
-    conn = sqlite3.connect(db_path)
-    enable_vec(conn)
-    init_memory_vec(conn)
+def ledger_key(segment_hashes):
+    return hashlib.sha256(json.dumps(segment_hashes).encode('utf-8')).hexdigest()
+
+
+def plan_import(session, messages):
+    by_hash = {message_hash(m): m for m in messages}
     
-    existing = get_existing_embeddings(conn)
+    resumed = []
+    unmatched = []
+    for chunk in session.query(ImportChunk).filter_by(status='pending').order_by(ImportChunk.id).all():
+        segment_hashes = json.loads(chunk.segments)
+        hashes = [h for _, week_hashes in segment_hashes for h in week_hashes]
+        if not hashes or not all(h in by_hash for h in hashes):
+            unmatched.append((chunk, hashes))
+            continue
+        segments = [(week, [by_hash.pop(h) for h in week_hashes]) for week, week_hashes in segment_hashes]
+        resumed.append({'segments': segments, 'chunk_id': chunk.id})
     
-    to_embed = []
-    for obs in session.query(Observation).all():
-        if ('observation', obs.id) not in existing and obs.text and obs.text.strip():
-            enriched = enrich_for_embedding(obs.text, obs.timestamp)
-            to_embed.append(('observation', obs.id, enriched))
-    for s in session.query(Summary).all():
-        if ('summary', s.id) not in existing and s.text and s.text.strip():
-            enriched = enrich_for_embedding(s.text, s.start_timestamp, s.end_timestamp)
-            to_embed.append(('summary', s.id, enriched))
+    # A pending chunk that only partly matches this import would never resume;
+    # once any of its messages go into new chunks it is abandoned. Chunks
+    # sharing no message with this import may belong to another source.
+    for chunk, hashes in unmatched:
+        if not hashes or any(h in by_hash for h in hashes):
+            chunk.status = 'abandoned'
     
-    if not to_embed:
-        conn.close()
-        session.close()
+    remaining = [m for m in messages if message_hash(m) in by_hash]
+    planned = plan_chunks(group_messages_by_week(remaining))
+    for entry in planned:
+        segment_hashes = [[week, [message_hash(m) for m in chunk]] for week, chunk in entry['segments']]
+        key = ledger_key(segment_hashes)
+        chunk = session.query(ImportChunk).filter_by(key=key).first()
+        if chunk is None:
+            chunk = ImportChunk(
+                key=key,
+                segments=json.dumps(segment_hashes),
+                message_count=sum(len(c) for _, c in entry['segments'])
+            )
+            session.add(chunk)
+            session.flush()
+        entry['chunk_id'] = chunk.id
+    session.commit()
+    
+    return resumed, resumed + planned
+
+
+def import_messages(session, messages, on_progress=None, max_workers=10):
+    known = find_processed_hashes(session, (message_hash(m) for m in messages))
+    new_messages = filter_new_messages(messages, known)
+    skipped = len(messages) - len(new_messages)
+    if skipped and on_progress:
+        on_progress(f"Skipping {skipped} already-processed messages")
+    
+    resumed, plan = plan_import(session, new_messages)
+    if not plan:
         return 0
     
     if on_progress:
-        on_progress(f"Embedding {len(to_embed)} items...")
+        if resumed:
+            on_progress(f"Resuming {len(resumed)} unfinished chunks from an interrupted import")
+        on_progress(f"Planned {len(plan) - len(resumed)} new chunks")
+    
+    def progress(completed, total, msgs_in_chunk, timestamp, obs_count):
+        if on_progress:
+            on_progress(f"  [{completed}/{total}] {obs_count} obs")
     
-    texts = [item[2] for item in to_embed]
-    embeddings = embed_many(texts, max_workers=max_workers)
+    total_observations = 0
+    for i, observations in extract_planned(plan, on_progress=progress, max_workers=max_workers):
+        entry = plan[i]
+        save_observations(session, observations, import_chunk_id=entry['chunk_id'])
+        record_processed_hashes(session, (message_hash(m) for _, chunk in entry['segments'] for m in chunk))
+        chunk = session.get(ImportChunk, entry['chunk_id'])
+        chunk.status = 'done'
+        chunk.observation_count = len(observations)
+        chunk.completed_at = datetime.now(UTC)
+        session.commit()
+        total_observations += len(observations)
     
-    store_embeddings(conn, to_embed, embeddings)
+    return total_observations
+
+
+EMBED_PAGE_SIZE = 1000
+
+PENDING_EMBEDDINGS = {
+    'observation': "SELECT id, text, timestamp, NULL FROM observations",
+    'summary': "SELECT id, text, start_timestamp, end_timestamp FROM summaries",
+}
+PENDING_FILTER = "WHERE embedded = 0 AND trim(text) != ''"
+
+
+def count_items_to_embed(conn):
+    reconcile_embedded_flags(conn)
+    return sum(
+        conn.execute(f"SELECT COUNT(*) FROM ({query} {PENDING_FILTER})").fetchone()[0]
+        for query in PENDING_EMBEDDINGS.values()
+    )
+
+
+def iter_items_to_embed(conn, page_size=EMBED_PAGE_SIZE):
+    # Pages of (source_type, source_id, enriched_text), read by id through the
+    # embedded index. Pages are re-queried by id, so callers may store each one
+    # before asking for the next.
+    reconcile_embedded_flags(conn)
+    for source_type, query in PENDING_EMBEDDINGS.items():
+        last_id = 0
+        while True:
+            rows = conn.execute(f"{query} {PENDING_FILTER} AND id > ? ORDER BY id LIMIT ?", [last_id, page_size]).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            yield [(source_type, source_id, enrich_for_embedding(text, start, end)) for source_id, text, start, end in rows]
+
+
+def embed_new_items(db_path, on_progress=None, max_workers=10, page_size=EMBED_PAGE_SIZE):
+    conn = vec_connection(db_path)
+    init_memory_vec(conn)
+    
+    total = count_items_to_embed(conn)
+    if not total:
+        conn.close()
+        return 0
+    
+    if on_progress:
+        on_progress(f"Embedding {total} items...")
+    
+    embedded = 0
+    for page in iter_items_to_embed(conn, page_size):
+        embeddings = embed_many([item[2] for item in page], max_workers=max_workers)
+        store_embeddings(conn, page, embeddings)
+        embedded += len(page)
     conn.close()
-    session.close()
     
     if on_progress:
-        on_progress(f"Embedded {len(to_embed)} items")
+        on_progress(f"Embedded {embedded} items")
     
-    return len(to_embed)
+    return embedded
 
 
 def write_model_files(db_path, workspace, on_progress=None):
@@ -67,15 +171,22 @@ def write_model_files(db_path, workspace, on_progress=None):
     return export_models(workspace, db_path, on_progress=on_progress)
 
 
-def sync(workspace, db='pyramid.db', source=None, on_progress=None, max_workers=10):
+def sync(workspace, db='pyramid.db', source=None, on_progress=None, max_workers=10, batch=False, poll_interval=None,
+         assign_margin=ASSIGN_MARGIN, patch_summaries=True):
     workspace = Path(workspace)
     db_path = workspace / db
     
     workspace.mkdir(parents=True, exist_ok=True)
     init_db(str(db_path))
+    cache = enable_cache(workspace)
+    enable_ledger(db_path)
     
     session = get_session(str(db_path))
     
+    if batch:
+        import batch as batch_api
+        poll_interval = poll_interval or batch_api.BATCH_POLL_INTERVAL
+    
     if source:
         tracking = {}
         for rec in session.query(ImportedSession).all():
@@ -88,33 +199,12 @@ def sync(workspace, db='pyramid.db', source=None, on_progress=None, max_workers=
                 on_progress(f"Found {len(changed_files)} changed files, {len(messages)} new messages")
             
             if messages:
-                by_week = group_messages_by_week(messages)
-                weeks = sorted(by_week.keys())
-                
-                total_observations = 0
-                for week in weeks:
-                    week_messages = by_week[week]
-                    if on_progress:
-                        on_progress(f"Processing {week}: {len(week_messages)} messages")
-                    
-                    def progress(completed, total, msgs_in_chunk, timestamp, obs_count):
-                        if on_progress:
-                            on_progress(f"  [{completed}/{total}] {obs_count} obs")
-                    
-                    observations = extract_observations(week_messages, on_progress=progress, max_workers=max_workers)
-                    
-                    for obs_data in observations:
-                        ts = obs_data.get('timestamp')
-                        if isinstance(ts, str):
-                            ts = datetime.fromisoformat(ts)
-                        obs = Observation(
-                            text=obs_data['text'],
-                            timestamp=ts or datetime.now(UTC)
-                        )
-                        session.add(obs)
-                    session.commit()
-                    total_observations += len(observations)
-                
+                if batch:
+                    total_observations = batch_api.import_messages_batch(
+                        session, messages, batch_api.get_batch_dir(db_path), poll_interval, on_progress
+                    )
+                else:
+                    total_observations = import_messages(session, messages, on_progress, max_workers)
                 if on_progress:
                     on_progress(f"Extracted {total_observations} observations")
             
@@ -132,22 +222,38 @@ def sync(workspace, db='pyramid.db', source=None, on_progress=None, max_workers=
     
     session.close()
     
-    tier0 = run_tier0_summarization(str(db_path), on_progress, max_workers)
+    if batch:
+        tier0 = batch_api.run_tier0_batch(str(db_path), poll_interval, on_progress, max_workers)
+    else:
+        tier0 = run_tier0_summarization(str(db_path), on_progress, max_workers, assign_margin=assign_margin)
     higher = run_higher_tier_summarization(str(db_path), on_progress, max_workers)
     if (tier0 or higher) and on_progress:
         on_progress(f"Created {tier0} tier-0 + {higher} higher-tier summaries")
     
-    dirty_processed = process_all_dirty(str(db_path), on_progress, max_workers)
+    dirty_processed = process_all_dirty(str(db_path), on_progress, max_workers, patch=patch_summaries)
     if dirty_processed and on_progress:
         on_progress(f"Regenerated {dirty_processed} dirty summaries")
     
-    embedded = embed_new_items(str(db_path), on_progress, max_workers)
+    if batch:
+        embedded = batch_api.embed_new_items_batch(str(db_path), poll_interval, on_progress)
+    else:
+        embedded = embed_new_items(str(db_path), on_progress, max_workers)
     
     synthesized = synthesize_dirty_models(str(db_path), on_progress, max_workers)
     
     written = write_model_files(str(db_path), workspace, on_progress)
+    flush_calls()
     
     if on_progress:
+        stats = cache.stats()
+        if stats['hits'] or stats['misses']:
+            on_progress(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evicted")
+        prompt_cache = format_usage(usage_by_stage())
+        if prompt_cache:
+            on_progress(f"Prompt cache (cached/prompt tokens): {prompt_cache}")
+        limits = get_limiter().stats()
+        if limits['retries']:
+            on_progress(f"Rate limiter: {limits['retries']} retries ({limits['throttled']} throttled), concurrency settled at {limits['concurrency']}")
         if written:
             on_progress(f"Sync complete. Updated: {', '.join(written)}")
         elif tier0 or higher or dirty_processed or synthesized:
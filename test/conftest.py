@@ -2,7 +2,13 @@ import pytest
 from datetime import datetime, UTC
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from db import Base, Model, Observation, Summary
+from db import Base, Model, Observation, Summary, dispose_engines
+
+
+@pytest.fixture(autouse=True)
+def pooled_engines():
+    yield
+    dispose_engines()
 
 
 @pytest.fixture
@@ -0,0 +1,96 @@
+import json
+import pytest
+from openai import AsyncOpenAI
+
+import batch
+import llm
+from datetime import datetime
+from db import init_db, get_session, BatchJob, Model, Observation, Summary, ProcessedMessage
+from fake_openai import FakeOpenAIServer
+from llm import observe_request
+from summarize import STEP
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with FakeOpenAIServer() as fake:
+        monkeypatch.setattr(llm, '_client', AsyncOpenAI(base_url=fake.base_url, api_key='test', max_retries=0))
+        monkeypatch.setattr(llm, '_cache', None)
+        yield fake
+
+
+def make_messages(contents):
+    return [{'role': 'user', 'content': c, 'timestamp': f'2025-01-{i + 10:02d}T10:00:00'} for i, c in enumerate(contents)]
+
+
+def test_split_requests_respects_weight_limit():
+    requests = [(f'r{i}', {'input': ['x'] * 3}) for i in range(5)]
+    groups = batch.split_requests(requests, weight=lambda body: len(body['input']), limit=7)
+    assert [len(g) for g in groups] == [2, 2, 1]
+
+
+def test_import_messages_batch(session, server, tmp_path):
+    count = batch.import_messages_batch(session, make_messages(['hello', 'world']), tmp_path, poll_interval=0)
+
+    assert count == 2
+    assert {o.text for o in session.query(Observation).all()} == {'User said: hello', 'User said: world'}
+    assert session.query(ProcessedMessage).count() == 2
+    job = session.query(BatchJob).one()
+    assert job.stage == 'extract'
+    assert job.status == 'completed'
+    assert job.applied
+    assert list(tmp_path.glob('extract-*.jsonl'))
+
+
+def test_import_messages_batch_skips_processed(session, server, tmp_path):
+    batch.import_messages_batch(session, make_messages(['hello']), tmp_path, poll_interval=0)
+    batch.import_messages_batch(session, make_messages(['hello']), tmp_path, poll_interval=0)
+
+    assert session.query(BatchJob).count() == 1
+    assert session.query(Observation).count() == 1
+
+
+def test_failed_requests_are_retried(session, server, tmp_path):
+    server.state.fail_custom_ids.add('chunk-0')
+    count = batch.import_messages_batch(session, make_messages(['hello']), tmp_path, poll_interval=0)
+    assert count == 0
+    assert session.query(ProcessedMessage).count() == 0
+
+    server.state.fail_custom_ids.clear()
+    count = batch.import_messages_batch(session, make_messages(['hello']), tmp_path, poll_interval=0)
+    assert count == 1
+    assert session.query(ProcessedMessage).count() == 1
+
+
+def test_resume_pending_job(session, server, tmp_path):
+    messages = make_messages(['hello'])
+    segments = [(None, messages)]
+    context = {'chunk-0': {'order': 0, 'timestamps': ['2025-01-10T10:00:00'], 'hashes': ['abc']}}
+    batch.submit_batch(session, 'extract', batch.CHAT_ENDPOINT, [('chunk-0', observe_request(segments))], context, tmp_path)
+
+    count = batch.import_messages_batch(session, [], tmp_path, poll_interval=0)
+
+    assert count == 1
+    assert session.query(BatchJob).one().applied
+    assert session.query(ProcessedMessage).one().hash == 'abc'
+
+
+def test_run_tier0_batch(server, tmp_path):
+    db_path = str(tmp_path / 'pyramid.db')
+    init_db(db_path)
+    session = get_session(db_path)
+    user = session.query(Model).filter_by(name='user').one()
+    for i in range(STEP):
+        session.add(Observation(text=f'fact {i}', model_id=user.id, timestamp=datetime(2025, 1, i + 1)))
+    session.commit()
+    session.close()
+
+    created = batch.run_tier0_batch(db_path, poll_interval=0)
+
+    session = get_session(db_path)
+    assert created == 1
+    summary = session.query(Summary).one()
+    assert summary.tier == 0
+    assert summary.text.startswith('Summary of')
+    assert json.loads(session.query(BatchJob).one().context)
+    session.close()
@@ -0,0 +1,131 @@
+import pytest
+import cache as cache_module
+from cache import ResponseCache, request_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    c = ResponseCache(tmp_path / 'llm_cache.db', max_entries=3)
+    yield c
+    c.close()
+
+
+def make_request(content, model='gpt-4.1-mini', tools=None):
+    request = {'model': model, 'messages': [{'role': 'user', 'content': content}]}
+    if tools:
+        request['tools'] = tools
+    return request
+
+
+def test_request_key_stable_across_dict_order():
+    a = {'model': 'm', 'messages': [{'role': 'user', 'content': 'hi'}]}
+    b = {'messages': [{'content': 'hi', 'role': 'user'}], 'model': 'm'}
+    assert request_key(a) == request_key(b)
+
+
+def test_request_key_depends_on_model_and_tools():
+    base = make_request('hi')
+    assert request_key(base) != request_key(make_request('hi', model='other'))
+    assert request_key(base) != request_key(make_request('hi', tools=[{'type': 'function'}]))
+
+
+def test_miss_then_hit(cache):
+    request = make_request('hello')
+    assert cache.get(request) is None
+    cache.put(request, {'id': 'resp-1'})
+    assert cache.get(request) == {'id': 'resp-1'}
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_persists_across_instances(tmp_path):
+    path = tmp_path / 'llm_cache.db'
+    first = ResponseCache(path)
+    first.put(make_request('hello'), {'id': 'resp-1'})
+    first.close()
+
+    second = ResponseCache(path)
+    assert second.get(make_request('hello')) == {'id': 'resp-1'}
+    second.close()
+
+
+def test_evicts_least_recently_used(cache):
+    for i in range(3):
+        cache.put(make_request(f'msg {i}'), {'i': i})
+    cache.get(make_request('msg 0'))
+    cache.put(make_request('msg 3'), {'i': 3})
+
+    assert len(cache) == 3
+    assert cache.evictions == 1
+    assert cache.get(make_request('msg 1')) is None
+    assert cache.get(make_request('msg 0')) == {'i': 0}
+
+
+def test_stats_hit_rate(cache):
+    cache.put(make_request('a'), {})
+    cache.get(make_request('a'))
+    cache.get(make_request('b'))
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+
+
+def test_hits_are_written_with_the_next_put(cache):
+    for i in range(3):
+        cache.put(make_request(f'msg {i}'), {'i': i})
+    cache.get(make_request('msg 0'))
+    assert not cache._conn.in_transaction
+    cache.put(make_request('msg 0'), {'i': 0})
+    cache.put(make_request('msg 3'), {'i': 3})
+    
+    assert cache.evictions == 1
+    assert cache._count == len(cache) == 3
+    assert cache.get(make_request('msg 1')) is None
+
+
+def test_last_used_persists_on_close(tmp_path):
+    path = tmp_path / 'llm_cache.db'
+    first = ResponseCache(path, max_entries=2)
+    first.put(make_request('a'), {})
+    first.put(make_request('b'), {})
+    first.get(make_request('a'))
+    first.close()
+    
+    second = ResponseCache(path, max_entries=2)
+    assert second._count == 2
+    second.put(make_request('c'), {})
+    assert second.get(make_request('b')) is None
+    assert second.get(make_request('a')) == {}
+    second.close()
+
+
+def test_hit_only_session_touches_survive_reopen(tmp_path):
+    path = tmp_path / 'llm_cache.db'
+    first = ResponseCache(path, max_entries=2)
+    first.put(make_request('a'), {})
+    first.put(make_request('b'), {})
+    first.close()
+    
+    # A run where every lookup hits; flush() is what llm's exit hook calls
+    second = ResponseCache(path, max_entries=2)
+    assert second.get(make_request('a')) == {}
+    second.flush()
+    
+    third = ResponseCache(path, max_entries=2)
+    third.put(make_request('c'), {})
+    assert third.get(make_request('b')) is None
+    assert third.get(make_request('a')) == {}
+    third.close()
+    second.close()
+
+
+def test_hits_are_written_in_batches(cache, monkeypatch):
+    monkeypatch.setattr(cache_module, 'TOUCH_BATCH_SIZE', 2)
+    cache.put(make_request('a'), {})
+    cache.put(make_request('b'), {})
+    cache.get(make_request('a'))
+    assert cache._touched
+    cache.get(make_request('b'))
+    assert not cache._touched
+    assert not cache._conn.in_transaction
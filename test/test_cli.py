@@ -0,0 +1,25 @@
+from click.testing import CliRunner
+
+from bench import startup_modules, LIGHT_COMMANDS
+from cli import cli
+
+
+def test_cli_import_does_not_load_heavy_modules():
+    assert startup_modules() == []
+
+
+def test_light_commands_do_not_load_heavy_modules():
+    for command in LIGHT_COMMANDS:
+        assert startup_modules(*command) == [], command[0]
+
+
+def test_help_lists_commands():
+    result = CliRunner().invoke(cli, ['--help'])
+    assert result.exit_code == 0
+    assert 'search' in result.output and 'sync' in result.output
+
+
+def test_search_without_database(tmp_path):
+    result = CliRunner().invoke(cli, ['search', '-w', str(tmp_path), 'anything'])
+    assert result.exit_code == 0
+    assert 'No database found' in result.output
@@ -1,6 +1,13 @@
+import sqlite3
 import pytest
 from datetime import datetime, UTC
-from db import Model, Observation, Summary
+from sqlalchemy import event
+import db
+import summarize
+from db import (
+    init_db, get_engine, get_session, vec_connection, migrate_db, schema_version, find_processed_hashes,
+    record_processed_hashes, Model, Observation, Summary, SummarySource, SCHEMA_VERSION
+)
 
 
 def test_base_models_created(session):
@@ -71,3 +78,146 @@ def test_summary_tiers(session, user_model):
     
     summaries = session.query(Summary).filter_by(model_id=user_model.id).order_by(Summary.tier).all()
     assert [s.tier for s in summaries] == [0, 1]
+
+
+def test_processed_hashes_roundtrip(session):
+    record_processed_hashes(session, ['a', 'b'])
+    session.commit()
+    
+    assert find_processed_hashes(session, ['a', 'c']) == {'a'}
+    assert find_processed_hashes(session, []) == set()
+
+
+def test_migrate_backfills_summary_parents(tmp_path):
+    db_path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute("""CREATE TABLE summaries (id INTEGER PRIMARY KEY, model_id INTEGER NOT NULL, tier INTEGER NOT NULL, text TEXT NOT NULL,
+                    start_timestamp DATETIME NOT NULL, end_timestamp DATETIME NOT NULL, is_dirty BOOLEAN)""")
+    conn.execute("CREATE TABLE summary_sources (id INTEGER PRIMARY KEY, summary_id INTEGER NOT NULL, source_type VARCHAR NOT NULL, source_id INTEGER NOT NULL)")
+    conn.execute("INSERT INTO summaries (id, model_id, tier, text, start_timestamp, end_timestamp) VALUES (1, 1, 0, 'child', '2025-01-01', '2025-01-02')")
+    conn.execute("INSERT INTO summaries (id, model_id, tier, text, start_timestamp, end_timestamp) VALUES (2, 1, 1, 'parent', '2025-01-01', '2025-01-02')")
+    conn.execute("INSERT INTO summary_sources (summary_id, source_type, source_id) VALUES (2, 'summary', 1)")
+    conn.commit()
+    conn.close()
+    
+    init_db(db_path)
+    session = get_session(db_path)
+    assert session.get(Summary, 1).parent_id == 2
+    assert session.get(Summary, 2).parent_id is None
+    session.close()
+
+
+def test_migrations_stamp_schema_version(tmp_path):
+    db_path = str(tmp_path / 'pyramid.db')
+    init_db(db_path)
+    assert schema_version(db_path) == SCHEMA_VERSION
+    assert migrate_db(db_path) == []
+    
+    conn = sqlite3.connect(db_path)
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+    assert {'ix_observations_model_timestamp', 'ix_summaries_model_tier_span', 'ix_summaries_is_dirty',
+            'ix_summary_sources_source', 'ix_summary_sources_summary_id'} <= indexes
+
+
+def test_failed_migration_keeps_previous_version(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'pyramid.db')
+    db.init_db(db_path)
+    
+    def broken(cursor):
+        cursor.execute("CREATE INDEX ix_half_done ON summaries (text)")
+        cursor.execute("SELECT * FROM missing_table")
+    
+    monkeypatch.setattr(db, 'MIGRATIONS', db.MIGRATIONS + [(db.SCHEMA_VERSION + 1, broken)])
+    with pytest.raises(sqlite3.OperationalError):
+        db.migrate_db(db_path)
+    assert db.schema_version(db_path) == db.SCHEMA_VERSION
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'ix_half_done'").fetchone()[0] == 0
+    conn.close()
+
+
+def query_plans(session, action):
+    statements = []
+    
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'WITH')):
+            statements.append((statement, parameters))
+    
+    engine = session.get_bind()
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        action()
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+    connection = session.connection()
+    return [
+        ' | '.join(row[3] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall())
+        for statement, parameters in statements
+    ]
+
+
+def test_hot_queries_use_indexes(session, user_model):
+    ts = datetime(2025, 1, 1)
+    summary = Summary(model_id=user_model.id, tier=0, text='t', start_timestamp=ts, end_timestamp=ts, is_dirty=True)
+    session.add(summary)
+    session.commit()
+    model_id = user_model.id
+    
+    plans = query_plans(session, lambda: summarize.mark_overlapping_summaries_dirty(session, model_id, ts))
+    assert 'ix_summaries_model_tier_span' in plans[0]
+    
+    for model in session.query(Model).all():
+        model.tier0_watermark_ts, model.tier0_watermark_id = ts, 1
+    session.commit()
+    plans = query_plans(session, lambda: summarize.plan_tier0_tasks(session))
+    planner = [p for p in plans if 'observations' in p]
+    assert planner and all('ix_observations_model_timestamp (model_id=? AND timestamp>?)' in p for p in planner)
+    
+    plans = query_plans(session, lambda: summarize.plan_dirty_regeneration(session))
+    assert 'ix_summaries_is_dirty' in plans[0]
+    assert any('ix_observations_model_timestamp' in p for p in plans)
+    assert any('ix_summary_sources_summary_id' in p for p in plans)
+    
+    plans = query_plans(session, lambda: session.query(SummarySource).filter_by(source_type='summary', source_id=summary.id).all())
+    assert 'ix_summary_sources_source' in plans[0]
+    
+    plans = query_plans(session, lambda: summarize.propagate_dirty_in_bulk(session))
+    assert 'ix_summaries_is_dirty' in plans[0] and 'SCAN summaries' not in plans[0]
+
+
+def test_engine_is_pooled_per_path_with_wal(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'pyramid.db')
+    init_db(db_path)
+    monkeypatch.chdir(tmp_path)
+    engine = get_engine(db_path)
+    assert get_engine('pyramid.db') is engine
+    
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert conn.exec_driver_sql('PRAGMA synchronous').scalar() == 1
+        assert conn.exec_driver_sql('PRAGMA busy_timeout').scalar() == 30000
+    
+    # A reader mid-transaction does not block a writer's commit under WAL
+    reader = engine.raw_connection()
+    reader.execute('BEGIN')
+    assert reader.execute('SELECT COUNT(*) FROM observations').fetchone()[0] == 0
+    session = get_session(db_path)
+    session.add(Observation(text='written while reading', timestamp=datetime(2025, 1, 1)))
+    session.commit()
+    assert reader.execute('SELECT COUNT(*) FROM observations').fetchone()[0] == 0
+    reader.execute('COMMIT')
+    assert reader.execute('SELECT COUNT(*) FROM observations').fetchone()[0] == 1
+    reader.close()
+    session.close()
+    assert engine.pool.checkedout() == 0
+
+
+@pytest.mark.skipif(not hasattr(__import__('sqlite3').Connection, 'enable_load_extension'), reason='sqlite3 built without extension loading')
+def test_vec_connection_comes_from_the_pool(tmp_path):
+    db_path = str(tmp_path / 'pyramid.db')
+    init_db(db_path)
+    conn = vec_connection(db_path)
+    assert conn.execute('SELECT vec_version()').fetchone()[0]
+    conn.close()
+    assert get_engine(db_path).pool.checkedout() == 0
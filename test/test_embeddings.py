@@ -1,9 +1,11 @@
+import sqlite3
 import pytest
 from datetime import datetime, timedelta, UTC
 from embeddings import (
     serialize_embedding, deserialize_embedding, estimate_tokens,
     batch_by_tokens, compute_time_penalty, EMBEDDING_DIM, MAX_TOKENS_PER_REQUEST,
-    TIME_DECAY_HALF_LIFE_DAYS, format_temporal_prefix, enrich_for_embedding
+    TIME_DECAY_HALF_LIFE_DAYS, format_temporal_prefix, enrich_for_embedding,
+    enable_vec, init_centroids, update_centroids, nearest_centroids
 )
 
 
@@ -39,7 +41,7 @@ def test_max_tokens_constant():
 
 
 def test_estimate_tokens():
-    assert estimate_tokens("12345678") == 2
+    assert 2 <= estimate_tokens("12345678") <= 4
     assert estimate_tokens("") == 0
 
 
@@ -51,7 +53,7 @@ def test_batch_by_tokens_single_batch():
 
 
 def test_batch_by_tokens_splits_large():
-    texts = ["x" * 1000 for _ in range(10)]
+    texts = ["lorem ipsum " * 100 for _ in range(10)]
     batches = batch_by_tokens(texts, max_tokens=500)
     assert len(batches) > 1
     all_texts = [t for b in batches for t in b]
@@ -121,3 +123,26 @@ def test_enrich_for_embedding():
 def test_enrich_for_embedding_no_timestamp():
     result = enrich_for_embedding("Some fact", None)
     assert result == "Some fact"
+
+
+def test_update_centroids_keeps_running_mean():
+    conn = sqlite3.connect(':memory:')
+    init_centroids(conn)
+    update_centroids(conn, [(1, [1.0, 0.0]), (1, [0.0, 1.0]), (2, [0.5, 0.5])])
+    update_centroids(conn, [(1, [1.0, 1.0])])
+    count, blob = conn.execute("SELECT count, embedding FROM model_centroids WHERE model_id = 1").fetchone()
+    assert count == 3
+    assert deserialize_embedding(blob) == pytest.approx([2 / 3, 2 / 3])
+
+
+@pytest.mark.skipif(not hasattr(sqlite3.Connection, 'enable_load_extension'), reason='sqlite3 built without extension loading')
+def test_nearest_centroids_orders_by_similarity():
+    conn = sqlite3.connect(':memory:')
+    enable_vec(conn)
+    init_centroids(conn)
+    update_centroids(conn, [(1, [1.0, 0.0, 0.0]), (2, [0.0, 1.0, 0.0]), (3, [0.0, 0.0, 1.0])])
+    update_centroids(conn, [(3, [0.0, 0.0, 1.0])])
+    nearest = nearest_centroids(conn, [0.9, 0.1, 0.0])
+    assert [model_id for model_id, _ in nearest] == [1, 2]
+    assert nearest[0][1] > nearest[1][1]
+    assert [model_id for model_id, _ in nearest_centroids(conn, [0.9, 0.1, 0.0], min_count=2)] == [3]
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import pytest
+import engine
+
+
+async def double(x):
+    await asyncio.sleep(0.001)
+    return x * 2
+
+
+def test_run_returns_result():
+    assert engine.run(double(21)) == 42
+
+
+def test_map_unordered_returns_all_results():
+    results = dict(engine.map_unordered(double, range(20), max_concurrency=5))
+    assert results == {i: i * 2 for i in range(20)}
+
+
+def test_pool_respects_concurrency_limit():
+    in_flight = 0
+    peak = 0
+    
+    async def track(_):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+    
+    list(engine.map_unordered(track, range(30), max_concurrency=4))
+    assert peak == 4
+
+
+def test_many_in_flight_without_threads():
+    threads_before = threading.active_count()
+    
+    async def wait(_):
+        await asyncio.sleep(0.05)
+    
+    list(engine.map_unordered(wait, range(300), max_concurrency=300))
+    assert threading.active_count() <= threads_before + 1
+
+
+def test_pool_submit_during_iteration():
+    pool = engine.TaskPool(max_concurrency=2)
+    pool.submit('a', double(1))
+    seen = []
+    for key, result in pool.completed():
+        seen.append((key, result))
+        if key == 'a':
+            pool.submit('b', double(result))
+    assert seen == [('a', 2), ('b', 4)]
+
+
+def test_pool_propagates_errors():
+    async def fail(_):
+        raise ValueError('boom')
+    
+    with pytest.raises(ValueError):
+        list(engine.map_unordered(fail, range(3)))
+
+
+def test_graph_runs_parent_after_its_own_children_only():
+    graph = engine.TaskGraph(max_concurrency=10)
+    
+    def leaf(value, delay):
+        async def run(inputs):
+            await asyncio.sleep(delay)
+            return value
+        return run
+    
+    async def total(inputs):
+        return sum(inputs.values())
+    
+    graph.add('fast-1', leaf(1, 0.0))
+    graph.add('fast-2', leaf(2, 0.0))
+    graph.add('slow', leaf(100, 0.2))
+    graph.add('fast-parent', total, ['fast-1', 'fast-2'])
+    graph.add('root', total, ['fast-parent', 'slow'])
+    
+    order = [key for key, _ in graph.completed()]
+    assert order.index('fast-parent') < order.index('slow')
+    assert order[-1] == 'root'
+
+
+def test_graph_passes_dependency_results():
+    graph = engine.TaskGraph()
+    
+    async def value(inputs):
+        return 3
+    
+    async def square(inputs):
+        return inputs['x'] ** 2
+    
+    graph.add('y', square, ['x'])
+    graph.add('x', value)
+    assert dict(graph.completed()) == {'x': 3, 'y': 9}
+
+
+def test_graph_propagates_errors():
+    graph = engine.TaskGraph()
+    
+    async def fail(inputs):
+        raise ValueError('boom')
+    
+    graph.add('a', fail)
+    graph.add('b', fail, ['a'])
+    with pytest.raises(ValueError):
+        list(graph.completed())
@@ -0,0 +1,96 @@
+import json
+import time
+import sqlite3
+import pytest
+from openai import AsyncOpenAI
+
+import llm
+import usage
+import tokens
+from fake_openai import FakeOpenAIServer, fake_chat_completion, fake_embedding, fake_assignments, fake_observations
+from llm import observe_request, MODEL
+
+
+@pytest.fixture(autouse=True)
+def restore_calibration(monkeypatch):
+    monkeypatch.setattr(tokens, '_calibration', 1.0)
+
+
+@pytest.fixture
+def point_clients(monkeypatch):
+    def point(server):
+        client = AsyncOpenAI(base_url=server.base_url, api_key='test', max_retries=0)
+        monkeypatch.setattr(llm, '_client', client)
+        monkeypatch.setattr(llm, '_cache', None)
+    return point
+
+
+def test_observations_follow_segments():
+    segments = [
+        ('2025-W01', [{'role': 'user', 'content': 'I planted tomatoes'}]),
+        ('2025-W02', [{'role': 'user', 'content': 'The tomatoes died'}, {'role': 'assistant', 'content': 'Sorry'}]),
+    ]
+    response = fake_chat_completion(observe_request(segments))
+    calls = response['choices'][0]['message']['tool_calls']
+    args = [json.loads(c['function']['arguments']) for c in calls]
+    assert [a['segment'] for a in args] == [1, 2, 2]
+    assert args[0]['text'] == 'User said: I planted tomatoes'
+
+
+def test_assignments_cover_every_observation():
+    calls = fake_assignments("Observations to assign:\n[4] User said: hello\n[7] Assistant said: hi")
+    args = [json.loads(c['function']['arguments']) for c in calls]
+    assert [a['observation_id'] for a in args] == [4, 7]
+    assert args[1]['model_name'] == 'assistant'
+
+
+def test_embeddings_are_deterministic_unit_vectors():
+    a, b = fake_embedding('hello'), fake_embedding('hello')
+    assert a == b
+    assert sum(v * v for v in a) == pytest.approx(1.0)
+    assert fake_embedding('other') != a
+
+
+def test_chat_through_server_with_latency(point_clients):
+    with FakeOpenAIServer(latency=0.05) as server:
+        point_clients(server)
+        started = time.monotonic()
+        response = llm.chat([{'role': 'user', 'content': 'hello there'}])
+        assert time.monotonic() - started >= 0.05
+        assert response.choices[0].message.content.startswith('Summary of')
+        assert response.model == MODEL
+
+
+def test_rate_limited_requests_are_retried(point_clients):
+    with FakeOpenAIServer(rate_limit_rate=0.5, retry_after_ms=1, seed=3) as server:
+        point_clients(server)
+        for i in range(5):
+            llm.chat([{'role': 'user', 'content': f'message {i}'}])
+        assert server.state.throttled > 0
+        assert server.state.stats()['requests']['/v1/chat/completions'] == 5 + server.state.throttled
+
+
+@pytest.mark.skipif(not hasattr(sqlite3.Connection, 'enable_load_extension'), reason='sqlite3 built without extension loading')
+def test_sync_end_to_end(tmp_path, point_clients):
+    from bench import synthetic_messages
+    from db import init_db, get_session, Observation, Summary
+    from sync import sync, import_messages
+
+    with FakeOpenAIServer() as server:
+        point_clients(server)
+        db_path = str(tmp_path / 'pyramid.db')
+        init_db(db_path)
+        session = get_session(db_path)
+        import_messages(session, synthetic_messages(200))
+        session.close()
+        try:
+            written = sync(str(tmp_path))
+        finally:
+            usage.disable_ledger()
+
+    session = get_session(db_path)
+    assert session.query(Observation).count() > 0
+    assert session.query(Summary).count() > 0
+    session.close()
+    assert (tmp_path / 'MEMORY.md').exists()
+    assert written
@@ -1,11 +1,18 @@
+import json
+import asyncio
 import pytest
-from llm import estimate_tokens, chunk_messages, MAX_TOKENS
+from unittest.mock import Mock, AsyncMock
+from openai.types.chat import ChatCompletion
+import llm
+from cache import ResponseCache
+from tokens import count_tokens
+from llm import estimate_tokens, chunk_messages, plan_chunks, MAX_TOKENS
 
 
 def test_estimate_tokens():
     text = "Hello world"
-    tokens = estimate_tokens(text)
-    assert tokens == len(text) // 4
+    assert estimate_tokens(text) == count_tokens(text)
+    assert 1 <= estimate_tokens(text) <= 3
 
 
 def test_estimate_tokens_empty():
@@ -23,7 +30,7 @@ def test_chunk_messages_single_chunk():
 
 
 def test_chunk_messages_splits_large():
-    long_content = "x" * (MAX_TOKENS * 4 + 100)
+    long_content = "word " * (MAX_TOKENS + 100)
     messages = [
         {'role': 'user', 'content': 'Short message'},
         {'role': 'assistant', 'content': long_content},
@@ -38,8 +45,133 @@ def test_chunk_messages_empty():
     assert chunks == []
 
 
+def test_chunk_messages_fills_close_to_limit():
+    messages = [{'role': 'user', 'content': f'Message number {i} about the weather today'} for i in range(2000)]
+    chunks = chunk_messages(messages, max_tokens=1000)
+    for chunk in chunks[:-1]:
+        used = sum(estimate_tokens(f"{m['role']}: {m['content']}\n") for m in chunk)
+        assert 950 <= used <= 1000
+
+
 def test_chunk_messages_preserves_order():
     messages = [{'role': 'user', 'content': f'Message {i}'} for i in range(5)]
     chunks = chunk_messages(messages)
     all_msgs = [m for chunk in chunks for m in chunk]
     assert all_msgs == messages
+
+
+def test_chat_uses_cache(tmp_path, monkeypatch):
+    response = ChatCompletion.model_validate({
+        'id': 'resp-1', 'object': 'chat.completion', 'created': 0, 'model': llm.MODEL,
+        'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': 'cached answer'}}],
+    })
+    raw = Mock(headers={}, parse=Mock(return_value=response))
+    create = AsyncMock(return_value=raw)
+    client = Mock()
+    client.chat.completions.with_raw_response.create = create
+    monkeypatch.setattr(llm, '_client', client)
+    monkeypatch.setattr(llm, '_cache', ResponseCache(tmp_path / 'llm_cache.db'))
+    
+    messages = [{'role': 'user', 'content': 'hello'}]
+    first = llm.chat(messages)
+    second = llm.chat(messages)
+    
+    assert create.call_count == 1
+    assert second.choices[0].message.content == 'cached answer'
+    assert first.choices[0].message.content == second.choices[0].message.content
+
+
+def test_truncated_response_is_not_cached(tmp_path, monkeypatch):
+    response = ChatCompletion.model_validate({
+        'id': 'resp-1', 'object': 'chat.completion', 'created': 0, 'model': llm.MODEL,
+        'choices': [{'index': 0, 'finish_reason': 'length', 'message': {'role': 'assistant', 'content': 'cut o'}}],
+    })
+    raw = Mock(headers={}, parse=Mock(return_value=response))
+    create = AsyncMock(return_value=raw)
+    client = Mock()
+    client.chat.completions.with_raw_response.create = create
+    cache = ResponseCache(tmp_path / 'llm_cache.db')
+    monkeypatch.setattr(llm, '_client', client)
+    monkeypatch.setattr(llm, '_cache', cache)
+    
+    messages = [{'role': 'user', 'content': 'hello'}]
+    llm.chat(messages)
+    llm.chat(messages)
+    
+    assert create.call_count == 2
+    assert len(cache) == 0
+
+
+def test_enable_cache_flushes_hits_at_exit(tmp_path, monkeypatch):
+    registered = []
+    monkeypatch.setattr(llm, '_cache', None)
+    monkeypatch.setattr(llm.atexit, 'register', registered.append)
+    cache = llm.enable_cache(tmp_path)
+    assert registered == [llm.flush_cache]
+    
+    request = {'model': 'm', 'messages': []}
+    cache.put(request, {})
+    cache.get(request)
+    llm.flush_cache()
+    assert not cache._touched
+    cache.close()
+
+
+def test_plan_chunks_packs_small_weeks():
+    by_week = {
+        '2025-W02': [{'role': 'user', 'content': 'week two', 'timestamp': '2025-01-08T10:00:00'}],
+        '2025-W01': [{'role': 'user', 'content': 'week one', 'timestamp': '2025-01-01T10:00:00'}],
+    }
+    plan = plan_chunks(by_week)
+    assert len(plan) == 1
+    assert [week for week, _ in plan[0]['segments']] == ['2025-W01', '2025-W02']
+
+
+def test_plan_chunks_without_packing_keeps_weeks_apart():
+    by_week = {
+        '2025-W01': [{'role': 'user', 'content': 'a', 'timestamp': '2025-01-01T10:00:00'}],
+        '2025-W02': [{'role': 'user', 'content': 'b', 'timestamp': '2025-01-08T10:00:00'}],
+    }
+    assert len(plan_chunks(by_week, pack_tails=False)) == 2
+
+
+def test_plan_chunks_does_not_pack_over_limit():
+    long_content = "word " * 600
+    by_week = {
+        '2025-W01': [{'role': 'user', 'content': long_content}],
+        '2025-W02': [{'role': 'user', 'content': long_content}],
+    }
+    assert len(plan_chunks(by_week, max_tokens=1000)) == 2
+
+
+def test_extract_planned_yields_in_plan_order(monkeypatch):
+    async def fake_segments(segments):
+        week = segments[0][0]
+        await asyncio.sleep(0.02 if week == 'w0' else 0)
+        return [{'text': week, 'timestamp': None}]
+    
+    monkeypatch.setattr(llm, 'aprocess_segments', fake_segments)
+    plan = [{'segments': [(f'w{i}', [{'role': 'user', 'content': 'x'}])], 'tokens': 1} for i in range(5)]
+    results = list(llm.extract_planned(plan, max_workers=5))
+    assert [i for i, _ in results] == [0, 1, 2, 3, 4]
+    assert [obs[0]['text'] for _, obs in results] == ['w0', 'w1', 'w2', 'w3', 'w4']
+
+
+def test_segmented_observations_keep_segment_timestamps(monkeypatch):
+    def tool_call(text, segment):
+        function = Mock(arguments=json.dumps({'text': text, 'segment': segment}))
+        function.name = 'add_observation'
+        return Mock(function=function)
+    
+    response = Mock(choices=[Mock(message=Mock(tool_calls=[tool_call('first', 1), tool_call('second', 2), tool_call('bad', 9)]))])
+    
+    async def fake_complete(request, stage=None):
+        return response
+    
+    monkeypatch.setattr(llm, 'acomplete', fake_complete)
+    segments = [
+        ('2025-W01', [{'role': 'user', 'content': 'a', 'timestamp': '2025-01-01T10:00:00'}]),
+        ('2025-W02', [{'role': 'user', 'content': 'b', 'timestamp': '2025-01-08T10:00:00'}]),
+    ]
+    observations = llm.engine.run(llm.aprocess_segments(segments))
+    assert [o['timestamp'] for o in observations] == ['2025-01-01T10:00:00', '2025-01-08T10:00:00', '2025-01-08T10:00:00']
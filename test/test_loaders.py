@@ -2,7 +2,11 @@ import pytest
 import json
 import tempfile
 import os
-from loaders import get_week_key, group_messages_by_week, load_claude_messages, load_openclaw_messages
+import io
+from loaders import (
+    get_week_key, group_messages_by_week, load_claude_messages, load_openclaw_messages,
+    iter_json_array
+)
 
 
 def test_get_week_key_basic():
@@ -123,6 +127,40 @@ def test_load_claude_messages_multipart_content():
         assert messages[0]['content'] == 'Part 1\nPart 2'
 
 
+def test_iter_json_array_small_reads():
+    data = [{'a': 'x] [, }'}, [1, 2, {'b': None}], 'text', 12345, {}]
+    f = io.StringIO(' \n' + json.dumps(data, indent=2))
+    assert list(iter_json_array(f, read_size=3)) == data
+
+
+def test_iter_json_array_empty_and_invalid():
+    assert list(iter_json_array(io.StringIO(' [ ] '))) == []
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(io.StringIO('{"a": 1}')))
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(io.StringIO('[{"a": 1}'), read_size=4))
+
+
+def test_load_claude_messages_sorts_across_conversations():
+    data = [
+        {'chat_messages': [
+            {'sender': 'human', 'content': [{'type': 'text', 'text': f'a{i}'}], 'created_at': f'2025-01-{10 + 2 * i:02d}T00:00:00Z'}
+            for i in range(3)
+        ]},
+        {'chat_messages': [
+            {'sender': 'human', 'content': [{'type': 'text', 'text': f'b{i}'}], 'created_at': f'2025-01-{11 + 2 * i:02d}T00:00:00Z'}
+            for i in range(3)
+        ]},
+    ]
+    
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
+        json.dump(data, f)
+        f.flush()
+        
+        messages, _ = load_claude_messages(f.name)
+        assert [m['content'] for m in messages] == ['a0', 'b0', 'a1', 'b1', 'a2', 'b2']
+
+
 def test_load_openclaw_messages():
     records = [
         {'type': 'session', 'id': 'test-session', 'timestamp': '2025-01-15T10:00:00Z'},
@@ -237,3 +275,20 @@ def test_load_openclaw_messages_with_limit():
         
         messages, _ = load_openclaw_messages(f.name, limit=2)
         assert len(messages) == 2
+
+
+def test_message_hash_depends_on_role_content_timestamp():
+    from loaders import message_hash
+    base = {'role': 'user', 'content': 'Hello', 'timestamp': '2025-01-15T10:00:00'}
+    assert message_hash(base) == message_hash(dict(base))
+    assert message_hash(base) != message_hash({**base, 'role': 'assistant'})
+    assert message_hash(base) != message_hash({**base, 'content': 'Hello!'})
+    assert message_hash(base) != message_hash({**base, 'timestamp': '2025-01-15T10:00:01'})
+
+
+def test_filter_new_messages_skips_known_and_duplicates():
+    from loaders import message_hash, filter_new_messages
+    old = {'role': 'user', 'content': 'Old', 'timestamp': '2025-01-15T10:00:00'}
+    new = {'role': 'user', 'content': 'New', 'timestamp': '2025-01-16T10:00:00'}
+    result = filter_new_messages([old, new, dict(new)], {message_hash(old)})
+    assert result == [new]
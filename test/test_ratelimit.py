@@ -0,0 +1,148 @@
+import asyncio
+import pytest
+import openai
+from unittest.mock import Mock
+import engine
+import ratelimit
+from ratelimit import (
+    RateLimiter, TokenBucket, AdaptiveConcurrency, parse_duration, estimate_request_tokens
+)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    async def fast_sleep(delay):
+        return None
+    monkeypatch.setattr(ratelimit.asyncio, 'sleep', fast_sleep)
+
+
+def raw_response(headers=None, total_tokens=None):
+    usage = Mock(total_tokens=total_tokens, prompt_tokens=total_tokens) if total_tokens else None
+    return Mock(headers=headers or {}, parse=Mock(return_value=Mock(usage=usage)))
+
+
+def status_error(cls, status, headers=None):
+    response = Mock(status_code=status, headers=headers or {}, request=Mock())
+    return cls('error', response=response, body=None)
+
+
+def test_parse_duration():
+    assert parse_duration('1s') == 1
+    assert parse_duration('6m0s') == 360
+    assert parse_duration('20ms') == pytest.approx(0.02)
+    assert parse_duration('2') == 2
+    assert parse_duration(None) is None
+
+
+def test_estimate_request_tokens_chat_and_embeddings():
+    from tokens import count_tokens
+    text = 'The quick brown fox jumps over the lazy dog.'
+    chat = {'messages': [{'role': 'user', 'content': text}]}
+    expected_prompt = count_tokens(text) + ratelimit.MESSAGE_OVERHEAD_TOKENS
+    assert estimate_request_tokens(chat) == expected_prompt + ratelimit.DEFAULT_COMPLETION_TOKENS
+    assert estimate_request_tokens({'input': [text, text]}) == 2 * count_tokens(text)
+
+
+def test_token_bucket_sync_lowers_level():
+    bucket = TokenBucket(1000, 1000)
+    bucket.sync(limit=500, remaining=10)
+    assert bucket.capacity == 500
+    assert bucket.level <= 10
+
+
+def test_retries_on_rate_limit_then_succeeds():
+    limiter = RateLimiter(concurrency=AdaptiveConcurrency(initial=8))
+    attempts = []
+    
+    async def send():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise status_error(openai.RateLimitError, 429, {'retry-after': '1'})
+        return raw_response()
+    
+    info = {}
+    engine.run(limiter.call('m', {'messages': []}, send, info))
+    assert len(attempts) == 3
+    assert info['retries'] == 2
+    assert info['latency'] >= 0
+    assert limiter.retries == 2
+    assert limiter.throttled == 2
+    assert limiter.concurrency.limit < 8
+
+
+def test_gives_up_after_max_retries():
+    limiter = RateLimiter()
+    
+    async def send():
+        raise status_error(openai.InternalServerError, 500)
+    
+    with pytest.raises(openai.InternalServerError):
+        engine.run(limiter.call('m', {'messages': []}, send))
+    assert limiter.retries == ratelimit.MAX_RETRIES
+
+
+def test_non_retryable_errors_raise_immediately():
+    limiter = RateLimiter()
+    
+    async def send():
+        raise status_error(openai.BadRequestError, 400)
+    
+    with pytest.raises(openai.BadRequestError):
+        engine.run(limiter.call('m', {'messages': []}, send))
+    assert limiter.retries == 0
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_failed_attempts_refund_reserved_tokens():
+    limiter = RateLimiter(tpm=10000)
+    attempts = []
+    
+    async def send():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise status_error(openai.RateLimitError, 429, {'retry-after': '1'})
+        return raw_response(total_tokens=100)
+    
+    engine.run(limiter.call('m', {'messages': []}, send))
+    requests, tokens = limiter.buckets['m']
+    # Only the successful attempt's actual usage stays deducted
+    assert tokens.level == pytest.approx(10000 - 100, abs=1)
+
+
+def test_seed_concurrency_from_workers(monkeypatch):
+    monkeypatch.setattr(ratelimit, '_limiter', RateLimiter())
+    ratelimit.seed_concurrency(32)
+    assert ratelimit.get_limiter().concurrency.limit == 32
+    ratelimit.seed_concurrency(0)
+    assert ratelimit.get_limiter().concurrency.limit == ratelimit.MIN_CONCURRENCY
+
+
+def test_headers_update_buckets():
+    limiter = RateLimiter()
+    
+    async def send():
+        return raw_response({
+            'x-ratelimit-limit-requests': '60',
+            'x-ratelimit-remaining-requests': '5',
+            'x-ratelimit-limit-tokens': '1000',
+            'x-ratelimit-remaining-tokens': '100',
+        })
+    
+    engine.run(limiter.call('m', {'messages': []}, send))
+    requests, tokens = limiter.buckets['m']
+    assert requests.capacity == 60
+    assert requests.level <= 5
+    assert tokens.capacity == 1000
+
+
+def test_concurrency_grows_on_fast_success():
+    concurrency = AdaptiveConcurrency(initial=4)
+    
+    async def cycle():
+        for _ in range(20):
+            await concurrency.acquire()
+            await concurrency.release(latency=0.1)
+    
+    engine.run(cycle())
+    assert concurrency.limit > 4
+    assert concurrency.in_flight == 0
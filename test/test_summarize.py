@@ -1,18 +1,18 @@
+import re
+import json
+import asyncio
 import pytest
-from datetime import datetime, UTC
-from db import Observation
-from summarize import chunk_observations, get_observations_by_model, STEP
-
-
-def test_get_observations_by_model(session, user_model):
-    session.add(Observation(text='Obs 1', timestamp=datetime.now(UTC), model_id=user_model.id))
-    session.add(Observation(text='Obs 2', timestamp=datetime.now(UTC), model_id=user_model.id))
-    session.add(Observation(text='Obs 3', timestamp=datetime.now(UTC)))
-    session.commit()
-    
-    by_model = get_observations_by_model(session)
-    assert user_model.id in by_model
-    assert len(by_model[user_model.id]) == 2
+from datetime import datetime, timedelta, UTC
+from unittest.mock import Mock
+import summarize
+import usage
+from db import init_db, get_session, Model, Observation, Summary
+from embeddings import EMBEDDING_DIM
+from llm import MAX_TOKENS
+from summarize import (
+    chunk_observations, confident_model, group_for_reduce, plan_tier0_tasks, save_tier0_summaries,
+    apply_assignments, plan_higher_tiers, plan_dirty_regeneration, STEP
+)
 
 
 def test_chunk_observations_small(session):
@@ -37,8 +37,7 @@ def test_chunk_observations_exact_step(session, user_model):
 
 
 def test_chunk_observations_by_tokens(session, user_model):
-    from llm import MAX_TOKENS
-    long_text = 'x' * (MAX_TOKENS * 4)
+    long_text = 'word ' * MAX_TOKENS
     session.add(Observation(text='Short', timestamp=datetime.now(UTC), model_id=user_model.id))
     session.add(Observation(text=long_text, timestamp=datetime.now(UTC), model_id=user_model.id))
     session.add(Observation(text='Short 2', timestamp=datetime.now(UTC), model_id=user_model.id))
@@ -51,3 +50,428 @@ def test_chunk_observations_by_tokens(session, user_model):
 
 def test_step_constant():
     assert STEP == 10
+
+
+def assign_response(pairs):
+    calls = []
+    for obs_id, model_name in pairs:
+        function = Mock(arguments=json.dumps({'observation_id': obs_id, 'model_name': model_name}))
+        function.name = 'assign_model'
+        calls.append(Mock(function=function))
+    return Mock(choices=[Mock(message=Mock(tool_calls=calls))])
+
+
+def test_assign_prompt_prefix_is_stable_across_batches(session, monkeypatch):
+    observations = [Observation(text=f'Obs {i}', timestamp=datetime.now(UTC)) for i in range(STEP * 2)]
+    session.add_all(observations)
+    session.commit()
+    
+    sent = []
+    first_id = observations[0].id
+    
+    async def fake_achat(messages, tools=None, tool_choice=None, stage=None):
+        sent.append(messages)
+        return assign_response([(first_id, 'garden')])
+    
+    monkeypatch.setattr(summarize, 'achat', fake_achat)
+    summarize.assign_models_to_observations(session, observations, max_workers=1)
+    
+    assert len(sent) == 2
+    assert sent[0][0] == sent[1][0]
+    assert 'garden' not in sent[0][1]['content']
+    assert 'Models created earlier in this run: garden' in sent[1][1]['content']
+
+
+def test_parallel_assignment_reconciles_new_models(session, monkeypatch):
+    observations = [Observation(text=f'Obs {i}', timestamp=datetime.now(UTC)) for i in range(STEP * 4)]
+    session.add_all(observations)
+    session.commit()
+    
+    async def fake_achat(messages, tools=None, tool_choice=None, stage=None):
+        await asyncio.sleep(0.01)
+        ids = [int(i) for i in re.findall(r'^\[(\d+)\]', messages[1]['content'], re.M)]
+        return assign_response([(i, 'Garden Club' if i % 2 else 'user') for i in ids] + [(999999, 'garden-club')])
+    
+    monkeypatch.setattr(summarize, 'achat', fake_achat)
+    summarize.assign_models_to_observations(session, observations, max_workers=4)
+    
+    garden = session.query(Model).filter_by(name='garden-club').one()
+    assert garden.content_dirty
+    assert session.query(Observation).filter(Observation.model_id == None).count() == 0
+    assert session.query(Observation).filter_by(model_id=garden.id).count() == STEP * 2
+
+
+def test_confident_model_needs_similarity_and_margin():
+    assert confident_model([(1, 0.8), (2, 0.5)], margin=0.1, min_similarity=0.5) == 1
+    assert confident_model([(1, 0.8), (2, 0.75)], margin=0.1, min_similarity=0.5) is None
+    assert confident_model([(1, 0.4), (2, 0.1)], margin=0.1, min_similarity=0.5) is None
+    assert confident_model([(1, 0.9)], margin=0.1, min_similarity=0.5) is None
+
+
+@pytest.mark.skipif(not hasattr(__import__('sqlite3').Connection, 'enable_load_extension'), reason='sqlite3 built without extension loading')
+def test_fast_path_assigns_clear_matches_and_defers_the_rest(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'pyramid.db')
+    init_db(db_path)
+    session = get_session(db_path)
+    user = session.query(Model).filter_by(name='user').one()
+    assistant = session.query(Model).filter_by(name='assistant').one()
+    
+    pad = [0.0] * (EMBEDDING_DIM - 3)
+    vectors = {'user': [1.0, 0.0, 0.0] + pad, 'assistant': [0.0, 1.0, 0.0] + pad, 'other': [0.6, 0.6, 0.5] + pad}
+    monkeypatch.setattr(summarize, 'embed_many', lambda texts, max_workers=10: [vectors[t.split(': ')[-1].split()[0]] for t in texts])
+    conn = summarize.open_vec_connection(db_path)
+    summarize.update_centroids(conn, [(user.id, vectors['user'])] * summarize.CENTROID_MIN_OBSERVATIONS
+                               + [(assistant.id, vectors['assistant'])] * summarize.CENTROID_MIN_OBSERVATIONS)
+    
+    observations = [Observation(text=f'{kind} fact', timestamp=datetime.now(UTC)) for kind in ('user', 'assistant', 'other')]
+    session.add_all(observations)
+    session.commit()
+    
+    remaining, embeddings = summarize.fast_assign_observations(session, conn, observations)
+    assert [o.text for o in remaining] == ['other fact']
+    assert len(embeddings) == 3
+    session.expire_all()
+    assert [o.model_id for o in observations[:2]] == [user.id, assistant.id]
+    assert conn.execute("SELECT count FROM model_centroids WHERE model_id = ?", [user.id]).fetchone()[0] == summarize.CENTROID_MIN_OBSERVATIONS + 1
+    assert conn.execute("SELECT COUNT(*) FROM memory_vec").fetchone()[0] == 3
+    conn.close()
+    session.close()
+
+
+def test_models_context_only_rerenders_changed_models(session, user_model, assistant_model, monkeypatch):
+    session.add(Observation(text='User likes tea', timestamp=datetime.now(UTC), model_id=user_model.id))
+    session.commit()
+    
+    rendered = []
+    original = summarize.render_model_context
+    
+    def counting_render(session, model, include_samples=True):
+        rendered.append(model.name)
+        return original(session, model, include_samples)
+    
+    monkeypatch.setattr(summarize, 'render_model_context', counting_render)
+    first = summarize.get_models_context(session)
+    assert sorted(rendered) == ['assistant', 'user']
+    assert '### user' in first and '  - User likes tea' in first
+    
+    rendered.clear()
+    assert summarize.get_models_context(session) == first
+    assert rendered == []
+    
+    obs = Observation(text='User likes coffee', timestamp=datetime.now(UTC))
+    session.add(obs)
+    session.commit()
+    summarize.apply_assignments(session, {obs.id: user_model.id})
+    session.commit()
+    context = summarize.get_models_context(session)
+    assert rendered == ['user']
+    assert '  - User likes coffee' in context
+    assert session.get(Model, user_model.id).context_dirty is False
+
+
+def test_tier0_planning_starts_after_watermark(session, user_model):
+    base = datetime(2025, 1, 1)
+    session.add_all([Observation(text=f'Obs {i}', timestamp=base + timedelta(hours=i), model_id=user_model.id) for i in range(25)])
+    session.commit()
+    
+    tasks = plan_tier0_tasks(session)
+    assert len(tasks) == 2
+    save_tier0_summaries(session, [(t[0], 'summary', t[4], t[5], [o.id for o in t[3]]) for t in tasks])
+    assert user_model.tier0_watermark_ts == base + timedelta(hours=19)
+    assert plan_tier0_tasks(session) == []
+    
+    session.add_all([Observation(text=f'Obs {i}', timestamp=base + timedelta(hours=i), model_id=user_model.id) for i in range(25, 30)])
+    session.commit()
+    tasks = plan_tier0_tasks(session)
+    assert len(tasks) == 1
+    assert [o.text for o in tasks[0][3]] == [f'Obs {i}' for i in range(20, 30)]
+
+
+def test_backdated_assignment_dirties_covering_summary(session, user_model):
+    base = datetime(2025, 1, 1)
+    session.add_all([Observation(text=f'Obs {i}', timestamp=base + timedelta(hours=i), model_id=user_model.id) for i in range(STEP)])
+    session.commit()
+    tasks = plan_tier0_tasks(session)
+    save_tier0_summaries(session, [(t[0], 'summary', t[4], t[5], [o.id for o in t[3]]) for t in tasks])
+    
+    late = Observation(text='Late', timestamp=base + timedelta(hours=3, minutes=30))
+    session.add(late)
+    session.commit()
+    apply_assignments(session, {late.id: user_model.id})
+    session.commit()
+    
+    assert session.query(Summary).filter_by(tier=0).one().is_dirty
+    assert plan_tier0_tasks(session) == []
+
+
+def test_backdated_observations_outside_every_window_are_planned(session, user_model):
+    base = datetime(2025, 6, 1)
+    session.add_all([Observation(text=f'Obs {i}', timestamp=base + timedelta(hours=i), model_id=user_model.id) for i in range(STEP)])
+    session.commit()
+    tasks = plan_tier0_tasks(session)
+    save_tier0_summaries(session, [(t[0], 'summary', t[4], t[5], [o.id for o in t[3]]) for t in tasks])
+    
+    old = [Observation(text=f'Old {i}', timestamp=datetime(2024, 1, 1) + timedelta(hours=i)) for i in range(15)]
+    session.add_all(old)
+    session.commit()
+    apply_assignments(session, {o.id: user_model.id for o in old})
+    session.commit()
+    
+    assert session.query(Summary).filter_by(is_dirty=True).count() == 0
+    tasks = plan_tier0_tasks(session)
+    assert [[o.text for o in t[3]] for t in tasks] == [[f'Old {i}' for i in range(STEP)]]
+    save_tier0_summaries(session, [(t[0], 'summary', t[4], t[5], [o.id for o in t[3]]) for t in tasks])
+    
+    session.add_all([Observation(text=f'New {i}', timestamp=base + timedelta(days=1, hours=i), model_id=user_model.id) for i in range(5)])
+    session.commit()
+    tasks = plan_tier0_tasks(session)
+    assert [o.text for o in tasks[0][3]] == [f'Old {i}' for i in range(STEP, 15)] + [f'New {i}' for i in range(5)]
+
+
+def test_watermark_initialized_for_existing_summaries(session, user_model):
+    base = datetime(2025, 1, 1)
+    session.add_all([Observation(text=f'Obs {i}', timestamp=base + timedelta(hours=i), model_id=user_model.id) for i in range(STEP * 2)])
+    session.add(Summary(model_id=user_model.id, tier=0, text='old', start_timestamp=base, end_timestamp=base + timedelta(hours=STEP - 1)))
+    session.commit()
+    
+    tasks = plan_tier0_tasks(session)
+    assert user_model.tier0_watermark_ts == base + timedelta(hours=STEP - 1)
+    assert [o.text for o in tasks[0][3]] == [f'Obs {i}' for i in range(STEP, STEP * 2)]
+
+
+def test_group_for_reduce_respects_fanout_and_tokens():
+    groups = group_for_reduce([f'summary {i}' for i in range(25)], fanout=10)
+    assert [len(g) for g in groups] == [10, 10, 5]
+    assert group_for_reduce(['a', 'b', 'c', 'd'], max_tokens=1) == [['a', 'b'], ['c', 'd']]
+    assert group_for_reduce(['a', 'b', 'c'], max_tokens=1) == [['a', 'b', 'c']]
+    assert [len(g) for g in group_for_reduce(['x'] * 11, fanout=10)] == [11]
+
+
+def test_summarize_observations_maps_concurrently_and_tree_reduces(monkeypatch):
+    active = 0
+    peak = 0
+    combines = []
+    
+    async def fake_chunk(observations, model_name, model_description):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return f'chunk {observations[0]}'
+    
+    async def fake_combine(texts, model_name, model_description):
+        combines.append(len(texts))
+        return ' + '.join(texts)
+    
+    monkeypatch.setattr(summarize, 'chunk_observations', lambda observations: [[i] for i in observations])
+    monkeypatch.setattr(summarize, 'asummarize_chunk', fake_chunk)
+    monkeypatch.setattr(summarize, 'acombine_summaries', fake_combine)
+    
+    result = summarize.engine.run(summarize.asummarize_observations(list(range(25)), 'user', ''))
+    assert peak == 25
+    assert combines == [10, 10, 5, 3]
+    assert result.count('chunk') == 25
+
+
+def test_higher_tiers_link_children_to_parents(tmp_path, monkeypatch):
+    async def fake_summaries(summaries, model_name, model_description):
+        return f'{len(summaries)} summaries'
+    
+    monkeypatch.setattr(summarize, 'asummarize_summaries', fake_summaries)
+    db_path = str(tmp_path / 'pyramid.db')
+    init_db(db_path)
+    session = get_session(db_path)
+    user = session.query(Model).filter_by(name='user').one()
+    base = datetime(2025, 1, 1)
+    session.add_all([
+        Summary(model_id=user.id, tier=0, text=f'T0 {i}', start_timestamp=base + timedelta(days=i), end_timestamp=base + timedelta(days=i, hours=12))
+        for i in range(STEP * 2 + 5)
+    ])
+    session.commit()
+    
+    assert summarize.run_higher_tier_summarization(db_path) == 2
+    assert summarize.run_higher_tier_summarization(db_path) == 0
+    
+    session.expire_all()
+    parents = session.query(Summary).filter_by(tier=1).order_by(Summary.start_timestamp).all()
+    tier0 = session.query(Summary).filter_by(tier=0).order_by(Summary.start_timestamp).all()
+    assert [s.parent_id for s in tier0[:STEP]] == [parents[0].id] * STEP
+    assert all(s.parent_id is None for s in tier0[STEP * 2:])
+    session.close()
+
+
+def test_higher_tiers_build_past_a_tier_with_no_unparented_rows(session, user_model):
+    base = datetime(2025, 1, 1)
+    session.add_all([
+        Summary(model_id=user_model.id, tier=0, text=f'T0 {i}', start_timestamp=base + timedelta(days=i), end_timestamp=base + timedelta(days=i))
+        for i in range(3)
+    ] + [
+        Summary(model_id=user_model.id, tier=2, text=f'T2 {i}', start_timestamp=base + timedelta(days=i), end_timestamp=base + timedelta(days=i))
+        for i in range(STEP)
+    ])
+    session.commit()
+    
+    nodes = plan_higher_tiers(session)
+    assert [(n['tier'], len(n['children'])) for n in nodes] == [(3, STEP)]
+    assert plan_higher_tiers(session, max_tier=2) == []
+
+
+def test_dirty_regeneration_follows_the_summary_graph(tmp_path, monkeypatch):
+    async def fake_summaries(texts, model_name, model_description):
+        return '[' + ','.join(texts) + ']'
+    
+    async def fake_observations(observations, model_name, model_description):
+        return 'fresh'
+    
+    monkeypatch.setattr(summarize, 'asummarize_summaries', fake_summaries)
+    monkeypatch.setattr(summarize, 'asummarize_observations', fake_observations)
+    db_path = str(tmp_path / 'pyramid.db')
+    init_db(db_path)
+    session = get_session(db_path)
+    user = session.query(Model).filter_by(name='user').one()
+    base = datetime(2025, 1, 1)
+    session.add_all([
+        Summary(model_id=user.id, tier=0, text=f't{i}', start_timestamp=base + timedelta(days=i), end_timestamp=base + timedelta(days=i, hours=12))
+        for i in range(STEP * STEP)
+    ])
+    session.commit()
+    
+    assert summarize.run_higher_tier_summarization(db_path) == STEP + 1
+    top = session.query(Summary).filter_by(tier=2).one()
+    first = session.query(Summary).filter_by(tier=0).order_by(Summary.start_timestamp).first()
+    first.is_dirty = True
+    session.commit()
+    
+    assert summarize.process_all_dirty(db_path, patch=False) == 3
+    session.expire_all()
+    assert top.text.startswith('[[fresh,t1,')
+    assert session.query(Summary).filter(Summary.is_dirty == True).count() == 0
+    session.close()
+
+
+def test_unchanged_inputs_skip_regeneration(tmp_path, monkeypatch):
+    calls = []
+    
+    async def fake_summaries(texts, model_name, model_description):
+        calls.append('summaries')
+        return f'parent of {len(texts)}'
+    
+    async def fake_observations(observations, model_name, model_description):
+        calls.append('observations')
+        return f'{len(observations)} observations'
+    
+    monkeypatch.setattr(summarize, 'asummarize_summaries', fake_summaries)
+    monkeypatch.setattr(summarize, 'asummarize_observations', fake_observations)
+    db_path = str(tmp_path / 'pyramid.db')
+    init_db(db_path)
+    session = get_session(db_path)
+    user = session.query(Model).filter_by(name='user').one()
+    base = datetime(2025, 1, 1)
+    session.add_all([Observation(text=f'Obs {i}', timestamp=base + timedelta(hours=i), model_id=user.id) for i in range(STEP * STEP)])
+    session.commit()
+    tasks = summarize.plan_tier0_tasks(session)
+    summarize.save_tier0_summaries(session, [(t[0], f'window {i}', t[4], t[5], [o.id for o in t[3]]) for i, t in enumerate(tasks)])
+    summarize.run_higher_tier_summarization(db_path)
+    calls.clear()
+    
+    first = session.query(Summary).filter_by(tier=0).order_by(Summary.start_timestamp).first()
+    first.is_dirty = True
+    session.commit()
+    progress = []
+    assert summarize.process_all_dirty(db_path, on_progress=progress.append) == 0
+    assert calls == []
+    assert 'Skipped 2/2 dirty summaries with unchanged inputs' in progress
+    
+    session.add(Observation(text='Late', timestamp=base + timedelta(minutes=30), model_id=user.id))
+    first.is_dirty = True
+    session.commit()
+    assert summarize.process_all_dirty(db_path, patch=False) == 2
+    assert calls == ['observations', 'summaries']
+    session.close()
+
+
+def test_dirty_inputs_come_from_recorded_sources_when_windows_share_a_timestamp(session, user_model):
+    ts = datetime(2025, 1, 1)
+    session.add_all([Observation(text=f'Obs {i}', timestamp=ts, model_id=user_model.id) for i in range(STEP * 2)])
+    session.commit()
+    tasks = plan_tier0_tasks(session)
+    save_tier0_summaries(session, [(t[0], f'window {i}', t[4], t[5], [o.id for o in t[3]]) for i, t in enumerate(tasks)])
+    first, second = session.query(Summary).filter_by(tier=0).order_by(Summary.id).all()
+    
+    first.is_dirty = True
+    session.commit()
+    node, = plan_dirty_regeneration(session)
+    assert [o.text for o in node['observations']] == [f'Obs {i}' for i in range(STEP)]
+    assert node['fingerprint'] == node['input_hash']
+    
+    late = Observation(text='Late', timestamp=ts, model_id=user_model.id)
+    session.add(late)
+    second.is_dirty = True
+    session.commit()
+    nodes = plan_dirty_regeneration(session)
+    assert [len(n['observations']) for n in nodes] == [STEP + 1, STEP]
+    assert nodes[1]['fingerprint'] == nodes[1]['input_hash']
+    # Only the late observation is new to the first window
+    assert [o.id for o in nodes[0]['delta']] == [late.id]
+    assert nodes[0]['patchable']
+
+
+def test_late_observation_patches_summaries(tmp_path, monkeypatch):
+    patches = []
+    
+    async def fake_patch(existing, update, model_name, model_description, saved_tokens=0):
+        patches.append((update, saved_tokens))
+        return f'{existing} + patch'
+    
+    async def fake_full(*args):
+        raise AssertionError('full rebuild')
+    
+    async def fake_parent(texts, model_name, model_description):
+        return 'parent'
+    
+    monkeypatch.setattr(summarize, 'apatch_summary', fake_patch)
+    monkeypatch.setattr(summarize, 'asummarize_summaries', fake_full)
+    monkeypatch.setattr(summarize, 'asummarize_observations', fake_full)
+    usage.reset_usage()
+    db_path = str(tmp_path / 'pyramid.db')
+    init_db(db_path)
+    session = get_session(db_path)
+    user = session.query(Model).filter_by(name='user').one()
+    base = datetime(2025, 1, 1)
+    session.add_all([Observation(text=f'Obs {i} ' + 'detail ' * 20, timestamp=base + timedelta(hours=i), model_id=user.id) for i in range(STEP * STEP)])
+    session.commit()
+    tasks = summarize.plan_tier0_tasks(session)
+    summarize.save_tier0_summaries(session, [(t[0], f'window {i}', t[4], t[5], [o.id for o in t[3]]) for i, t in enumerate(tasks)])
+    monkeypatch.setattr(summarize, 'asummarize_summaries', fake_parent)
+    summarize.run_higher_tier_summarization(db_path)
+    monkeypatch.setattr(summarize, 'asummarize_summaries', fake_full)
+    
+    first = session.query(Summary).filter_by(tier=0).order_by(Summary.start_timestamp).first()
+    session.add(Observation(text='Late fact', timestamp=base + timedelta(minutes=30), model_id=user.id))
+    first.is_dirty = True
+    session.commit()
+    progress = []
+    assert summarize.process_all_dirty(db_path, on_progress=progress.append) == 2
+    assert [update for update, _ in patches] == [
+        'New observations:\n- Late fact',
+        'Updated sections:\n\nBefore:\nwindow 0\n\nAfter:\nwindow 0 + patch',
+    ]
+    assert patches[0][1] > 0
+    assert any(p.startswith('Patched 2/2 dirty summaries') for p in progress)
+    
+    session.expire_all()
+    parent = session.query(Summary).filter_by(tier=1).one()
+    assert parent.text == 'parent + patch'
+    assert session.get(Summary, first.id).patch_count == 1
+    assert len(session.get(Summary, first.id).sources) == STEP + 1
+    session.close()
+
+
+def test_patch_policy_falls_back_to_full_rebuild():
+    node = {'patchable': True, 'text': 'old', 'patch_count': 0}
+    assert summarize.should_patch(node, 1, 10)
+    assert not summarize.should_patch(node, 0, 10)
+    assert not summarize.should_patch(node, 6, 10)
+    assert not summarize.should_patch(dict(node, patch_count=summarize.PATCH_MAX_CONSECUTIVE), 1, 10)
+    assert not summarize.should_patch(dict(node, patchable=False), 1, 10)
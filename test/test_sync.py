@@ -0,0 +1,136 @@
+import json
+import pytest
+from datetime import datetime
+import sync
+from db import init_db, get_session, vec_connection, Model, Observation, Summary, ImportChunk
+from embeddings import EMBEDDING_DIM
+
+
+@pytest.fixture
+def fake_extract(monkeypatch):
+    calls = []
+    
+    def extract_planned(plan, on_progress=None, max_workers=10):
+        for i, entry in enumerate(plan):
+            messages = [m for _, chunk in entry['segments'] for m in chunk]
+            calls.append(messages)
+            yield i, [{'text': f"saw {m['content']}", 'timestamp': m['timestamp']} for m in messages]
+    
+    monkeypatch.setattr(sync, 'extract_planned', extract_planned)
+    return calls
+
+
+def make_messages(contents):
+    return [{'role': 'user', 'content': c, 'timestamp': f'2025-01-{i + 10:02d}T10:00:00'} for i, c in enumerate(contents)]
+
+
+def test_import_messages_saves_observations(session, fake_extract):
+    count = sync.import_messages(session, make_messages(['a', 'b']))
+    assert count == 2
+    assert {o.text for o in session.query(Observation).all()} == {'saw a', 'saw b'}
+
+
+def test_reimport_only_sends_new_messages(session, fake_extract):
+    sync.import_messages(session, make_messages(['a', 'b']))
+    fake_extract.clear()
+    
+    count = sync.import_messages(session, make_messages(['a', 'b', 'c']))
+    
+    assert count == 1
+    sent = [m['content'] for call in fake_extract for m in call]
+    assert sent == ['c']
+    assert session.query(Observation).count() == 3
+
+
+def test_interrupted_import_resumes_pending_chunks(session, monkeypatch):
+    calls = []
+    crash_after = [1]
+    
+    def crashing_extract(plan, on_progress=None, max_workers=10):
+        for i, entry in enumerate(plan):
+            if crash_after and len(calls) == crash_after[0]:
+                raise RuntimeError('interrupted')
+            messages = [m for _, chunk in entry['segments'] for m in chunk]
+            calls.append([m['content'][:1] for m in messages])
+            yield i, [{'text': f"saw {m['content'][:1]}", 'timestamp': m['timestamp']} for m in messages]
+    
+    monkeypatch.setattr(sync, 'extract_planned', crashing_extract)
+    messages = make_messages([letter + ' word' * 6000 for letter in 'abc'])
+    
+    with pytest.raises(RuntimeError):
+        sync.import_messages(session, messages)
+    
+    chunks = session.query(ImportChunk).order_by(ImportChunk.id).all()
+    assert [c.status for c in chunks] == ['done', 'pending', 'pending']
+    assert chunks[0].observation_count == 1
+    assert session.query(Observation).one().import_chunk_id == chunks[0].id
+    
+    calls.clear()
+    crash_after.clear()
+    count = sync.import_messages(session, messages)
+    
+    assert count == 2
+    assert calls == [['b'], ['c']]
+    assert session.query(ImportChunk).count() == 3
+
+
+def test_superseded_pending_chunks_are_abandoned(session, fake_extract):
+    messages = make_messages(['a', 'b'])
+    segment_hashes = [['2025-W02', [sync.message_hash(m) for m in messages] + ['gone']]]
+    session.add_all([
+        ImportChunk(key='stale', segments=json.dumps(segment_hashes), message_count=3),
+        ImportChunk(key='other', segments=json.dumps([['2025-W02', ['elsewhere']]]), message_count=1),
+    ])
+    session.commit()
+    
+    assert sync.import_messages(session, messages) == 2
+    statuses = {c.key: c.status for c in session.query(ImportChunk).all()}
+    assert statuses.pop('stale') == 'abandoned'
+    assert statuses.pop('other') == 'pending'
+    assert set(statuses.values()) == {'done'}
+
+
+def test_pending_embeddings_use_the_embedded_index(session):
+    conn = session.connection()
+    for source_type, query in sync.PENDING_EMBEDDINGS.items():
+        plan = ' '.join(row[3] for row in conn.exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {query} {sync.PENDING_FILTER} AND id > ? ORDER BY id LIMIT ?", (0, 10)
+        ))
+        assert f'ix_{"observations" if source_type == "observation" else "summaries"}_embedded' in plan
+        assert 'TEMP B-TREE' not in plan
+
+
+@pytest.mark.skipif(not hasattr(__import__('sqlite3').Connection, 'enable_load_extension'), reason='sqlite3 built without extension loading')
+def test_embed_new_items_pages_through_unembedded_rows(tmp_path, monkeypatch):
+    batches = []
+    
+    def fake_embed_many(texts, max_workers=10, on_progress=None):
+        batches.append(len(texts))
+        return [[1.0] + [0.0] * (EMBEDDING_DIM - 1) for _ in texts]
+    
+    monkeypatch.setattr(sync, 'embed_many', fake_embed_many)
+    db_path = str(tmp_path / 'pyramid.db')
+    init_db(db_path)
+    session = get_session(db_path)
+    user = session.query(Model).filter_by(name='user').one()
+    ts = datetime(2025, 1, 1)
+    session.add_all([Observation(text=f'Obs {i}', timestamp=ts) for i in range(4)] + [Observation(text='  ', timestamp=ts)])
+    session.add(Summary(model_id=user.id, tier=0, text='Summary', start_timestamp=ts, end_timestamp=ts))
+    session.commit()
+    
+    assert sync.embed_new_items(db_path, page_size=3) == 5
+    assert batches == [3, 1, 1]
+    assert sync.embed_new_items(db_path) == 0
+    assert batches == [3, 1, 1]
+    
+    # Rows from before the embedded column are settled against memory_vec once
+    late = Observation(text='Late', timestamp=ts)
+    session.add(late)
+    session.commit()
+    conn = vec_connection(db_path)
+    conn.execute("UPDATE observations SET embedded = NULL")
+    conn.commit()
+    assert sync.count_items_to_embed(conn) == 1
+    assert [item[1] for page in sync.iter_items_to_embed(conn) for item in page] == [late.id]
+    conn.close()
+    session.close()
@@ -0,0 +1,88 @@
+import sys
+import pytest
+from types import SimpleNamespace
+import tokens
+import ratelimit
+from tokens import heuristic_count, count_tokens, set_counter, get_counter
+
+
+@pytest.fixture(autouse=True)
+def restore_counter():
+    previous = tokens._counter
+    previous_calibration = tokens._calibration
+    tokens._calibration = 1.0
+    yield
+    tokens._counter = previous
+    tokens._calibration = previous_calibration
+
+
+def test_heuristic_empty():
+    assert heuristic_count('') == 0
+
+
+def test_heuristic_english_words_about_one_token_each():
+    text = 'the user prefers dark mode in all of their apps'
+    assert heuristic_count(text) == len(text.split())
+
+
+def test_heuristic_counts_more_for_code_than_chars_suggest():
+    code = 'if (x[0] != y[1]) { return {"a": 1}; }'
+    assert heuristic_count(code) > len(code) // 4
+
+
+def test_heuristic_counts_cjk_per_character():
+    text = '東京は日本の首都です'
+    assert heuristic_count(text) >= len(text) - 1
+
+
+def test_heuristic_splits_long_numbers():
+    assert heuristic_count('123456789') == 3
+
+
+def test_set_counter_is_pluggable():
+    set_counter(lambda text: 42)
+    assert count_tokens('anything') == 42
+
+
+def test_calibrate_adjusts_heuristic():
+    set_counter(heuristic_count)
+    before = heuristic_count('one two three four five six seven eight nine ten')
+    for _ in range(50):
+        tokens.calibrate(before, before * 2)
+    after = heuristic_count('one two three four five six seven eight nine ten')
+    assert after > before
+    assert tokens._calibration <= tokens.CALIBRATION_MAX
+
+
+def test_calibrate_ignored_for_bpe_counter():
+    set_counter(lambda text: len(text))
+    tokens.calibrate(10, 20)
+    assert tokens._calibration == 1.0
+
+
+def test_heuristic_env_forces_fallback(monkeypatch):
+    monkeypatch.setenv('PYRAMID_TOKENIZER', 'heuristic')
+    assert tokens.load_bpe_counter() is None
+
+
+def test_failed_download_is_remembered(tmp_path, monkeypatch):
+    attempts = []
+    
+    def get_encoding(name):
+        attempts.append(name)
+        raise OSError('offline')
+    
+    monkeypatch.delenv('PYRAMID_TOKENIZER', raising=False)
+    monkeypatch.setenv('TIKTOKEN_CACHE_DIR', str(tmp_path))
+    monkeypatch.setitem(sys.modules, 'tiktoken', SimpleNamespace(get_encoding=get_encoding))
+    assert tokens.load_bpe_counter() is None
+    assert tokens.load_bpe_counter() is None
+    assert attempts == [tokens.ENCODING_NAME]
+    assert (tmp_path / f'{tokens.ENCODING_NAME}.unavailable').exists()
+
+
+def test_rate_limit_estimates_do_not_load_tiktoken():
+    tokens._counter = None
+    chat = {'messages': [{'role': 'user', 'content': 'hello there'}]}
+    assert ratelimit.estimate_prompt_tokens(chat) == heuristic_count('hello there') + ratelimit.MESSAGE_OVERHEAD_TOKENS
+    assert tokens._counter is None
@@ -0,0 +1,92 @@
+import sqlite3
+import pytest
+from types import SimpleNamespace
+import usage
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    usage.reset_usage()
+    yield
+    usage.reset_usage()
+
+
+def test_record_usage_by_stage():
+    usage.record_usage('assign', SimpleNamespace(
+        prompt_tokens=2000, completion_tokens=50,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=1536)
+    ))
+    usage.record_usage('assign', {'prompt_tokens': 2000, 'completion_tokens': 50, 'prompt_tokens_details': {'cached_tokens': 0}})
+    usage.record_usage('assign', None, local_hit=True)
+    
+    stats = usage.usage_by_stage()['assign']
+    assert stats['calls'] == 2
+    assert stats['local_hits'] == 1
+    assert stats['prompt_tokens'] == 4000
+    assert stats['cached_tokens'] == 1536
+    assert stats['cached_rate'] == pytest.approx(0.384)
+
+
+def test_missing_details_count_as_uncached():
+    usage.record_usage('embed', SimpleNamespace(prompt_tokens=10, total_tokens=10))
+    assert usage.usage_by_stage()['embed']['cached_tokens'] == 0
+
+
+def test_format_usage():
+    usage.record_usage('summarize', {'prompt_tokens': 100, 'prompt_tokens_details': {'cached_tokens': 50}})
+    assert usage.format_usage(usage.usage_by_stage()) == 'summarize 50/100 (50%)'
+
+
+def test_ledger_records_calls_and_aggregates(tmp_path):
+    from db import init_db, get_session
+    db_path = tmp_path / 'pyramid.db'
+    init_db(str(db_path))
+    usage.enable_ledger(db_path)
+    try:
+        for latency in (0.1, 0.2, 0.3, 0.4):
+            usage.record_call('extract', 'gpt-4.1-mini', 'chat', {'prompt_tokens': 100, 'completion_tokens': 10}, latency, retries=1)
+        usage.record_call('extract', 'gpt-4.1-mini', 'chat', outcome='cached')
+        usage.record_call('embed', 'text-embedding-3-small', 'embedding', outcome='error', error='RateLimitError')
+        usage.record_call('summarize', 'gpt-4.1-mini', 'chat', {'prompt_tokens': 50}, 0.1, saved_tokens=400)
+        assert usage.flush_calls() == 7
+    finally:
+        usage.disable_ledger()
+    
+    session = get_session(str(db_path))
+    rows = {row['stage']: row for row in usage.call_stats(session, 'stage')}
+    assert rows['extract']['calls'] == 5
+    assert rows['extract']['cached'] == 1
+    assert rows['extract']['retries'] == 4
+    assert rows['extract']['prompt_tokens'] == 400
+    assert rows['extract']['p50_ms'] == pytest.approx(200)
+    assert rows['extract']['p95_ms'] == pytest.approx(400)
+    assert rows['embed']['errors'] == 1
+    assert rows['summarize']['saved_tokens'] == 400
+    assert usage.usage_by_stage()['summarize']['saved_tokens'] == 400
+    
+    by_day = usage.call_stats(session, 'day')
+    assert len(by_day) == 1 and by_day[0]['calls'] == 7
+    session.close()
+
+
+def test_ledger_flush_skips_a_database_without_the_ledger(tmp_path):
+    db_path = tmp_path / 'pyramid.db'
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE observations (id INTEGER PRIMARY KEY, text TEXT)")
+    conn.close()
+    usage.enable_ledger(db_path)
+    try:
+        usage.record_call('search', 'gpt-4.1-mini', 'chat', {'prompt_tokens': 10}, 0.1)
+        assert usage.flush_calls() == 0
+    finally:
+        usage.disable_ledger()
+    
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'llm_calls'").fetchone() is None
+    conn.close()
+
+
+def test_percentile():
+    assert usage.percentile([], 50) is None
+    assert usage.percentile([5, 1, 3], 50) == 3
+    assert usage.percentile(list(range(1, 101)), 95) == 95
@@ -0,0 +1,144 @@
+import os
+import re
+import math
+import time
+import threading
+from pathlib import Path
+
+ENCODING_NAME = 'o200k_base'
+TIKTOKEN_CACHE_DIR = Path.home() / '.cache' / 'pyramid' / 'tiktoken'
+# tiktoken downloads the BPE file on first use without a timeout. A failed or
+# slow download falls back to the heuristic and is remembered for a day, so
+# every new process doesn't try again first.
+DOWNLOAD_TIMEOUT = 10
+FALLBACK_RETRY_SECONDS = 24 * 3600
+
+CALIBRATION_MIN = 0.5
+CALIBRATION_MAX = 2.0
+CALIBRATION_WEIGHT = 0.1
+
+_PIECE_RE = re.compile(
+    r"[A-Za-z]+"
+    r"|[0-9]+"
+    r"|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]"
+    r"|[^\x00-\x7f\s]+"
+    r"|\n+|[ \t]+"
+    r"|[^\sA-Za-z0-9]+"
+)
+
+_lock = threading.Lock()
+_counter = None
+_calibration = 1.0
+
+
+def heuristic_count(text):
+    if not text:
+        return 0
+    total = 0.0
+    prev_space = False
+    for match in _PIECE_RE.finditer(text):
+        piece = match.group()
+        first = piece[0]
+        if first == ' ' or first == '\t':
+            if len(piece) > 1:
+                total += 1
+            prev_space = True
+            continue
+        if first == '\n':
+            total += 1
+        elif first.isascii() and first.isalpha():
+            total += 1 if len(piece) <= 7 else math.ceil(len(piece) / 4.5)
+        elif first.isdigit():
+            total += math.ceil(len(piece) / 3)
+        elif not first.isascii():
+            total += 1 if len(piece) == 1 else math.ceil(len(piece) / 2.5)
+        else:
+            total += math.ceil(len(piece) * 0.6)
+            if prev_space:
+                total += 0.2
+        prev_space = False
+    return max(1, round(total * _calibration))
+
+
+def calibrate(estimated, actual):
+    global _calibration
+    # Estimates come from rough_count, so calibrate unless a BPE counter is loaded
+    if estimated <= 0 or actual <= 0 or _counter not in (None, heuristic_count):
+        return
+    ratio = actual / (estimated / _calibration)
+    with _lock:
+        updated = (1 - CALIBRATION_WEIGHT) * _calibration + CALIBRATION_WEIGHT * ratio
+        _calibration = min(CALIBRATION_MAX, max(CALIBRATION_MIN, updated))
+
+
+def load_bpe_counter(encoding_name=ENCODING_NAME):
+    if os.environ.get('PYRAMID_TOKENIZER') == 'heuristic':
+        return None
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    os.environ.setdefault('TIKTOKEN_CACHE_DIR', str(TIKTOKEN_CACHE_DIR))
+    marker = Path(os.environ['TIKTOKEN_CACHE_DIR']) / f'{encoding_name}.unavailable'
+    try:
+        if time.time() - marker.stat().st_mtime < FALLBACK_RETRY_SECONDS:
+            return None
+    except OSError:
+        pass
+    
+    loaded = {}
+    
+    def load():
+        try:
+            loaded['encoding'] = tiktoken.get_encoding(encoding_name)
+            marker.unlink(missing_ok=True)
+        except Exception:
+            pass
+    
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+    thread.join(DOWNLOAD_TIMEOUT)
+    encoding = loaded.get('encoding')
+    if encoding is None:
+        try:
+            marker.parent.mkdir(parents=True, exist_ok=True)
+            marker.touch()
+        except OSError:
+            pass
+        return None
+
+    def count(text):
+        if not text:
+            return 0
+        return len(encoding.encode(text, disallowed_special=()))
+
+    count.encoding = encoding_name
+    return count
+
+
+def get_counter():
+    global _counter
+    if _counter is None:
+        with _lock:
+            if _counter is None:
+                _counter = load_bpe_counter() or heuristic_count
+    return _counter
+
+
+def set_counter(counter):
+    global _counter
+    _counter = counter
+
+
+def is_heuristic():
+    return get_counter() is heuristic_count
+
+
+def count_tokens(text):
+    return get_counter()(text)
+
+
+def rough_count(text):
+    # For estimates that don't justify loading tiktoken (rate-limit
+    # reservations): the loaded counter if there is one, else the heuristic
+    return (_counter or heuristic_count)(text)
@@ -0,0 +1,209 @@
+import math
+import atexit
+import sqlite3
+import threading
+from datetime import datetime, UTC
+
+_lock = threading.Lock()
+_stages = {}
+_ledger = None
+
+LEDGER_COLUMNS = (
+    'stage', 'model', 'kind', 'prompt_tokens', 'completion_tokens', 'cached_tokens',
+    'latency_ms', 'retries', 'outcome', 'error', 'created_at', 'saved_tokens',
+)
+
+
+def _field(obj, name):
+    if obj is None:
+        return None
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def _tokens(obj, name):
+    value = _field(obj, name)
+    return value if isinstance(value, int) else 0
+
+
+def cached_tokens(usage):
+    return _tokens(_field(usage, 'prompt_tokens_details'), 'cached_tokens')
+
+
+def _stage_totals(stage):
+    return _stages.setdefault(stage or 'other', {
+        'calls': 0,
+        'local_hits': 0,
+        'prompt_tokens': 0,
+        'cached_tokens': 0,
+        'completion_tokens': 0,
+        'saved_tokens': 0,
+    })
+
+
+def record_usage(stage, usage, local_hit=False, saved_tokens=0):
+    # saved_tokens: prompt tokens avoided by sending a cheaper request than
+    # the default one (incremental summary patches)
+    with _lock:
+        totals = _stage_totals(stage)
+        if local_hit:
+            totals['local_hits'] += 1
+            return
+        totals['calls'] += 1
+        totals['saved_tokens'] += saved_tokens
+        if usage is not None:
+            totals['prompt_tokens'] += _tokens(usage, 'prompt_tokens')
+            totals['completion_tokens'] += _tokens(usage, 'completion_tokens')
+            totals['cached_tokens'] += cached_tokens(usage)
+
+
+def usage_by_stage():
+    with _lock:
+        result = {}
+        for stage, totals in _stages.items():
+            entry = dict(totals)
+            entry['cached_rate'] = entry['cached_tokens'] / entry['prompt_tokens'] if entry['prompt_tokens'] else 0.0
+            result[stage] = entry
+        return result
+
+
+def reset_usage():
+    with _lock:
+        _stages.clear()
+
+
+def format_usage(stats):
+    parts = []
+    for stage, s in sorted(stats.items()):
+        if not s['calls']:
+            continue
+        parts.append(f"{stage} {s['cached_tokens']}/{s['prompt_tokens']} ({s['cached_rate']:.0%})")
+    return ', '.join(parts)
+
+
+class CallLedger:
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.pending = []
+        self.columns = None
+        self._lock = threading.Lock()
+
+    def add(self, row):
+        with self._lock:
+            self.pending.append(row)
+
+    def flush(self):
+        with self._lock:
+            rows, self.pending = self.pending, []
+        if not rows:
+            return 0
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            if self.columns is None:
+                # A database not yet migrated by init_db may lack newer columns,
+                # or the whole table if it predates the ledger (search never
+                # runs init_db); those rows are dropped.
+                existing = {row[1] for row in conn.execute("PRAGMA table_info(llm_calls)")}
+                if not existing:
+                    return 0
+                self.columns = [c for c in LEDGER_COLUMNS if c in existing]
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO llm_calls ({', '.join(self.columns)}) VALUES ({', '.join('?' * len(self.columns))})",
+                    [[row[c] for c in self.columns] for row in rows]
+                )
+        finally:
+            conn.close()
+        return len(rows)
+
+
+def enable_ledger(db_path):
+    global _ledger
+    if _ledger is not None and _ledger.db_path == str(db_path):
+        return _ledger
+    if _ledger is not None:
+        _ledger.flush()
+    else:
+        atexit.register(flush_calls)
+    _ledger = CallLedger(db_path)
+    return _ledger
+
+
+def disable_ledger():
+    global _ledger
+    if _ledger is not None:
+        _ledger.flush()
+    _ledger = None
+
+
+def flush_calls():
+    if _ledger is None:
+        return 0
+    return _ledger.flush()
+
+
+def record_call(stage, model, kind, usage=None, latency=None, retries=0, outcome='ok', error=None, saved_tokens=0):
+    saved_tokens = max(0, saved_tokens) if outcome == 'ok' else 0
+    record_usage(stage, usage, local_hit=outcome == 'cached', saved_tokens=saved_tokens)
+    if _ledger is None:
+        return
+    _ledger.add({
+        'stage': stage or 'other',
+        'model': model,
+        'kind': kind,
+        'prompt_tokens': _tokens(usage, 'prompt_tokens'),
+        'completion_tokens': _tokens(usage, 'completion_tokens'),
+        'cached_tokens': cached_tokens(usage),
+        'latency_ms': latency * 1000 if latency is not None else None,
+        'retries': retries or 0,
+        'outcome': outcome,
+        'error': error,
+        'created_at': datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S.%f'),
+        'saved_tokens': saved_tokens,
+    })
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def call_stats(session, group_by='stage', since=None):
+    from db import LLMCall
+    query = session.query(LLMCall)
+    if since is not None:
+        query = query.filter(LLMCall.created_at >= since)
+
+    groups = {}
+    for call in query.order_by(LLMCall.id).yield_per(1000):
+        key = call.stage if group_by == 'stage' else call.created_at.strftime('%Y-%m-%d')
+        g = groups.setdefault(key, {
+            'calls': 0, 'cached': 0, 'errors': 0, 'retries': 0,
+            'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0, 'saved_tokens': 0, 'latencies': [],
+        })
+        g['calls'] += 1
+        g['retries'] += call.retries or 0
+        if call.outcome == 'cached':
+            g['cached'] += 1
+            continue
+        if call.outcome == 'error':
+            g['errors'] += 1
+        g['prompt_tokens'] += call.prompt_tokens or 0
+        g['completion_tokens'] += call.completion_tokens or 0
+        g['cached_tokens'] += call.cached_tokens or 0
+        g['saved_tokens'] += call.saved_tokens or 0
+        if call.latency_ms is not None:
+            g['latencies'].append(call.latency_ms)
+
+    rows = []
+    for key in sorted(groups):
+        g = groups[key]
+        latencies = g.pop('latencies')
+        g[group_by] = key
+        g['cached_rate'] = g['cached_tokens'] / g['prompt_tokens'] if g['prompt_tokens'] else 0.0
+        g['p50_ms'] = percentile(latencies, 50)
+        g['p95_ms'] = percentile(latencies, 95)
+        rows.append(g)
+    return rows